@@ -1,26 +1,3632 @@
-import tkinter as tk
-import ttkbootstrap as ttk
-from ttkbootstrap.constants import *
-from tkinter import filedialog, messagebox
-from moviepy.editor import VideoFileClip, CompositeAudioClip, ImageClip, CompositeVideoClip
-from moviepy.video.fx.all import crop, resize, speedx, blackwhite, rotate, lum_contrast
-from moviepy.audio.fx.all import volumex
-from moviepy.audio.io.AudioFileClip import AudioFileClip
+try:
+    import tkinter as tk
+    import ttkbootstrap as ttk
+    from ttkbootstrap.constants import *
+    from tkinter import filedialog, messagebox
+    from PIL import Image, ImageTk
+except ImportError:
+    # Render servers run `main.py batch` without Tk installed
+    tk = ttk = filedialog = messagebox = Image = ImageTk = None
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import multiprocessing
+import collections
+import contextlib
+import functools
+import argparse
 import threading
+import sqlite3
+import signal
+import queue
+import subprocess
+import tempfile
+import hashlib
+import zipfile
+import shutil
+import bisect
+import glob
+import math
+import csv
+import struct
+import json
+import re
+import time
+import sys
 import os
-import cv2
-import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage, peak RSS is reported as None there
+    resource = None
+
+# Media stack. numpy, OpenCV, proglog and MoviePy take most of the startup
+# time, so they are imported on first use: load_media_stack() binds the names
+# below as module globals. The GUI calls it on a background thread once the
+# window is up, RenderContext and the command line call it before rendering,
+# and np/cv2 load it themselves on first attribute access.
+MEDIA_STACK_LOCK = threading.Lock()
+MEDIA_STACK_READY = threading.Event()
+
+
+class LazyModule:
+    # Placeholder for np/cv2 until load_media_stack() replaces it with the real module
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        load_media_stack()
+        return getattr(sys.modules[self.name], attr)
+
+
+np = LazyModule("numpy")
+cv2 = LazyModule("cv2")
+
+
+def load_media_stack():
+    global np, cv2, proglog, VideoFileClip, VideoClip, ImageClip, CompositeVideoClip, concatenate_videoclips
+    global AudioClip, CompositeAudioClip, AudioFileClip, FFMPEG_VideoWriter
+    global crop, resize, speedx, blackwhite, rotate, lum_contrast, volumex, audio_fadein, audio_fadeout, ProgressLogger
+    if MEDIA_STACK_READY.is_set():
+        return
+    with MEDIA_STACK_LOCK:
+        if MEDIA_STACK_READY.is_set():
+            return
+        import numpy as np
+        import cv2
+        import proglog
+        # The MoviePy modules themselves: moviepy.editor would also import IPython
+        # and every effect, about half of the import time
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+        from moviepy.video.VideoClip import VideoClip, ImageClip
+        from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+        from moviepy.video.compositing.concatenate import concatenate_videoclips
+        from moviepy.audio.AudioClip import AudioClip, CompositeAudioClip
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
+        from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+        from moviepy.video.fx.crop import crop
+        from moviepy.video.fx.resize import resize
+        from moviepy.video.fx.speedx import speedx
+        from moviepy.video.fx.blackwhite import blackwhite
+        from moviepy.video.fx.rotate import rotate
+        from moviepy.video.fx.lum_contrast import lum_contrast
+        from moviepy.audio.fx.volumex import volumex
+        from moviepy.audio.fx.audio_fadein import audio_fadein
+        from moviepy.audio.fx.audio_fadeout import audio_fadeout
+
+        class ProgressLogger(proglog.ProgressBarLogger):
+            # proglog logger for MoviePy's write_audiofile/iter_frames/write_videofile,
+            # forwards every bar update to the RenderContext
+            def __init__(self, context):
+                super().__init__()
+                self.context = context
+
+            def bars_callback(self, bar, attr, value, old_value=None):
+                self.context.check_cancelled()
+                total = self.bars[bar]["total"]
+                if attr == "index" and total:
+                    self.context.progress(value / total)
+
+        MEDIA_STACK_READY.set()
+
+# Render engine. Everything below up to VideoCutterApp works on plain job dicts
+# and never touches Tk, so it can run in batch workers on a headless server.
+
+JOB_DEFAULTS = {
+    "cut": {
+        "start_time": 0,
+        "end_time": None,
+        "width": 1080,
+        "height": 1920,
+        "video_volume": 1.0,
+        "audio_volume": 1.0,
+        "video_speed": 1.0,
+        "video_rotation": 0,
+        "contrast": 0.0,
+        "brightness": 0.0,
+        "framerate": 60,
+        "video_bitrate": "12000",
+        "audio_bitrate": "192",
+        "audio_file": None,
+        "music_fade_in": 0.0,
+        "music_fade_out": 0.0,
+        "music_duck": 1.0,
+        "music_duck_threshold": 0.05,
+        "watermark_text": None,
+        "watermark_position": "Top Left",
+        "watermark_image": None,
+        "watermark_opacity": 0.4,
+        "watermark_scale": 0.2,
+        "outputs": None,
+        "ranges": None,
+        "ranges_file": None,
+        "reel": False,
+        "crossfade": 0.0,
+        "frame_skipping": True,
+        "threads": None,
+        "frame_workers": None,
+        "frame_ring": None,
+        "smart_cut": True,
+        "backend": "moviepy",
+    },
+    "compress": {
+        "width": 1080,
+        "height": 1920,
+        "framerate": 60,
+        "video_bitrate": 4000,
+        "audio_bitrate": 256,
+        "volume": 1.0,
+        "tone": 1.0,
+        "frame_skipping": True,
+        "threads": None,
+        "frame_workers": None,
+        "frame_ring": None,
+        "segment_seconds": None,
+        "segment_workers": None,
+        "segment_rate_control": "complexity",
+        "target_size_mb": None,
+        "two_pass": False,
+    },
+    "extract_audio": {
+        "audio_format": "mp3",
+        "stream_copy": True,
+        "skip_existing": False,
+    },
+}
+
+
+def normalize_job(job):
+    job_type = job.get("type", "cut")
+    if job_type not in JOB_DEFAULTS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    if not job.get("input_file"):
+        raise ValueError("Job has no input_file.")
+
+    spec = {"type": job_type, "name": None, "output_dir": ".", "output_file": None, "metrics_file": None, "render_cache": True}
+    spec.update(JOB_DEFAULTS[job_type])
+    spec.update(job)
+    if spec["name"] is None:
+        spec["name"] = os.path.basename(spec["input_file"])
+    return spec
+
+
+def job_output_path(spec, default_name):
+    if spec["output_file"]:
+        return spec["output_file"]
+    return os.path.join(spec["output_dir"], default_name)
+
+
+RENDER_STAGES = ("cache", "probe", "open", "decode", "transform", "watermark", "audio mix", "encode", "mux")
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process and of its finished child
+    # processes (the ffmpeg encoders). ru_maxrss is KB on Linux, bytes on macOS.
+    if resource is None:
+        return None, None
+    unit = 1 if sys.platform == "darwin" else 1024
+    return tuple(resource.getrusage(who).ru_maxrss * unit / 2**20 for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+
+class RenderMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = collections.defaultdict(float)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - started
+
+    def record(self, spec, output_files, frames):
+        wall_time = time.perf_counter() - self.started
+        peak_rss, peak_child_rss = peak_rss_mb()
+        stages = {name: round(self.stages[name], 4) for name in RENDER_STAGES if name in self.stages}
+        return {
+            "name": spec["name"],
+            "type": spec["type"],
+            "input_file": spec["input_file"],
+            "output_files": output_files,
+            "frames": frames,
+            "wall_time": wall_time,
+            "fps": frames / wall_time if frames and wall_time > 0 else None,
+            "stages": stages,
+            "peak_rss_mb": peak_rss,
+            "peak_child_rss_mb": peak_child_rss,
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class RenderContext:
+    # Handed to every renderer: the logger to pass to MoviePy, the per-stage
+    # timers, and progress reporting. Renderers split the 0..1 range into
+    # spans (e.g. audio 0-0.1, frames 0.1-1); progress() is relative to the
+    # current span and on_progress gets (fraction, eta_seconds, label).
+    # cancel() may be called from any thread: it kills the watched ffmpeg
+    # processes and the render raises RenderCancelled at its next check.
+    PROGRESS_INTERVAL = 0.1
+
+    def __init__(self, logger="bar", on_progress=None):
+        load_media_stack()
+        self.metrics = RenderMetrics()
+        self.on_progress = on_progress
+        self.logger = ProgressLogger(self) if on_progress is not None else logger
+        self.section_range = (0.0, 1.0)
+        self.span_range = (0.0, 1.0)
+        self.label = ""
+        self.fraction = 0.0
+        self.last_report = 0.0
+        self.cancelled = threading.Event()
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def watch(self, proc):
+        with self.lock:
+            self.processes.add(proc)
+        if self.cancelled.is_set():
+            proc.kill()
+
+    def unwatch(self, proc):
+        with self.lock:
+            self.processes.discard(proc)
+
+    def cancel(self):
+        self.cancelled.set()
+        with self.lock:
+            processes = list(self.processes)
+        for proc in processes:
+            if proc.poll() is None:
+                proc.kill()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise RenderCancelled("Render cancelled.")
+
+    def section(self, start, end):
+        # Nests the spans that follow into [start, end], e.g. one range of a cut list
+        self.section_range = (start, end)
+
+    def span(self, start, end, label):
+        low, high = self.section_range
+        self.span_range = (low + (high - low) * start, low + (high - low) * end)
+        self.label = label
+        self.progress(0.0)
+
+    def progress(self, fraction):
+        start, end = self.span_range
+        self.fraction = max(self.fraction, start + (end - start) * min(max(fraction, 0.0), 1.0))
+        if self.on_progress is None:
+            return
+        now = time.perf_counter()
+        if now - self.last_report < self.PROGRESS_INTERVAL and fraction < 1.0:
+            return
+        self.last_report = now
+        elapsed = now - self.metrics.started
+        eta = elapsed * (1 - self.fraction) / self.fraction if self.fraction > 0.01 else None
+        self.on_progress(self.fraction, eta, self.label)
+
+
+MIX_FPS = 48000
+
+
+def decoded_pcm(audio_file, fps=MIX_FPS, nchannels=2):
+    # Decode and resample once into the cache; later mixes of the same song
+    # memory-map the float32 PCM instead of decoding it again
+    key = f"{file_identity(audio_file)}|{fps}|{nchannels}"
+    path = cache_file("pcm", key, ".f32")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        run_ffmpeg(["-i", audio_file, "-vn", "-ac", nchannels, "-ar", fps, "-f", "f32le", tmp_path])
+        os.replace(tmp_path, path)
+    if os.path.getsize(path) == 0:
+        return np.zeros((0, nchannels), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r").reshape(-1, nchannels)
+
+
+class MusicMixer:
+    # make_frame for an AudioClip that adds the background music to the
+    # source audio. MoviePy asks for one block of sample times at a time; each
+    # block slices the memory-mapped music, so memory stays flat for any
+    # length, and gain, fades, ducking and clipping happen in one vector pass.
+
+    DUCK_WINDOW = 480  # 10 ms at 48 kHz
+
+    def __init__(self, source_audio, music, duration, volume=1.0, fade_in=0.0, fade_out=0.0, duck=1.0, duck_threshold=0.05):
+        self.source_audio = source_audio
+        self.music = music
+        self.duration = duration
+        self.volume = volume
+        self.fade_in = fade_in
+        self.fade_out = fade_out
+        self.duck = duck
+        self.duck_threshold = duck_threshold
+        self.last_duck_gain = 1.0
+
+    def music_block(self, first_sample, count):
+        block = np.zeros((count, self.music.shape[1]), dtype=np.float32)
+        available = self.music[max(first_sample, 0):max(first_sample + count, 0)]
+        offset = max(-first_sample, 0)
+        block[offset:offset + len(available)] = available
+        return block
+
+    def duck_gain(self, source):
+        # Source loudness per 10 ms window, music gain ramps between windows
+        count = len(source)
+        windows = max(1, count // self.DUCK_WINDOW)
+        trimmed = source[:windows * self.DUCK_WINDOW] if count >= self.DUCK_WINDOW else source
+        rms = np.sqrt(np.mean(np.square(trimmed.reshape(windows, -1)), axis=1))
+        targets = np.where(rms > self.duck_threshold, self.duck, 1.0)
+        centers = (np.arange(windows) + 0.5) * (count / windows)
+        gain = np.interp(np.arange(count), np.concatenate(([0.0], centers)), np.concatenate(([self.last_duck_gain], targets)))
+        self.last_duck_gain = targets[-1]
+        return gain
+
+    def __call__(self, t):
+        tt = np.atleast_1d(np.asarray(t, dtype=np.float64))
+        first_sample = int(round(tt[0] * MIX_FPS))
+        mix = self.music_block(first_sample, len(tt))
+
+        gain = np.full(len(tt), self.volume, dtype=np.float64)
+        if self.fade_in > 0:
+            gain *= np.clip(tt / self.fade_in, 0.0, 1.0)
+        if self.fade_out > 0:
+            gain *= np.clip((self.duration - tt) / self.fade_out, 0.0, 1.0)
+
+        if self.source_audio is not None:
+            source = np.asarray(self.source_audio.get_frame(tt), dtype=np.float32).reshape(len(tt), -1)
+            if self.duck != 1.0:
+                gain *= self.duck_gain(source)
+            mix *= gain[:, None].astype(np.float32)
+            mix += source
+        else:
+            mix *= gain[:, None].astype(np.float32)
+        np.clip(mix, -1.0, 1.0, out=mix)
+        return mix if np.ndim(t) else mix[0]
+
+
+def process_audio(subclip, audio_file, audio_volume, fade_in=0.0, fade_out=0.0, duck=1.0, duck_threshold=0.05):
+    # Without a video audio track the music is used on its own
+    music = decoded_pcm(audio_file)
+    mixer = MusicMixer(subclip.audio, music, subclip.duration, audio_volume, fade_in, fade_out, duck, duck_threshold)
+    mixed_audio = AudioClip(make_frame=mixer, duration=subclip.duration, fps=MIX_FPS)
+    return subclip.set_audio(mixed_audio)
+
+
+WATERMARK_MARGIN = 20
+
+# Pre-rendered watermark: the (x0, y0, x1, y1) box it covers in the frame, and
+# the per-pixel (1 - alpha) and alpha * colour terms of the blend over that box.
+WatermarkSprite = collections.namedtuple("WatermarkSprite", ["x0", "y0", "x1", "y1", "inv_alpha", "premultiplied"])
+
+
+def make_watermark_sprite(rgb, alpha, x, y, frame_width, frame_height):
+    # Trim fully transparent borders, then clip the box to the frame
+    rows = np.flatnonzero(alpha.any(axis=1))
+    cols = np.flatnonzero(alpha.any(axis=0))
+    if rows.size == 0:
+        return None
+    top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    x0, y0 = max(x + left, 0), max(y + top, 0)
+    x1, y1 = min(x + right, frame_width), min(y + bottom, frame_height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    alpha = alpha[y0 - y:y1 - y, x0 - x:x1 - x, None].astype(np.float32)
+    rgb = rgb[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.float32)
+    # +0.5 so the truncating uint8 cast in blend_watermark rounds like cv2.addWeighted
+    premultiplied = rgb * alpha + 0.5
+    inv_alpha = 1.0 - alpha
+    premultiplied.flags.writeable = False
+    inv_alpha.flags.writeable = False
+    return WatermarkSprite(int(x0), int(y0), int(x1), int(y1), inv_alpha, premultiplied)
+
+
+@functools.lru_cache(maxsize=64)
+def text_watermark_sprite(text, frame_width, frame_height, position="Top Left", opacity=0.4):
+    font, font_scale, thickness = cv2.FONT_HERSHEY_SIMPLEX, 1, 2
+    (text_width, text_height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
+    pad = thickness
+    coverage = np.zeros((text_height + baseline + 2 * pad, text_width + 2 * pad), dtype=np.uint8)
+    cv2.putText(coverage, text, (pad, text_height + pad), font, font_scale, 255, thickness, cv2.LINE_AA)
+
+    # Text origins (bottom-left of the text) as the old per-frame putText used them
+    origins = {
+        "Top Left": (WATERMARK_MARGIN, 40),
+        "Top Right": (frame_width - WATERMARK_MARGIN - text_width, 40),
+        "Bottom Left": (WATERMARK_MARGIN, frame_height - WATERMARK_MARGIN),
+        "Bottom Right": (frame_width - WATERMARK_MARGIN - text_width, frame_height - WATERMARK_MARGIN),
+        "Center": ((frame_width - text_width) // 2, (frame_height + text_height) // 2),
+    }
+    x, y = origins.get(position, origins["Top Left"])  # Default to "Top Left" if position is not recognized
+    white = np.full(coverage.shape + (3,), 255, dtype=np.uint8)
+    return make_watermark_sprite(white, coverage / 255.0 * opacity, x - pad, y - text_height - pad, frame_width, frame_height)
+
+
+@functools.lru_cache(maxsize=64)
+def image_watermark_sprite(image_file, mtime, frame_width, frame_height, position="Top Left", opacity=0.4, scale=0.2):
+    # mtime is only part of the cache key, so an edited logo is picked up
+    image = cv2.imread(image_file, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Could not read watermark image: {image_file}")
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        alpha = image[:, :, 3] / 255.0
+    else:
+        alpha = np.ones(image.shape[:2])
+    rgb = cv2.cvtColor(image[:, :, :3], cv2.COLOR_BGR2RGB)
+
+    # Scale the logo to a fraction of the frame width
+    logo_width = max(1, int(frame_width * scale))
+    logo_height = max(1, round(image.shape[0] * logo_width / image.shape[1]))
+    rgb = cv2.resize(rgb, (logo_width, logo_height), interpolation=cv2.INTER_AREA)
+    alpha = cv2.resize(alpha, (logo_width, logo_height), interpolation=cv2.INTER_AREA)
+
+    right = frame_width - WATERMARK_MARGIN - logo_width
+    bottom = frame_height - WATERMARK_MARGIN - logo_height
+    corners = {
+        "Top Left": (WATERMARK_MARGIN, WATERMARK_MARGIN),
+        "Top Right": (right, WATERMARK_MARGIN),
+        "Bottom Left": (WATERMARK_MARGIN, bottom),
+        "Bottom Right": (right, bottom),
+        "Center": ((frame_width - logo_width) // 2, (frame_height - logo_height) // 2),
+    }
+    x, y = corners.get(position, corners["Top Left"])
+    return make_watermark_sprite(rgb, alpha * opacity, x, y, frame_width, frame_height)
+
+
+def watermark_sprites(frame_width, frame_height, text=None, image=None, position="Top Left", opacity=0.4, scale=0.2):
+    sprites = []
+    if image:
+        sprites.append(image_watermark_sprite(image, os.path.getmtime(image), frame_width, frame_height, position, opacity, scale))
+    if text:
+        sprites.append(text_watermark_sprite(text, frame_width, frame_height, position, opacity))
+    return [sprite for sprite in sprites if sprite is not None]
+
+
+def blend_watermark(frame, sprite):
+    # Blend in place, touching only the pixels under the watermark
+    roi = frame[sprite.y0:sprite.y1, sprite.x0:sprite.x1]
+    np.copyto(roi, roi * sprite.inv_alpha + sprite.premultiplied, casting="unsafe")
+
+
+def add_watermark(video_clip, text=None, image=None, position="Top Left", opacity=0.4, scale=0.2):
+    def add_watermark_to_frame(frame):
+        if not frame.flags.writeable:
+            # Frames straight from the reader are read-only buffers it keeps for reuse
+            frame = frame.copy()
+        h, w = frame.shape[:2]
+        for sprite in watermark_sprites(w, h, text, image, position, opacity, scale):
+            blend_watermark(frame, sprite)
+        return frame
+
+    return video_clip.fl_image(add_watermark_to_frame)
+
+
+def add_text_watermark(video_clip, text, position="Top Left"):
+    return add_watermark(video_clip, text=text, position=position)
+
+
+def lum_contrast_lut(lum=0.0, contrast=0.0, contrast_thr=127):
+    # Same math as moviepy.video.fx.lum_contrast, evaluated once for all 256 levels
+    levels = np.arange(256, dtype=np.float64)
+    corrected = levels + lum + contrast * (levels - float(contrast_thr))
+    return np.clip(corrected, 0, 255).astype(np.uint8)
+
+
+def center_crop_box(frame_width, frame_height, aspect_ratio):
+    # Largest centered box with the target aspect ratio, as (x0, y0, x1, y1)
+    if frame_width / frame_height > aspect_ratio:
+        crop_width = int(frame_height * aspect_ratio)
+        x0 = (frame_width - crop_width) // 2
+        return x0, 0, x0 + crop_width, frame_height
+    if frame_width / frame_height < aspect_ratio:
+        crop_height = int(frame_width / aspect_ratio)
+        y0 = (frame_height - crop_height) // 2
+        return 0, y0, frame_width, y0 + crop_height
+    return 0, 0, frame_width, frame_height
+
+
+class FrameTransform:
+    # crop + lum/contrast + resize + rotate by quarter turns in one pass per frame.
+    # Crops first (a view) so the colour math only runs on kept pixels, applies
+    # lum/contrast as a 256-entry LUT, resizes once into a reused buffer and
+    # rotates with a zero-copy np.rot90 view. The returned frame is only valid
+    # until the next call.
+
+    # width/height None skips crop and resize; crop_box (x0, y0, x1, y1)
+    # replaces the centered crop.
+
+    def __init__(self, width, height, rotation=0, brightness=0.0, contrast=0.0, crop_box=None):
+        if rotation % 90 != 0:
+            raise ValueError("FrameTransform only rotates by multiples of 90 degrees.")
+        self.width = width
+        self.height = height
+        self.crop_box = crop_box
+        self.quarter_turns = (rotation // 90) % 4
+        self.lut = lum_contrast_lut(brightness, contrast) if brightness != 0.0 or contrast != 0.0 else None
+        self._plans = {}
+        self._buffers = {}
+
+    def _plan(self, shape):
+        plan = self._plans.get(shape)
+        if plan is None:
+            frame_height, frame_width = shape[:2]
+            # Resize target in source orientation, rotated afterwards
+            if self.width is None:
+                size = (frame_width, frame_height)
+            elif self.quarter_turns % 2:
+                size = (self.height, self.width)
+            else:
+                size = (self.width, self.height)
+            if self.crop_box is not None:
+                x0, y0, x1, y1 = self.crop_box
+                x0, x1 = max(0, min(x0, frame_width)), max(0, min(x1, frame_width))
+                y0, y1 = max(0, min(y0, frame_height)), max(0, min(y1, frame_height))
+                if x0 >= x1 or y0 >= y1:
+                    raise ValueError(f"Crop box {self.crop_box} is outside the {frame_width}x{frame_height} frame.")
+            else:
+                x0, y0, x1, y1 = center_crop_box(frame_width, frame_height, size[0] / size[1])
+            if (x1 - x0, y1 - y0) == size:
+                interpolation = None
+            elif size[0] > x1 - x0 or size[1] > y1 - y0:
+                interpolation = cv2.INTER_LINEAR
+            else:
+                # For downsizing use area to prevent aliasing
+                interpolation = cv2.INTER_AREA
+            plan = (slice(y0, y1), slice(x0, x1), size, interpolation)
+            self._plans[shape] = plan
+        return plan
+
+    def _buffer(self, name, shape):
+        buffer = self._buffers.get((name, shape))
+        if buffer is None:
+            buffer = self._buffers[(name, shape)] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def __call__(self, frame):
+        rows, cols, size, interpolation = self._plan(frame.shape)
+        image = frame[rows, cols]
+        if self.lut is not None:
+            # Before the resize, like the old chain, since clipping doesn't commute with interpolation
+            image = cv2.LUT(image, self.lut, dst=self._buffer("lut", image.shape))
+        if interpolation is not None:
+            image = cv2.resize(image, size, dst=self._buffer("resize", (size[1], size[0]) + frame.shape[2:]), interpolation=interpolation)
+        if self.quarter_turns:
+            image = np.rot90(image, self.quarter_turns)
+        return image
+
+
+def ffmpeg_binary():
+    # Same binary MoviePy uses (imageio-ffmpeg unless FFMPEG_BINARY is set);
+    # only moviepy.config, so probing a file doesn't wait for the media stack
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_version(binary):
+    # First line of `ffmpeg -version`, e.g. "ffmpeg version 7.0.2-static ..."
+    stdout, _ = run_ffmpeg(["-version"], capture_stdout=True)
+    return stdout.decode("utf8", "replace").splitlines()[0]
+
+
+def encoder_versions():
+    # What a render depends on besides its settings and inputs
+    from moviepy.version import __version__ as moviepy_version
+    return {"ffmpeg": ffmpeg_version(ffmpeg_binary()), "moviepy": moviepy_version}
+
+
+def warm_up_media_stack():
+    load_media_stack()
+    ffmpeg_binary()
+
+
+def run_ffmpeg(args, loglevel="error", context=None, capture_stdout=False, progress_duration=None):
+    # Returns stderr, or (stdout bytes, stderr) with capture_stdout.
+    # With a RenderContext the process is killed when the render is cancelled,
+    # and with progress_duration ffmpeg's -progress output drives context.progress().
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", loglevel, "-y"]
+    if progress_duration:
+        cmd += ["-progress", "pipe:1", "-nostats"]
+    cmd += [str(a) for a in args]
+    popen_params = {"stdout": subprocess.PIPE if capture_stdout or progress_duration else subprocess.DEVNULL, "stderr": subprocess.PIPE}
+    if os.name == "nt":
+        popen_params["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
+    proc = subprocess.Popen(cmd, **popen_params)
+    if context is not None:
+        context.watch(proc)
+    try:
+        if progress_duration:
+            # Drain stderr on the side so a chatty ffmpeg can't block on a full pipe
+            stderr_chunks = []
+            stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+            stderr_reader.start()
+            for line in proc.stdout:
+                if line.startswith(b"out_time_us=") and line[12:].strip().isdigit():
+                    context.progress(int(line[12:]) / 1e6 / progress_duration)
+            proc.wait()
+            stderr_reader.join()
+            stdout, stderr = b"", b"".join(stderr_chunks)
+        else:
+            stdout, stderr = proc.communicate()
+        stderr = stderr.decode("utf8", errors="replace")
+    finally:
+        if context is not None:
+            context.unwatch(proc)
+    if context is not None:
+        context.check_cancelled()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {stderr.strip()[-500:]}")
+    return (stdout, stderr) if capture_stdout else stderr
+
+
+def cache_dir(*parts):
+    # Shared on-disk cache, CUTITOUT_CACHE_DIR overrides the per-user default
+    root = os.environ.get("CUTITOUT_CACHE_DIR")
+    if not root:
+        base = os.environ.get("LOCALAPPDATA") if os.name == "nt" else None
+        root = os.path.join(base or os.path.join(os.path.expanduser("~"), ".cache"), "cutitout")
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_identity(path):
+    # Cheap identity for cache keys: a changed size or mtime invalidates the entry
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def cache_file(kind, key, extension):
+    name = hashlib.sha1(key.encode("utf8")).hexdigest()
+    return os.path.join(cache_dir(kind), name + extension)
+
+
+def write_json_atomic(path, data):
+    # Batch workers share the cache, so never leave a half-written file behind
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def iter_mp4_boxes(data, offset=0, end=None):
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def find_mp4_box(data, box_type, start, end):
+    for found_type, payload_start, box_end in iter_mp4_boxes(data, start, end):
+        if found_type == box_type:
+            return payload_start, box_end
+    return None
+
+
+def read_mp4_keyframe_spacing(path):
+    # Average distance in frames between sync samples of the first video track,
+    # read from the MP4/MOV 'stss' box. Only the moov header is read, None for
+    # other containers or fragmented files.
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            size, box_type = struct.unpack(">I4s", header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                header_size = 16
+            if box_type == b"moov":
+                moov = f.read(size - header_size) if size else f.read()
+                break
+            if size < header_size:
+                return None
+            f.seek(size - header_size, os.SEEK_CUR)
+
+    for box_type, trak_start, trak_end in iter_mp4_boxes(moov):
+        if box_type != b"trak":
+            continue
+        mdia = find_mp4_box(moov, b"mdia", trak_start, trak_end)
+        hdlr = mdia and find_mp4_box(moov, b"hdlr", *mdia)
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        minf = find_mp4_box(moov, b"minf", *mdia)
+        stbl = minf and find_mp4_box(moov, b"stbl", *minf)
+        if not stbl:
+            return None
+        stsz = find_mp4_box(moov, b"stsz", *stbl)
+        sample_count = struct.unpack_from(">I", moov, stsz[0] + 8)[0] if stsz else 0
+        if sample_count == 0:
+            return None
+        stss = find_mp4_box(moov, b"stss", *stbl)
+        if stss is None:
+            return 1.0  # no sync sample table: every frame is a keyframe
+        entry_count = struct.unpack_from(">I", moov, stss[0] + 4)[0]
+        if entry_count < 2:
+            return float(sample_count)
+        first, = struct.unpack_from(">I", moov, stss[0] + 8)
+        last, = struct.unpack_from(">I", moov, stss[0] + 4 + 4 * entry_count)
+        return (last - first) / (entry_count - 1)
+    return None
+
+
+def read_media_info(path):
+    # `ffmpeg -i` only reads the container and stream headers
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", path]
+    popen_params = {"stdout": subprocess.DEVNULL, "stderr": subprocess.PIPE}
+    if os.name == "nt":
+        popen_params["creationflags"] = 0x08000000
+    stderr = subprocess.run(cmd, **popen_params).stderr.decode("utf8", errors="replace")
+    if "Duration:" not in stderr:
+        raise ValueError(f"Could not read media info from {path}: {stderr.strip()[-300:]}")
+
+    info = {
+        "duration": None, "bitrate": None,
+        "video_codec": None, "pix_fmt": None, "width": None, "height": None, "rotation": 0, "fps": None, "video_bitrate": None, "keyframe_interval": None,
+        "audio_codec": None, "audio_rate": None, "audio_channels": None, "audio_bitrate": None,
+    }
+    match = re.search(r"Duration: (\d+):(\d+):(\d+\.\d+)", stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    match = re.search(r"bitrate: (\d+) kb/s", stderr)
+    if match:
+        info["bitrate"] = int(match.group(1))
+
+    lines = [line.strip() for line in stderr.splitlines()]
+    video_line = None
+    for i, line in enumerate(lines):
+        if not line.startswith("Stream #"):
+            continue
+        if "Video:" in line and info["video_codec"] is None:
+            video_line = i
+            info["video_codec"] = re.search(r"Video: (\w+)", line).group(1)
+            match = re.search(r"Video: \w+[^,]*, (\w+)", line)
+            info["pix_fmt"] = match.group(1) if match else None
+            match = re.search(r" (\d{2,5})x(\d{2,5})[ ,]", line)
+            if match:
+                info["width"], info["height"] = int(match.group(1)), int(match.group(2))
+            match = re.search(r"([\d.]+) fps", line) or re.search(r"([\d.]+) tbr", line)
+            if match:
+                info["fps"] = float(match.group(1))
+            match = re.search(r"(\d+) kb/s", line)
+            info["video_bitrate"] = int(match.group(1)) if match else None
+        elif "Audio:" in line and info["audio_codec"] is None:
+            info["audio_codec"] = re.search(r"Audio: (\w+)", line).group(1)
+            match = re.search(r"(\d+) Hz, ([\w.()]+)", line)
+            if match:
+                info["audio_rate"] = int(match.group(1))
+                info["audio_channels"] = {"mono": 1, "stereo": 2}.get(match.group(2), match.group(2))
+            match = re.search(r"(\d+) kb/s", line)
+            info["audio_bitrate"] = int(match.group(1)) if match else None
+
+    if video_line is not None:
+        # Display rotation sits in the stream's metadata / side data block
+        for line in lines[video_line + 1:]:
+            if line.startswith("Stream #"):
+                break
+            match = re.search(r"rotation of (-?[\d.]+) degrees", line) or re.match(r"rotate\s*:\s*(-?\d+)", line)
+            if match:
+                info["rotation"] = int(round(float(match.group(1)))) % 360
+        # ffmpeg auto-rotates when decoding, so report the displayed size
+        if info["rotation"] in (90, 270) and info["width"]:
+            info["width"], info["height"] = info["height"], info["width"]
+        try:
+            spacing = read_mp4_keyframe_spacing(path)
+        except (OSError, struct.error):
+            spacing = None
+        if spacing and info["fps"]:
+            info["keyframe_interval"] = spacing / info["fps"]
+    return info
+
+
+PROBE_CACHE_VERSION = 1
+probe_memory_cache = {}
+
+
+def probe_media(path):
+    # Header probe, cached in memory and on disk by path, size and mtime
+    key = f"v{PROBE_CACHE_VERSION}|{file_identity(path)}"
+    info = probe_memory_cache.get(key)
+    if info is None:
+        path_in_cache = cache_file("probe", key, ".json")
+        try:
+            with open(path_in_cache, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            info = read_media_info(path)
+            write_json_atomic(path_in_cache, info)
+        probe_memory_cache[key] = info
+    return dict(info)
+
+
+THUMBNAIL_WIDTH = 160
+MAX_THUMBNAILS = 300
+INDEX_CACHE_VERSION = 1
+INDEX_MEMORY_ENTRIES = 4
+index_memory_cache = collections.OrderedDict()
+index_lock = threading.Lock()
+
+
+def build_media_index(path, context=None):
+    # One decode pass over the keyframes only (-skip_frame nokey). The first
+    # showinfo logs every keyframe; a select filter then thins them out to at
+    # most MAX_THUMBNAILS evenly spaced ones, which are scaled down, logged by
+    # the second showinfo and piped out as raw RGB for the timeline strip.
+    info = probe_media(path)
+    thumbnail_height = max(2, round(THUMBNAIL_WIDTH * info["height"] / info["width"] / 2) * 2)
+    min_gap = info["duration"] / MAX_THUMBNAILS
+    video_filter = f"showinfo,select='isnan(prev_selected_t)+gte(t-prev_selected_t,{min_gap:.6f})',scale={THUMBNAIL_WIDTH}:{thumbnail_height},showinfo"
+    stdout, stderr = run_ffmpeg(["-skip_frame", "nokey", "-i", path, "-map", "0:v:0", "-vf", video_filter, "-fps_mode", "passthrough", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"], loglevel="info", context=context, capture_stdout=True)
+
+    times = collections.defaultdict(list)
+    for instance, pts_time in re.findall(r"Parsed_showinfo_(\d+) .*?pts_time:\s*(-?[\d.]+)", stderr):
+        times[int(instance)].append(float(pts_time))
+    keyframe_log, thumbnail_log = (sorted(times) + [None, None])[:2]
+    thumbnails = np.frombuffer(stdout, dtype=np.uint8)
+    thumbnails = thumbnails[:thumbnails.size // (thumbnail_height * THUMBNAIL_WIDTH * 3) * thumbnail_height * THUMBNAIL_WIDTH * 3].reshape(-1, thumbnail_height, THUMBNAIL_WIDTH, 3)
+    thumbnail_times = np.array(times.get(thumbnail_log, []), dtype=np.float64)[:len(thumbnails)]
+    return {
+        "keyframes": np.array(times.get(keyframe_log, []), dtype=np.float64),
+        "thumbnail_times": thumbnail_times,
+        "thumbnails": thumbnails[:len(thumbnail_times)],
+    }
+
+
+def media_index(path, context=None):
+    # Keyframe times and thumbnail strip of a file: in memory for the last few
+    # files, on disk (.npz) for everything indexed before
+    key = file_identity(path)
+    with index_lock:
+        index = index_memory_cache.get(key)
+        if index is not None:
+            index_memory_cache.move_to_end(key)
+            return index
+
+    path_in_cache = cache_file("index", f"{INDEX_CACHE_VERSION}|{key}", ".npz")
+    try:
+        with np.load(path_in_cache) as data:
+            index = {name: data[name] for name in ("keyframes", "thumbnail_times", "thumbnails")}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        index = build_media_index(path, context)
+        tmp_path = f"{path_in_cache}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **index)
+        os.replace(tmp_path, path_in_cache)
+
+    with index_lock:
+        index_memory_cache[key] = index
+        while len(index_memory_cache) > INDEX_MEMORY_ENTRIES:
+            index_memory_cache.popitem(last=False)
+    return index
+
+
+def read_keyframes(path, context=None):
+    return [float(t) for t in media_index(path, context)["keyframes"]]
+
+
+def thumbnail_at(index, t):
+    i = max(0, np.searchsorted(index["thumbnail_times"], t, side="right") - 1)
+    return index["thumbnails"][i] if len(index["thumbnails"]) else None
+
+
+PREVIEW_WIDTH = 480
+FRAME_CACHE_SIZE = 64
+
+
+def seek_frame(path, t, width=PREVIEW_WIDTH):
+    # Snap to the frame grid so nearby scrub positions share cache entries
+    info = probe_media(path)
+    fps = info["fps"] or 30.0
+    t = min(max(round(t * fps) / fps, 0.0), max(info["duration"] - 1 / fps, 0.0))
+    return decode_frame(file_identity(path), path, t, width)
+
+
+@functools.lru_cache(maxsize=FRAME_CACHE_SIZE)
+def decode_frame(identity, path, t, width):
+    # Input-side seek to the indexed keyframe at or before t, so the demuxer
+    # jumps straight there, then decode forward to t
+    info = probe_media(path)
+    keyframes = media_index(path)["keyframes"]
+    i = np.searchsorted(keyframes, t + 1e-6) - 1
+    keyframe = float(keyframes[i]) if i >= 0 else 0.0
+    height = max(2, round(width * info["height"] / info["width"] / 2) * 2)
+    raw = run_ffmpeg(["-ss", f"{keyframe:.6f}", "-i", path, "-ss", f"{t - keyframe:.6f}", "-map", "0:v:0", "-frames:v", 1, "-vf", f"scale={width}:{height}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"], capture_stdout=True)[0]
+    if len(raw) < width * height * 3:
+        raise ValueError(f"Could not decode a frame at {t:.3f}s from {path}")
+    return np.frombuffer(raw[:width * height * 3], dtype=np.uint8).reshape(height, width, 3)
+
+
+def stream_ffmpeg(args, chunk_bytes, context=None):
+    # Yields ffmpeg's stdout in chunk_bytes blocks while it decodes, so a long
+    # file is never held in memory. Same error and cancel handling as run_ffmpeg.
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y"] + [str(a) for a in args]
+    popen_params = {"stdout": subprocess.PIPE, "stderr": subprocess.PIPE}
+    if os.name == "nt":
+        popen_params["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
+    proc = subprocess.Popen(cmd, **popen_params)
+    if context is not None:
+        context.watch(proc)
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+    try:
+        while True:
+            chunk = proc.stdout.read(chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+        proc.wait()
+    finally:
+        if proc.poll() is None:
+            # The consumer stopped early
+            proc.kill()
+            proc.wait()
+        stderr_reader.join()
+        if context is not None:
+            context.unwatch(proc)
+    if context is not None:
+        context.check_cancelled()
+    if proc.returncode != 0:
+        stderr = b"".join(stderr_chunks).decode("utf8", errors="replace")
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {stderr.strip()[-500:]}")
+
+
+# Analysis resolution: loudness per LOUDNESS_WINDOW seconds of ANALYSIS_RATE Hz
+# mono audio, scene scores between SCENE_FPS frames per second scaled to SCENE_SIZE
+ANALYSIS_RATE = 8000
+LOUDNESS_WINDOW = 0.05
+SCENE_FPS = 5
+SCENE_SIZE = (64, 36)
+ANALYSIS_CHUNK_SECONDS = 10
+ANALYSIS_CACHE_VERSION = 1
+
+
+def measure_loudness(path, context=None):
+    # RMS level in dBFS per window, from a mono low-rate decode read in chunks
+    window = round(ANALYSIS_RATE * LOUDNESS_WINDOW)
+    args = ["-i", path, "-map", "0:a:0", "-vn", "-ac", 1, "-ar", ANALYSIS_RATE, "-f", "f32le", "-"]
+    levels = []
+    for chunk in stream_ffmpeg(args, window * 4 * round(ANALYSIS_CHUNK_SECONDS / LOUDNESS_WINDOW), context):
+        samples = np.frombuffer(chunk[:len(chunk) // (window * 4) * window * 4], dtype=np.float32).reshape(-1, window)
+        rms = np.sqrt(np.mean(np.square(samples, dtype=np.float64), axis=1))
+        levels.append((20 * np.log10(np.maximum(rms, 1e-5))).astype(np.float32))
+    return np.concatenate(levels) if levels else np.zeros(0, dtype=np.float32)
+
+
+def measure_scene_scores(path, duration, context=None):
+    # Mean absolute difference (0..1) between consecutive tiny grayscale frames.
+    # The decoder skips the loop filter and non-reference frames, which only
+    # costs detail these thumbnails don't have.
+    width, height = SCENE_SIZE
+    frame_bytes = width * height
+    args = ["-skip_loop_filter", "all", "-skip_frame", "noref", "-i", path, "-map", "0:v:0", "-an",
+            "-vf", f"fps={SCENE_FPS},scale={width}:{height}:flags=area", "-f", "rawvideo", "-pix_fmt", "gray", "-"]
+    scores = []
+    previous = None
+    decoded = 0
+    for chunk in stream_ffmpeg(args, frame_bytes * SCENE_FPS * ANALYSIS_CHUNK_SECONDS, context):
+        frames = np.frombuffer(chunk[:len(chunk) // frame_bytes * frame_bytes], dtype=np.uint8).reshape(-1, height, width).astype(np.int16)
+        if previous is not None:
+            frames = np.concatenate([previous, frames])
+        else:
+            scores.append(np.zeros(1, dtype=np.float32))
+        scores.append((np.abs(np.diff(frames, axis=0)).mean(axis=(1, 2)) / 255).astype(np.float32))
+        previous = frames[-1:]
+        decoded += len(frames) - 1
+        if context is not None and duration:
+            context.progress(decoded / SCENE_FPS / duration)
+    return np.concatenate(scores) if previous is not None else np.zeros(0, dtype=np.float32)
+
+
+def analyze_media(path, context=None):
+    # Loudness and scene-change curves of a file, cached on disk. Thresholds
+    # are applied afterwards (find_silences, find_scene_changes), so changing
+    # them never re-decodes. Audio and video are decoded by two ffmpeg
+    # processes side by side.
+    path_in_cache = cache_file("analysis", f"{ANALYSIS_CACHE_VERSION}|{ANALYSIS_RATE}|{LOUDNESS_WINDOW}|{SCENE_FPS}|{SCENE_SIZE}|{file_identity(path)}", ".npz")
+    try:
+        with np.load(path_in_cache) as data:
+            return {name: data[name] for name in ("loudness", "scene_scores")}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass
+
+    info = probe_media(path)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        loudness = pool.submit(measure_loudness, path, context) if info["audio_codec"] is not None else None
+        scene_scores = measure_scene_scores(path, info["duration"], context) if info["video_codec"] is not None else np.zeros(0, dtype=np.float32)
+        loudness = loudness.result() if loudness is not None else np.zeros(0, dtype=np.float32)
+    analysis = {"loudness": loudness, "scene_scores": scene_scores}
+    tmp_path = f"{path_in_cache}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **analysis)
+    os.replace(tmp_path, path_in_cache)
+    return analysis
+
+
+def find_silences(analysis, threshold_db=-40.0, min_silence=0.5):
+    # (start, end) of every stretch quieter than threshold_db for at least min_silence seconds
+    quiet = np.concatenate([[False], analysis["loudness"] < threshold_db, [False]])
+    edges = np.flatnonzero(np.diff(quiet.astype(np.int8)))
+    starts, ends = edges[0::2] * LOUDNESS_WINDOW, edges[1::2] * LOUDNESS_WINDOW
+    keep = ends - starts >= min_silence
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+def find_scene_changes(analysis, threshold=0.15, min_gap=1.0):
+    # Times of local score peaks above threshold, at least min_gap seconds apart
+    scores = analysis["scene_scores"]
+    if scores.size < 3:
+        return []
+    peaks = np.flatnonzero((scores[1:-1] >= threshold) & (scores[1:-1] > scores[:-2]) & (scores[1:-1] >= scores[2:])) + 1
+    changes = []
+    for i in peaks[np.argsort(-scores[peaks], kind="stable")]:
+        # Strongest first, so a weaker peak right next to a cut is the one dropped
+        t = float(i / SCENE_FPS)
+        if all(abs(t - other) >= min_gap for other in changes):
+            changes.append(t)
+    return sorted(changes)
+
+
+def suggest_cut_list(analysis, duration, silence_db=-40.0, min_silence=0.5, scene_threshold=0.15, min_length=5.0, max_length=60.0):
+    # Ranges over the non-silent parts, split at scene changes into clips of
+    # min_length..max_length seconds, as a cut list for the Cut List / ranges_file
+    silences = find_silences(analysis, silence_db, min_silence)
+    changes = find_scene_changes(analysis, scene_threshold)
+    spans, t = [], 0.0
+    for start, end in silences + [(duration, duration)]:
+        if start > t:
+            spans.append((t, min(start, duration)))
+        t = end
+
+    ranges = []
+    for span_start, span_end in spans:
+        points = [c for c in changes if span_start < c < span_end] + [span_end]
+        start = span_start
+        while span_end - start >= min_length:
+            # Furthest boundary that keeps the clip under max_length, else a hard split
+            fitting = [p for p in points if min_length <= p - start <= max_length]
+            end = fitting[-1] if fitting else min(start + max_length, span_end)
+            ranges.append({"name": f"{len(ranges) + 1:03d}_{int(start // 60):02d}m{start % 60:04.1f}s", "start": round(start, 3), "end": round(end, 3)})
+            start = end
+    return ranges
+
+
+# Source codec -> encoder for the re-encoded partial GOPs at the cut points
+SMART_CUT_CODECS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+}
+MP4_AUDIO_CODECS = ("aac", "mp3", "ac3", "eac3", "opus", "alac")
+
+
+def is_pure_trim(spec, info):
+    if not spec["smart_cut"] or info["video_codec"] not in SMART_CUT_CODECS:
+        return False
+    if info["audio_codec"] is not None and info["audio_codec"] not in MP4_AUDIO_CODECS:
+        return False
+    return (
+        (spec["width"], spec["height"]) == (info["width"], info["height"])
+        and info["rotation"] == 0
+        and spec["video_speed"] == 1.0
+        and spec["video_rotation"] % 360 == 0
+        and spec["contrast"] == 0.0
+        and spec["brightness"] == 0.0
+        and spec["video_volume"] == 1.0
+        and not spec["watermark_text"]
+        and not spec["watermark_image"]
+        and not spec["audio_file"]
+        and info["fps"] is not None
+        and abs(spec["framerate"] - info["fps"]) < 1
+    )
+
+
+def smart_cut(input_file, info, start_time, end_time, output_file, context):
+    # Stream-copy every whole GOP inside the range and only re-encode the
+    # partial GOPs at the two cut points, then stitch the pieces together.
+    encoder = SMART_CUT_CODECS[info["video_codec"]]
+    with context.metrics.stage("probe"):
+        keyframes = [k for k in read_keyframes(input_file, context) if start_time <= k <= end_time]
+    if keyframes and end_time >= info["duration"] - 1 / info["fps"]:
+        keyframes.append(end_time)  # cutting at the end of the file needs no tail re-encode
+
+    with tempfile.TemporaryDirectory(prefix="cutitout_") as tmp_dir:
+        parts = []
+
+        def add_part(t0, t1, copy):
+            # Matroska parts keep each part's own codec headers through the concat demuxer
+            part = os.path.join(tmp_dir, f"part{len(parts)}.mkv")
+            args = ["-ss", f"{t0:.6f}", "-i", input_file, "-map", "0:v:0", "-an"]
+            if copy:
+                # Count packets instead of using -t, which lets reordered B-frames spill past t1
+                args += ["-frames:v", round((t1 - t0) * info["fps"]), "-c:v", "copy"]
+            else:
+                args += ["-t", f"{t1 - t0:.6f}", "-c:v", encoder, "-preset", "slow", "-crf", "16", "-pix_fmt", info["pix_fmt"] or "yuv420p"]
+            with context.metrics.stage("mux" if copy else "encode"):
+                run_ffmpeg(args + [part], context=context)
+            parts.append(part)
+            context.progress(len(parts) / 3)
+
+        context.span(0.0, 0.9, "encode")
+        if len(keyframes) < 2:
+            # No whole GOP inside the range, the clip is short enough to just re-encode
+            add_part(start_time, end_time, copy=False)
+        else:
+            first_key, last_key = keyframes[0], keyframes[-1]
+            if first_key - start_time > 1e-3:
+                add_part(start_time, first_key, copy=False)
+            add_part(first_key, last_key, copy=True)
+            if end_time - last_key > 1e-3:
+                add_part(last_key, end_time, copy=False)
+
+        context.span(0.9, 1.0, "mux")
+        concat_list = os.path.join(tmp_dir, "parts.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            f.writelines(f"file '{part}'\n" for part in parts)
+
+        with context.metrics.stage("mux"):
+            args = ["-f", "concat", "-safe", "0", "-i", concat_list]
+            if info["audio_codec"] is not None:
+                audio_part = os.path.join(tmp_dir, "audio.mka")
+                # Output-side -ss: an input seek would snap the audio to the previous video keyframe
+                run_ffmpeg(["-i", input_file, "-ss", f"{start_time:.6f}", "-t", f"{end_time - start_time:.6f}", "-map", "0:a:0", "-vn", "-c:a", "copy", audio_part], context=context)
+                args += ["-i", audio_part, "-map", "0:v", "-map", "1:a"]
+            if info["video_codec"] == "hevc":
+                args += ["-tag:v", "hvc1"]
+            run_ffmpeg(args + ["-c", "copy", "-movflags", "+faststart", output_file], context=context)
+        context.progress(1.0)
+    return len(parts)
+
+
+def parse_time(value):
+    # Seconds, or [hh:]mm:ss(.fff) timecodes like stream markers use
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_cut_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return {"true": True, "false": False}.get(value.lower(), value)
+
+
+def load_cut_list(path):
+    # A JSON list of ranges ({"ranges": [...]} works too), or a CSV with a
+    # header row. name/start/end columns plus any job keys as per-range overrides.
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data["ranges"] if isinstance(data, dict) else data
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.DictReader(f))
+    ranges = []
+    for row in rows:
+        cut = {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+        if not cut:
+            continue
+        ranges.append({key: value if key in ("name", "start", "end") else parse_cut_value(value) for key, value in cut.items()})
+    return ranges
+
+
+def save_cut_list(path, ranges):
+    if path.lower().endswith(".json"):
+        write_json_atomic(path, ranges)
+        return
+    columns = ["name", "start", "end"]
+    columns += sorted({key for cut in ranges for key in cut} - set(columns))
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(ranges)
+
+
+def cut_ranges(spec, duration):
+    # The job's cut list as sorted {"name", "start", "end", "overrides"} ranges.
+    # Sorted so the shared reader only ever moves forward; for a reel,
+    # overlapping ranges with the same overrides are merged so no footage
+    # plays twice.
+    ranges = list(spec["ranges"] or [])
+    if spec["ranges_file"]:
+        ranges += load_cut_list(spec["ranges_file"])
+    cuts = []
+    for i, cut in enumerate(ranges):
+        start = parse_time(cut.get("start", 0))
+        end = min(parse_time(cut["end"]) if cut.get("end") not in (None, "") else duration, duration)
+        if start >= end:
+            raise ValueError(f"Range {cut.get('name') or i + 1}: end time must be greater than start time.")
+        overrides = {key: value for key, value in cut.items() if key not in ("name", "start", "end")}
+        cuts.append({"name": str(cut.get("name") or f"{i + 1:02d}_cut_{start:g}_{end:g}"), "start": start, "end": end, "overrides": overrides})
+    cuts.sort(key=lambda cut: (cut["start"], cut["end"]))
+
+    if spec["reel"]:
+        merged = []
+        for cut in cuts:
+            if merged and cut["start"] <= merged[-1]["end"] and cut["overrides"] == merged[-1]["overrides"]:
+                merged[-1]["end"] = max(merged[-1]["end"], cut["end"])
+            else:
+                merged.append(cut)
+        cuts = merged
+    return cuts
+
+
+class FrameSchedule:
+    # Decodes only the source frames an output at out_fps actually shows when
+    # [start_time, ...) plays at speed. Output frame k is source frame
+    # m = int(fps * (start_time + speed * k / out_fps) + 1e-5), MoviePy's own
+    # rounding, so with A = fps * start_time + 1e-5 and B = fps * speed / out_fps
+    # source frame m is needed iff ceil((m - A) / B) < (m + 1 - A) / B. A select
+    # filter evaluates that in the decoder, so the frames in between are
+    # dropped before they are converted to RGB or piped.
+    def __init__(self, video, start_time, duration, speed, out_fps, context=None):
+        self.path = video.filename
+        self.size = tuple(video.size)
+        self.fps = video.reader.fps
+        self.start_time = start_time
+        self.speed = speed
+        self.context = context
+        self.a = self.fps * start_time + 1e-5
+        self.b = self.fps * speed / out_fps
+        # The same time grid iter_frames uses
+        times = np.arange(0, duration, 1.0 / out_fps)
+        first = self.source_index(0.0)
+        last = self.source_index(times[-1]) if len(times) else first
+        self.indices = [m for m in range(first, last + 1) if math.ceil((m - self.a) / self.b) < (m + 1 - self.a) / self.b]
+        self.proc = None
+        self.position = -1
+        self.frame = None
+
+    def source_index(self, t):
+        return int(self.fps * (self.speed * t + self.start_time) + 0.00001)
+
+    def open(self, i):
+        self.close()
+        first, last = self.indices[i], self.indices[-1]
+        keep = f"st(0,{first}+round(t*{self.fps!r}));lte(ld(0),{last})*lt(ceil((ld(0)-{self.a!r})/{self.b!r}),(ld(0)+1-{self.a!r})/{self.b!r})"
+        # Same scale and -sws_flags as MoviePy's reader, so the RGB frames are identical
+        cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-ss", f"{first / self.fps:.6f}", "-i", self.path,
+               "-map", "0:v:0", "-vf", f"select='{keep}',scale={self.size[0]}:{self.size[1]}", "-sws_flags", "bicubic", "-fps_mode", "passthrough",
+               "-frames:v", str(len(self.indices) - i), "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+        popen_params = {"stdout": subprocess.PIPE, "stderr": subprocess.DEVNULL, "bufsize": self.size[0] * self.size[1] * 3 + 100}
+        if os.name == "nt":
+            popen_params["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
+        self.proc = subprocess.Popen(cmd, **popen_params)
+        if self.context is not None:
+            self.context.watch(self.proc)
+        self.position = i - 1
+
+    def get_frame(self, t):
+        # Latest decoded frame at or before the one MoviePy would show at t
+        i = max(bisect.bisect_right(self.indices, self.source_index(t)) - 1, 0)
+        if self.proc is None or i < self.position:
+            self.open(i)
+        nbytes = self.size[0] * self.size[1] * 3
+        while self.position < i:
+            raw = self.proc.stdout.read(nbytes)
+            if len(raw) < nbytes:
+                break  # past the end of the file, keep showing the last frame
+            self.position += 1
+            if self.position == i:
+                self.frame = np.frombuffer(raw, dtype=np.uint8).reshape(self.size[1], self.size[0], 3)
+        if self.frame is None:
+            raise IOError(f"Could not decode frame {self.indices[i]} of {self.path}")
+        return self.frame
+
+    def close(self):
+        if self.proc is not None:
+            if self.context is not None:
+                self.context.unwatch(self.proc)
+            self.proc.kill()
+            self.proc.stdout.close()
+            self.proc.wait()
+            self.proc = None
+
+
+class SourceVideo:
+    # The source VideoFileClip, opened on first use and shared by every range
+    # cut from it: its ffmpeg reader keeps running forward through the file
+    # (skipping short gaps, seeking long ones) instead of being reopened.
+    # Crossfaded ranges play two at a time, so they alternate between two
+    # lanes, each with its own reader.
+    def __init__(self, path, context):
+        self.path = path
+        self.context = context
+        self.videos = {}
+        self.schedules = []
+        self.tmp_dir = None
+
+    def clip(self, lane=0):
+        if lane not in self.videos:
+            with self.context.metrics.stage("open"):
+                self.videos[lane] = VideoFileClip(self.path)
+        return self.videos[lane]
+
+    def scheduled_clip(self, video, start_time, end_time, speed, fps):
+        # Trim + speed change for an output at fps that needs fewer frames than
+        # the source has, see FrameSchedule
+        duration = (end_time - start_time) / speed
+        schedule = FrameSchedule(video, start_time, duration, speed, fps, self.context)
+        self.schedules.append(schedule)
+        clip = VideoClip(schedule.get_frame, duration=duration)
+        if video.audio is None:
+            return clip
+        if speed == 1.0:
+            return clip.set_audio(video.audio.subclip(start_time, end_time))
+        return clip.set_audio(self.sped_up_audio(start_time, end_time, speed))
+
+    def sped_up_audio(self, start_time, end_time, speed):
+        # Faster and higher, like speedx, but from a decode of just the range
+        # that ffmpeg resamples properly instead of speedx's sample picking
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix="cutitout_")
+        audio_file = os.path.join(self.tmp_dir, f"speed{len(os.listdir(self.tmp_dir))}.wav")
+        with self.context.metrics.stage("audio mix"):
+            run_ffmpeg(["-ss", f"{start_time:.6f}", "-t", f"{end_time - start_time:.6f}", "-i", self.path, "-map", "0:a:0", "-vn",
+                        "-af", speed_audio_filter(speed), "-c:a", "pcm_f32le", audio_file], context=self.context)
+        return AudioFileClip(audio_file, fps=MIX_FPS)
+
+    def close(self):
+        for schedule in self.schedules:
+            schedule.close()
+        for video in self.videos.values():
+            video.close()
+        self.videos = {}
+        self.schedules = []
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+
+def render_cut(spec, context):
+    with context.metrics.stage("probe"):
+        info = probe_media(spec["input_file"])
+    with contextlib.closing(SourceVideo(spec["input_file"], context)) as source:
+        if spec["ranges"] or spec["ranges_file"]:
+            return render_cut_list(spec, info, source, context)
+        return render_cut_range(spec, info, source, context)
+
+
+def render_cut_list(spec, info, source, context):
+    cuts = cut_ranges(spec, info["duration"])
+    if not cuts:
+        raise ValueError("The cut list is empty.")
+    if spec["reel"]:
+        return render_reel(spec, cuts, source, context)
+
+    print(f"Cutting {len(cuts)} range(s) from {spec['input_file']}")
+    total = sum(cut["end"] - cut["start"] for cut in cuts)
+    done = 0.0
+    output_files, frames = [], 0
+    names = collections.Counter()
+    for cut in cuts:
+        names[cut["name"]] += 1
+        name = cut["name"] if names[cut["name"]] == 1 else f"{cut['name']}_{names[cut['name']]}"
+        range_spec = {**spec, **cut["overrides"], "start_time": cut["start"], "end_time": cut["end"], "ranges": None, "ranges_file": None}
+        range_spec["output_file"] = cut["overrides"].get("output_file") or os.path.join(range_spec["output_dir"], f"{name}.mp4")
+        context.section(done / total, (done + cut["end"] - cut["start"]) / total)
+        range_files, range_frames = render_cut_range(range_spec, info, source, context)
+        output_files += range_files
+        frames += range_frames
+        done += cut["end"] - cut["start"]
+    context.section(0.0, 1.0)
+    return output_files, frames
+
+
+def render_cut_range(spec, info, source, context):
+    if not spec["outputs"] and is_pure_trim(spec, info):
+        start_time = spec["start_time"]
+        end_time = spec["end_time"] if spec["end_time"] is not None else info["duration"]
+        if start_time >= end_time:
+            raise ValueError("End time must be greater than start time.")
+        output_file = job_output_path(spec, f"cut_video_{start_time}_{end_time}.mp4")
+        cut_end = min(end_time, info["duration"])
+        try:
+            print(f"Smart cut (stream copy) to file: {output_file}")
+            smart_cut(spec["input_file"], info, start_time, cut_end, output_file, context)
+            return [output_file], int((cut_end - start_time) * info["fps"])
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            print(f"Smart cut failed, falling back to a full re-encode: {e}")
+
+    if spec["backend"] == "ffmpeg":
+        try:
+            return render_cut_native(spec, info, context)
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            print(f"Native ffmpeg render failed, falling back to MoviePy: {e}")
+    elif spec["backend"] != "moviepy":
+        raise ValueError(f"Unknown backend: {spec['backend']}")
+
+    video = source.clip()
+    start_time = spec["start_time"]
+    end_time = spec["end_time"] if spec["end_time"] is not None else video.duration
+    if start_time >= end_time:
+        raise ValueError("End time must be greater than start time.")
+
+    subclip, rotation = cut_subclip(source, spec, start_time, end_time)
+    if spec["audio_file"]:
+        subclip = process_audio(subclip, spec["audio_file"], spec["audio_volume"], spec["music_fade_in"], spec["music_fade_out"], spec["music_duck"], spec["music_duck_threshold"])
+
+    base_name = f"cut_video_{start_time}_{end_time}"
+    if spec["outputs"]:
+        # One decode, many encoders: speed, rotation and colour run once per
+        # frame, then every output crops/resizes its own copy
+        shared = FrameTransform(None, None, rotation, spec["brightness"], spec["contrast"])
+        targets = []
+        for output in spec["outputs"]:
+            width, height = output["width"], output["height"]
+            output_file = output.get("output_file") or os.path.join(spec["output_dir"], output.get("name") or f"{base_name}_{width}x{height}.mp4")
+            targets.append((FrameTransform(width, height, crop_box=output.get("crop")), output_file, output.get("video_bitrate", spec["video_bitrate"])))
+    else:
+        # Crop, resize, quarter-turn rotation and contrast/brightness in one pass
+        shared = None
+        targets = [(FrameTransform(spec["width"], spec["height"], rotation, spec["brightness"], spec["contrast"]), job_output_path(spec, f"{base_name}.mp4"), spec["video_bitrate"])]
+
+    output_files = encode_clip(subclip, targets, spec, context, shared=shared, watermark=spec_watermark(spec))
+    return output_files, int(subclip.duration * spec["framerate"])
+
+
+def cut_subclip(source, spec, start_time, end_time, lane=0):
+    # Trim, speed, free rotation and volume. Quarter turns are left to
+    # FrameTransform and returned.
+    video = source.clip(lane)
+    if spec["frame_skipping"] and video.reader.fps * spec["video_speed"] / spec["framerate"] > 1:
+        # Speed-up or a lower framerate: only decode the frames that are kept
+        subclip = source.scheduled_clip(video, start_time, end_time, spec["video_speed"], spec["framerate"])
+    else:
+        subclip = video.subclip(start_time, end_time)
+
+        # Apply video speed
+        if spec["video_speed"] != 1.0:
+            subclip = speedx(subclip, factor=spec["video_speed"])
+
+    # Any angle that isn't a quarter turn keeps MoviePy's expanding rotate
+    rotation = spec["video_rotation"]
+    if rotation % 90 != 0:
+        subclip = rotate(subclip, angle=rotation)
+        rotation = 0
+
+    if spec["video_volume"] != 1.0:
+        subclip = subclip.fx(volumex, spec["video_volume"])
+    return subclip, rotation
+
+
+def spec_watermark(spec):
+    if spec["watermark_text"] or spec["watermark_image"]:
+        return (spec["watermark_text"], spec["watermark_image"], spec["watermark_position"], spec["watermark_opacity"], spec["watermark_scale"])
+    return None
+
+
+def crossfade_clips(clips, crossfade):
+    # Each clip fades in over the tail of the previous one, video and audio.
+    # Frames are only blended inside the overlaps; CompositeVideoClip would
+    # alpha-blit every frame through float masks (and concatenate_videoclips'
+    # negative padding also cuts the last clip short).
+    starts = np.cumsum([0.0] + [clip.duration - crossfade for clip in clips[:-1]])
+
+    def make_frame(t):
+        i = max(int(np.searchsorted(starts, t, side="right")) - 1, 0)
+        frame = clips[i].get_frame(t - starts[i])
+        if i > 0 and t - starts[i] < crossfade:
+            previous = clips[i - 1].get_frame(min(t - starts[i - 1], clips[i - 1].duration))
+            weight = (t - starts[i]) / crossfade
+            frame = cv2.addWeighted(np.ascontiguousarray(frame), weight, np.ascontiguousarray(previous), 1.0 - weight, 0.0)
+        return frame
+
+    reel = VideoClip(make_frame, duration=starts[-1] + clips[-1].duration)
+    tracks = []
+    for i, (clip, start) in enumerate(zip(clips, starts)):
+        if clip.audio is None:
+            continue
+        audio = clip.audio
+        if i > 0:
+            audio = audio.fx(audio_fadein, crossfade)
+        if i < len(clips) - 1:
+            audio = audio.fx(audio_fadeout, crossfade)
+        tracks.append(audio.set_start(start))
+    if tracks:
+        reel = reel.set_audio(CompositeAudioClip(tracks).set_duration(reel.duration))
+    return reel
+
+
+def render_reel(spec, cuts, source, context):
+    # All ranges joined into one video in source order. Every range gets its
+    # own speed/rotation/colour and is brought to the reel size on its own,
+    # then the joined clip is watermarked, mixed with the music and encoded once.
+    width, height = spec["width"], spec["height"]
+    crossfade = spec["crossfade"] if len(cuts) > 1 else 0.0
+    print(f"Joining {len(cuts)} range(s) from {spec['input_file']} into a highlight reel")
+    clips = []
+    for i, cut in enumerate(cuts):
+        cut_spec = {**spec, **cut["overrides"]}
+        clip, rotation = cut_subclip(source, cut_spec, cut["start"], cut["end"], i % 2 if crossfade > 0 else 0)
+        clips.append(clip.fl_image(FrameTransform(width, height, rotation, cut_spec["brightness"], cut_spec["contrast"])))
+
+    if crossfade > 0:
+        crossfade = min(crossfade, min(clip.duration for clip in clips) / 2)
+        reel = crossfade_clips(clips, crossfade)
+    else:
+        reel = concatenate_videoclips(clips)
+    if spec["audio_file"]:
+        reel = process_audio(reel, spec["audio_file"], spec["audio_volume"], spec["music_fade_in"], spec["music_fade_out"], spec["music_duck"], spec["music_duck_threshold"])
+
+    targets = [(FrameTransform(width, height), job_output_path(spec, "highlight_reel.mp4"), spec["video_bitrate"])]
+    output_files = encode_clip(reel, targets, spec, context, watermark=spec_watermark(spec))
+    return output_files, int(reel.duration * spec["framerate"])
+
+
+def encode_clip(clip, targets, spec, context, shared=None, watermark=None, audio_file=None):
+    # Owns the frame loop instead of write_videofile so every stage can be
+    # timed. targets are (transform, output_file, video_bitrate); each gets its
+    # own ffmpeg writer fed from the same decoded frame. The audio track is
+    # encoded once (unless audio_file is already encoded) and muxed into all of them.
+    audio_share = 0.1 if clip.audio is not None and audio_file is None else 0.0
+    with tempfile.TemporaryDirectory(prefix="cutitout_") as tmp_dir:
+        if clip.audio is not None and audio_file is None:
+            audio_file = os.path.join(tmp_dir, "audio.m4a")
+            context.span(0.0, audio_share, "audio mix")
+            with context.metrics.stage("audio mix"):
+                clip.audio.write_audiofile(audio_file, fps=48000, nbytes=4, codec="aac", bitrate=f"{spec['audio_bitrate']}k", logger=context.logger)
+
+        writers = []
+        try:
+            for transform, output_file, video_bitrate in targets:
+                writers.append(FFMPEG_VideoWriter(output_file, (transform.width, transform.height), spec["framerate"], codec="libx264", audiofile=audio_file, preset="slow", bitrate=f"{video_bitrate}k", threads=spec["threads"]))
+                context.watch(writers[-1].proc)
+                print(f"Writing video to file: {output_file}")
+
+            context.span(audio_share, 0.98, "encode")
+            frames = clip.iter_frames(fps=spec["framerate"], dtype="uint8", logger=context.logger)
+            if spec["frame_workers"] and spec["frame_workers"] > 1:
+                pipeline_frames(frames, targets, writers, context, shared, watermark, spec["frame_workers"], spec["frame_ring"])
+            else:
+                while True:
+                    with context.metrics.stage("decode"):
+                        frame = next(frames, None)
+                    if frame is None:
+                        break
+                    context.check_cancelled()
+                    if shared is not None:
+                        with context.metrics.stage("transform"):
+                            frame = shared(frame)
+                    for (transform, _, _), writer in zip(targets, writers):
+                        with context.metrics.stage("transform"):
+                            image = transform(frame)
+                        if watermark is not None:
+                            with context.metrics.stage("watermark"):
+                                if not image.flags.writeable or np.shares_memory(image, frame):
+                                    # Don't draw into the shared frame the next output still needs
+                                    image = image.copy()
+                                for sprite in watermark_sprites(image.shape[1], image.shape[0], *watermark):
+                                    blend_watermark(image, sprite)
+                        with context.metrics.stage("encode"):
+                            writer.write_frame(image)
+        finally:
+            if context.cancelled.is_set():
+                # The writers were killed, drop their partial files
+                for writer in writers:
+                    try:
+                        writer.close()
+                    except OSError:
+                        pass
+                    if os.path.exists(writer.filename):
+                        os.remove(writer.filename)
+            else:
+                # Closing waits for ffmpeg to flush its last frames and mux the audio
+                context.span(0.98, 1.0, "mux")
+                with context.metrics.stage("mux"):
+                    for writer in writers:
+                        context.unwatch(writer.proc)
+                        writer.close()
+                context.progress(1.0)
+    return [writer.filename for writer in writers]
+
+
+# Frame slots per worker in the shared-memory ring when frame_ring isn't set:
+# one being transformed, one decoded and waiting
+FRAME_RING_SLOTS_PER_WORKER = 2
+
+
+def ring_views(buffer, ring_size, frame_shape, output_shapes):
+    # Lays the ring out as ring_size slots of [decoded frame | output 1 | output 2 ...]
+    # and returns (frame, [outputs]) numpy views into it per slot
+    shapes = [frame_shape] + list(output_shapes)
+    slot_bytes = sum(int(np.prod(shape)) for shape in shapes)
+    slots = []
+    for slot in range(ring_size):
+        offset = slot * slot_bytes
+        views = []
+        for shape in shapes:
+            views.append(np.ndarray(shape, dtype=np.uint8, buffer=buffer, offset=offset))
+            offset += int(np.prod(shape))
+        slots.append((views[0], views[1:]))
+    return slots
+
+
+def frame_worker(shm_name, ring_size, frame_shape, output_shapes, shared, transforms, watermark, tasks, done):
+    # Worker process: transforms the decoded frame of a slot into the slot's
+    # output buffers in place. Only (seq, slot) travels over the queues.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        transform_slots(ring_views(shm.buf, ring_size, frame_shape, output_shapes), shared, transforms, watermark, tasks, done)
+    finally:
+        shm.close()
+
+
+def transform_slots(slots, shared, transforms, watermark, tasks, done):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        seq, slot = task
+        frame, outputs = slots[slot]
+        transform_time = watermark_time = 0.0
+        try:
+            started = time.perf_counter()
+            if shared is not None:
+                frame = shared(frame)
+            for transform, output in zip(transforms, outputs):
+                np.copyto(output, transform(frame))
+                if watermark is not None:
+                    marked = time.perf_counter()
+                    transform_time += marked - started
+                    for sprite in watermark_sprites(output.shape[1], output.shape[0], *watermark):
+                        blend_watermark(output, sprite)
+                    started = time.perf_counter()
+                    watermark_time += started - marked
+            transform_time += time.perf_counter() - started
+            done.put((seq, slot, transform_time, watermark_time, None))
+        except Exception as e:
+            done.put((seq, slot, transform_time, watermark_time, f"{type(e).__name__}: {e}"))
+
+
+def pipeline_frames(frames, targets, writers, context, shared, watermark, workers, ring_size=None):
+    # decode -> N transform processes -> ordered encode. This thread decodes
+    # into free ring slots, the workers transform the slots in parallel and a
+    # writer thread hands the finished slots to the encoders in frame order,
+    # then frees them. The ring is the only frame memory, so at most ring_size
+    # frames are in flight however far the decoder runs ahead.
+    with context.metrics.stage("decode"):
+        first = next(frames, None)
+    if first is None:
+        return
+    ring_size = max(ring_size or workers * FRAME_RING_SLOTS_PER_WORKER, 2)
+    output_shapes = [(transform.height, transform.width, 3) for transform, _, _ in targets]
+    slot_bytes = first.nbytes + sum(int(np.prod(shape)) for shape in output_shapes)
+    print(f"Transforming frames in {workers} worker processes, {ring_size} x {slot_bytes / 2**20:.1f} MB ring")
+
+    mp_context = multiprocessing.get_context()
+    tasks = mp_context.Queue()
+    done = mp_context.Queue()
+    free_slots = queue.Queue()
+    for slot in range(ring_size):
+        free_slots.put(slot)
+    state = {"total": None, "error": None}
+    stop = threading.Event()
+
+    shm = shared_memory.SharedMemory(create=True, size=ring_size * slot_bytes)
+    processes = []
+    writer_thread = None
+    try:
+        slots = ring_views(shm.buf, ring_size, first.shape, output_shapes)
+        transforms = [transform for transform, _, _ in targets]
+        for _ in range(workers):
+            process = mp_context.Process(target=frame_worker, args=(shm.name, ring_size, first.shape, output_shapes, shared, transforms, watermark, tasks, done), daemon=True)
+            process.start()
+            processes.append(process)
+
+        def write_ordered():
+            finished = {}
+            next_seq = 0
+            try:
+                while state["total"] is None or next_seq < state["total"]:
+                    if stop.is_set():
+                        return
+                    try:
+                        item = done.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is None:
+                        # Wake-up after the last frame was queued, total is set now
+                        continue
+                    seq, slot, transform_time, watermark_time, error = item
+                    context.metrics.stages["transform"] += transform_time
+                    if watermark is not None:
+                        context.metrics.stages["watermark"] += watermark_time
+                    if error is not None:
+                        raise RuntimeError(f"Frame {seq}: {error}")
+                    finished[seq] = slot
+                    while next_seq in finished:
+                        slot = finished.pop(next_seq)
+                        with context.metrics.stage("encode"):
+                            for output, writer in zip(slots[slot][1], writers):
+                                writer.write_frame(output)
+                        free_slots.put(slot)
+                        next_seq += 1
+            except Exception as e:
+                state["error"] = e
+                stop.set()
+
+        writer_thread = threading.Thread(target=write_ordered, daemon=True)
+        writer_thread.start()
+
+        seq = 0
+        frame = first
+        while frame is not None:
+            context.check_cancelled()
+            slot = None
+            while slot is None:
+                if stop.is_set():
+                    # A killed encoder fails the writer first when the render was cancelled
+                    context.check_cancelled()
+                    raise state["error"]
+                try:
+                    slot = free_slots.get(timeout=0.1)
+                except queue.Empty:
+                    context.check_cancelled()
+            np.copyto(slots[slot][0], frame)
+            tasks.put((seq, slot))
+            seq += 1
+            with context.metrics.stage("decode"):
+                frame = next(frames, None)
+
+        state["total"] = seq
+        done.put(None)
+        while writer_thread.is_alive():
+            writer_thread.join(timeout=0.1)
+            context.check_cancelled()
+        if state["error"] is not None:
+            context.check_cancelled()
+            raise state["error"]
+    finally:
+        stop.set()
+        if writer_thread is not None:
+            writer_thread.join()
+        for process in processes:
+            tasks.put(None)
+        for process in processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        tasks.close()
+        done.close()
+        # The numpy views must be gone before the mapping can be closed
+        slots = frame = first = None
+        shm.close()
+        shm.unlink()
+
+
+def speed_audio_filter(speed):
+    # Faster and higher like MoviePy's speedx: play the samples at speed times
+    # the rate, then resample back. Both backends use it so they sound the same.
+    return f"aresample={MIX_FPS},asetrate={round(MIX_FPS * speed)},aresample={MIX_FPS}"
+
+
+def native_rotation_filters(rotation, width, height):
+    # MoviePy and np.rot90 turn counter-clockwise, ffmpeg's rotate clockwise
+    if rotation % 90 != 0:
+        # Expanded canvas rounded out to whole pixels on both sides, like PIL's
+        # rotate(expand=True) under MoviePy, so the centre crop after it matches
+        angle = np.radians(rotation)
+        half_width = (abs(width * np.cos(angle)) + abs(height * np.sin(angle))) / 2
+        half_height = (abs(width * np.sin(angle)) + abs(height * np.cos(angle))) / 2
+        # Rotating subsampled chroma planes smears colour edges, so rotate in RGB
+        return ["format=rgb24", f"rotate={-rotation}*PI/180:ow={2 * int(np.ceil(half_width))}:oh={2 * int(np.ceil(half_height))}:c=black"]
+    return [[], ["transpose=cclock"], ["hflip", "vflip"], ["transpose=clock"]][(rotation // 90) % 4]
+
+
+def native_rotation_mask(rotation, width, height):
+    # The pixels MoviePy's rotate (PIL, expand=True) fills, 255 inside and 0 outside
+    from PIL import Image as PILImage
+    mask = np.array(PILImage.new("L", (width, height), 255).rotate(rotation, expand=True))
+    return np.where(mask > 0, 255, 0).astype(np.uint8)
+
+
+def native_eq_filter(brightness, contrast):
+    # lum_contrast works on RGB: v' = v * (1 + contrast) + brightness - contrast * 127.
+    # In limited-range YUV that is the same gain on luma and chroma around 16,
+    # which eq expresses as contrast/saturation plus a brightness offset
+    # (eq pivots luma on 127.5 and counts brightness in 1/255 steps).
+    gain = 1.0 + contrast
+    offset = brightness - contrast * 127
+    eq_brightness = ((gain - 1.0) * 111.5 + offset * 219 / 255) / 255
+    return f"eq=contrast={gain:.6f}:saturation={min(max(gain, 0.0), 3.0):.6f}:brightness={min(max(eq_brightness, -1.0), 1.0):.6f}"
+
+
+def native_crop_filter(width, height, crop_box=None):
+    if crop_box is not None:
+        x0, y0, x1, y1 = crop_box
+        return f"crop={x1 - x0}:{y1 - y0}:{x0}:{y0}:exact=1"
+    # center_crop_box as an expression, only ffmpeg knows the size after an
+    # arbitrary rotation. x/y are spelled out because ffmpeg's default
+    # centring rounds the offset up where center_crop_box floors it.
+    aspect = width / height
+    return f"crop=w='if(gt(iw/ih,{aspect}),trunc(ih*{aspect}),iw)':h='if(lt(iw/ih,{aspect}),trunc(iw/{aspect}),ih)':x='trunc((iw-ow)/2)':y='trunc((ih-oh)/2)':exact=1"
+
+
+def watermark_rgba(sprite):
+    # Undo the blend terms of a sprite into a straight-alpha RGBA image
+    alpha = 1.0 - sprite.inv_alpha
+    rgb = np.where(alpha > 0, (sprite.premultiplied - 0.5) / np.maximum(alpha, 1e-6), 0.0)
+    return np.dstack([rgb, alpha * 255]).round().clip(0, 255).astype(np.uint8)
+
+
+def native_cut_command(spec, info, start_time, end_time, targets, tmp_dir):
+    # Compile a cut job into one ffmpeg call: input-side trim, then speed,
+    # rotation and colour once, split per output into crop/scale/watermark,
+    # and the audio through volume/speed and the music mix. targets are
+    # (width, height, crop_box, output_file, video_bitrate).
+    duration = (end_time - start_time) / spec["video_speed"]
+    args = ["-ss", f"{start_time:.6f}", "-t", f"{end_time - start_time:.6f}", "-i", spec["input_file"]]
+    input_count = 1
+    graph = []
+
+    shared = ["setpts=(PTS-STARTPTS)/%.6f" % spec["video_speed"], f"fps={spec['framerate']}"]
+    shared += native_rotation_filters(spec["video_rotation"], info["width"], info["height"])
+    source = "[0:v:0]"
+    if spec["video_rotation"] % 90 != 0:
+        # ffmpeg's rotate also paints a rim of about a pixel around the turned
+        # frame; multiply by the area PIL covers so the corners match MoviePy
+        mask_file = os.path.join(tmp_dir, "rotation_mask.png")
+        cv2.imwrite(mask_file, native_rotation_mask(spec["video_rotation"], info["width"], info["height"]))
+        args += ["-i", mask_file]
+        graph.append(f"{source}{','.join(shared)},format=gbrp[rotated]")
+        graph.append(f"[{input_count}:v]format=gbrp[mask]")
+        # In RGB, multiplying YUV would shift the chroma
+        graph.append("[rotated][mask]blend=all_mode=multiply[masked]")
+        input_count += 1
+        source, shared = "[masked]", []
+    if spec["brightness"] != 0.0 or spec["contrast"] != 0.0:
+        shared.append(native_eq_filter(spec["brightness"], spec["contrast"]))
+    video_labels = [f"v{i}" for i in range(len(targets))]
+    shared.append(f"split={len(targets)}" + "".join(f"[{label}]" for label in video_labels) if len(targets) > 1 else "null[v0]")
+    graph.append(source + ",".join(shared))
+
+    source_pixels = info["width"] * info["height"]
+    for i, (width, height, crop_box, _, _) in enumerate(targets):
+        # Area averaging when shrinking, like FrameTransform
+        flags = "area" if width * height < source_pixels else "bilinear"
+        # Crop and scale in RGB like FrameTransform: an odd crop offset on
+        # yuv420p would shift the chroma by half a sample
+        graph.append(f"[v{i}]format=rgb24,{native_crop_filter(width, height, crop_box)},scale={width}:{height}:flags={flags},setsar=1[s{i}]")
+        last = f"s{i}"
+        sprites = watermark_sprites(width, height, spec["watermark_text"], spec["watermark_image"], spec["watermark_position"], spec["watermark_opacity"], spec["watermark_scale"])
+        for j, sprite in enumerate(sprites):
+            # The same pre-rendered watermark the MoviePy path blends, overlaid as a still image
+            image_file = os.path.join(tmp_dir, f"watermark{i}_{j}.png")
+            cv2.imwrite(image_file, cv2.cvtColor(watermark_rgba(sprite), cv2.COLOR_RGBA2BGRA))
+            args += ["-i", image_file]
+            graph.append(f"[{last}][{input_count}:v]overlay={sprite.x0}:{sprite.y0}[w{i}_{j}]")
+            input_count += 1
+            last = f"w{i}_{j}"
+        video_labels[i] = last
+
+    audio = None
+    if info["audio_codec"] is not None:
+        source = []
+        if spec["video_volume"] != 1.0:
+            source.append(f"volume={spec['video_volume']}")
+        if spec["video_speed"] != 1.0:
+            source.append(speed_audio_filter(spec["video_speed"]))
+        graph.append("[0:a:0]" + ",".join(source or ["anull"]) + "[src]")
+        audio = "src"
+    if spec["audio_file"]:
+        music_input = input_count
+        args += ["-i", spec["audio_file"]]
+        music = ["aformat=sample_rates=48000:channel_layouts=stereo", f"volume={spec['audio_volume']}"]
+        if spec["music_fade_in"] > 0:
+            music.append(f"afade=t=in:st=0:d={spec['music_fade_in']}")
+        if spec["music_fade_out"] > 0:
+            music.append(f"afade=t=out:st={max(duration - spec['music_fade_out'], 0):.6f}:d={spec['music_fade_out']}")
+        graph.append(f"[{music_input}:a:0]" + ",".join(music) + "[music]")
+        if audio is None:
+            graph.append(f"[music]atrim=end={duration:.6f},apad=whole_dur={duration:.6f}[mix]")
+        else:
+            graph.append("[src]aformat=sample_rates=48000:channel_layouts=stereo[src48]")
+            music_label = "music"
+            if spec["music_duck"] != 1.0:
+                # A hard compressor keyed on the video audio, blended so the music
+                # settles at music_duck while the video is louder than the threshold
+                graph.append("[src48]asplit=2[src48][key]")
+                graph.append(f"[music][key]sidechaincompress=threshold={spec['music_duck_threshold']}:ratio=20:attack=5:release=50:mix={1.0 - spec['music_duck']:.4f}[ducked]")
+                music_label = "ducked"
+            graph.append(f"[src48][{music_label}]amix=inputs=2:duration=first:normalize=0[mix]")
+        audio = "mix"
+    audio_labels = []
+    if audio is not None:
+        audio_labels = [f"a{i}" for i in range(len(targets))]
+        graph.append(f"[{audio}]" + (f"asplit={len(targets)}" + "".join(f"[{label}]" for label in audio_labels) if len(targets) > 1 else "anull[a0]"))
+
+    args += ["-filter_complex", ";".join(graph)]
+    for i, (_, _, _, output_file, video_bitrate) in enumerate(targets):
+        args += ["-map", f"[{video_labels[i]}]"]
+        args += ["-c:v", "libx264", "-preset", "slow", "-b:v", f"{video_bitrate}k", "-pix_fmt", "yuv420p"]
+        if spec["threads"]:
+            args += ["-threads", spec["threads"]]
+        if audio_labels:
+            args += ["-map", f"[{audio_labels[i]}]", "-c:a", "aac", "-b:a", f"{spec['audio_bitrate']}k", "-ar", 48000]
+        args += ["-movflags", "+faststart", output_file]
+    return args, duration
+
+
+def render_cut_native(spec, info, context):
+    start_time = spec["start_time"]
+    end_time = min(spec["end_time"] if spec["end_time"] is not None else info["duration"], info["duration"])
+    if start_time >= end_time:
+        raise ValueError("End time must be greater than start time.")
+    base_name = f"cut_video_{start_time}_{spec['end_time'] if spec['end_time'] is not None else info['duration']}"
+    if spec["outputs"]:
+        targets = [(o["width"], o["height"], o.get("crop"), o.get("output_file") or os.path.join(spec["output_dir"], o.get("name") or f"{base_name}_{o['width']}x{o['height']}.mp4"), o.get("video_bitrate", spec["video_bitrate"])) for o in spec["outputs"]]
+    else:
+        targets = [(spec["width"], spec["height"], None, job_output_path(spec, f"{base_name}.mp4"), spec["video_bitrate"])]
+
+    with tempfile.TemporaryDirectory(prefix="cutitout_") as tmp_dir:
+        args, duration = native_cut_command(spec, info, start_time, end_time, targets, tmp_dir)
+        for target in targets:
+            print(f"Writing video to file (native ffmpeg): {target[3]}")
+        context.span(0.0, 1.0, "encode")
+        with context.metrics.stage("encode"):
+            run_ffmpeg(args, context=context, progress_duration=duration)
+    return [target[3] for target in targets], int(duration * spec["framerate"])
+
+
+def render_compress(spec, context):
+    volume, tone = spec["volume"], spec["tone"]
+    if volume <= 0:
+        raise ValueError("Volume limit must be a positive value.")
+    if tone <= 0:
+        raise ValueError("Volume limit must be a positive value.")
+    if spec["target_size_mb"]:
+        output_file = job_output_path(spec, f"compressed_video_{spec['framerate']}_{spec['target_size_mb']:g}MB.mp4")
+        with context.metrics.stage("probe"):
+            info = probe_media(spec["input_file"])
+        with tempfile.TemporaryDirectory(prefix="cutitout_") as tmp_dir:
+            audio_file = os.path.join(tmp_dir, "audio.m4a") if info["audio_codec"] is not None else None
+            spec = {**spec, "video_bitrate": plan_target_bitrate(spec, info, audio_file, context)}
+            if spec["two_pass"]:
+                render_compress_two_pass(spec, info, audio_file, output_file, context)
+            else:
+                # The usual one-pass paths, after the probe's share of the progress
+                context.section(0.1, 1.0)
+                render_compress_plain(spec, output_file, info, context, audio_file)
+        size_mb = os.path.getsize(output_file) / 1e6
+        print(f"{os.path.basename(output_file)}: {size_mb:.2f} MB for a {spec['target_size_mb']:g} MB target" + (" (over the target!)" if size_mb > spec["target_size_mb"] else ""))
+        return [output_file], int(info["duration"] * spec["framerate"])
+
+    output_file = job_output_path(spec, f"compressed_video_{spec['framerate']}_{spec['video_bitrate']}.mp4")
+    info = None
+    if spec["segment_seconds"]:
+        with context.metrics.stage("probe"):
+            info = probe_media(spec["input_file"])
+    return [output_file], render_compress_plain(spec, output_file, info, context)
+
+
+def render_compress_plain(spec, output_file, info, context, audio_file=None):
+    # One pass at spec["video_bitrate"]: parallel segments or the MoviePy frame
+    # loop, with audio_file as the audio track if it is already encoded
+    volume, tone = spec["volume"], spec["tone"]
+    if spec["segment_seconds"]:
+        render_compress_segmented(spec, info, output_file, context, audio_file)
+        return int(info["duration"] * spec["framerate"])
+
+    with contextlib.closing(SourceVideo(spec["input_file"], context)) as source:
+        video = source.clip()
+        subclip = video
+        if spec["frame_skipping"] and video.reader.fps / spec["framerate"] > 1:
+            # Lower framerate: only decode the frames that are kept
+            subclip = source.scheduled_clip(video, 0, video.duration, 1.0, spec["framerate"])
+
+        # Adjust volume
+        if volume != 1.0:
+            subclip = subclip.fx(volumex, volume)
+
+        # Set tone
+        if tone != 1.0:
+            subclip = subclip.fx(volumex, tone)
+
+        # Plain resize to the new size (a crop box over the whole frame stretches instead of cropping)
+        transform = FrameTransform(spec["width"], spec["height"], crop_box=(0, 0, video.w, video.h))
+        encode_clip(subclip, [(transform, output_file, spec["video_bitrate"])], spec, context, audio_file=audio_file)
+        frames = int(subclip.duration * spec["framerate"])
+    return frames
+
+
+def keyframe_segments(keyframes, duration, segment_seconds):
+    # Split points on keyframes at least segment_seconds apart, without
+    # leaving a tiny last segment
+    bounds = [0.0]
+    for keyframe in keyframes:
+        if keyframe - bounds[-1] >= segment_seconds and duration - keyframe >= segment_seconds / 2:
+            bounds.append(keyframe)
+    bounds.append(duration)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def allocate_segment_bitrates(complexity, durations, target_bitrate, spread=2.0):
+    # Share the overall bitrate budget out by each segment's measured
+    # complexity (bytes per second at constant quality), within target/spread
+    # and target*spread, so that sum(bitrate * duration) still equals
+    # target_bitrate * total duration.
+    total_duration = sum(durations)
+    mean_complexity = sum(c * d for c, d in zip(complexity, durations)) / total_duration
+    bitrates = [target_bitrate * c / mean_complexity for c in complexity]
+    for _ in range(10):
+        bitrates = [min(max(b, target_bitrate / spread), target_bitrate * spread) for b in bitrates]
+        scale = target_bitrate * total_duration / sum(b * d for b, d in zip(bitrates, durations))
+        if abs(scale - 1) < 1e-3:
+            break
+        bitrates = [b * scale for b in bitrates]
+    return bitrates
+
+
+def compress_video_filter(info, width, height, framerate):
+    # Area averaging when shrinking, like MoviePy's resize
+    flags = "area" if width * height < info["width"] * info["height"] else "bilinear"
+    return f"scale={width}:{height}:flags={flags},fps={framerate}"
+
+
+def compress_audio_args(spec):
+    return ["-af", f"volume={spec['volume'] * spec['tone']}", "-c:a", "aac", "-b:a", f"{spec['audio_bitrate']}k", "-ar", 48000]
+
+
+def encode_segment(input_file, t0, t1, output_file, video_args, context=None):
+    run_ffmpeg(["-ss", f"{t0:.6f}", "-i", input_file, "-t", f"{t1 - t0:.6f}", "-map", "0:v:0", "-an"] + video_args + [output_file], context=context)
+    return os.path.getsize(output_file)
+
+
+SEGMENT_PROBE_SECONDS = 2.0
+# x264's one-pass ABR spends less than -b:v on short chunks (1-2 s segments
+# came out 15-25% under), so the parts' total is measured after encoding and
+# the segments are encoded once more at corrected rates if it is off by more
+# than this.
+SEGMENT_RATE_TOLERANCE = 0.03
+
+
+def render_compress_segmented(spec, info, output_file, context, audio_file=None):
+    # Encode keyframe-aligned chunks in parallel ffmpeg processes with the same
+    # settings, then concatenate them losslessly and mux the audio
+    input_file = spec["input_file"]
+    with context.metrics.stage("probe"):
+        segments = keyframe_segments(read_keyframes(input_file, context), info["duration"], spec["segment_seconds"])
+    durations = [t1 - t0 for t0, t1 in segments]
+    workers = min(spec["segment_workers"] or os.cpu_count() or 1, len(segments))
+    # Split the cores between the encoders instead of oversubscribing them
+    threads = spec["threads"] or max(1, (os.cpu_count() or 1) // workers)
+    video_filter = compress_video_filter(info, spec["width"], spec["height"], spec["framerate"])
+    print(f"Encoding {len(segments)} segment(s) of ~{spec['segment_seconds']}s with {workers} worker(s)")
+
+    with tempfile.TemporaryDirectory(prefix="cutitout_") as tmp_dir, ThreadPoolExecutor(max_workers=workers) as pool:
+        def part_path(i, kind):
+            return os.path.join(tmp_dir, f"{kind}{i:05d}.mkv")
+
+        audio_future = None
+        if info["audio_codec"] is not None and audio_file is None:
+            audio_file = os.path.join(tmp_dir, "audio.m4a")
+            audio_args = ["-i", input_file, "-map", "0:a:0", "-vn"] + compress_audio_args(spec) + [audio_file]
+            audio_future = pool.submit(run_ffmpeg, audio_args, context=context)
+
+        bitrates = [spec["video_bitrate"]] * len(segments)
+        if spec["segment_rate_control"] == "complexity" and len(segments) > 1:
+            context.span(0.0, 0.1, "probe")
+            # Quick constant-quality pass at half size over the first seconds of
+            # each chunk, to measure how hard the chunks are relative to each other
+            probe_seconds = [min(d, SEGMENT_PROBE_SECONDS) for d in durations]
+            probe_filter = compress_video_filter(info, max(2, spec["width"] // 4 * 2), max(2, spec["height"] // 4 * 2), spec["framerate"])
+            probe_args = ["-vf", probe_filter, "-c:v", "libx264", "-preset", "ultrafast", "-crf", "23", "-threads", threads]
+            with context.metrics.stage("probe"):
+                sizes = list(pool.map(lambda i: encode_segment(input_file, segments[i][0], segments[i][0] + probe_seconds[i], part_path(i, "probe"), probe_args, context), range(len(segments))))
+            complexity = [size / seconds for size, seconds in zip(sizes, probe_seconds)]
+            bitrates = allocate_segment_bitrates(complexity, durations, spec["video_bitrate"])
+
+        def encode(i):
+            video_args = ["-vf", video_filter, "-c:v", "libx264", "-preset", "slow", "-b:v", f"{int(bitrates[i])}k", "-pix_fmt", "yuv420p", "-threads", threads]
+            context.check_cancelled()
+            return encode_segment(input_file, *segments[i], part_path(i, "part"), video_args, context)
+
+        def encode_parts(start, end, label):
+            # Progress by encoded seconds, as the segments finish
+            context.span(start, end, label)
+            sizes = [0] * len(segments)
+            done_seconds = 0.0
+            with context.metrics.stage("encode"):
+                futures = {pool.submit(encode, i): i for i in range(len(segments))}
+                for future in as_completed(futures):
+                    sizes[futures[future]] = future.result()
+                    done_seconds += durations[futures[future]]
+                    context.progress(done_seconds / info["duration"])
+            return sizes
+
+        sizes = encode_parts(context.fraction, 0.97, "encode")
+        budget = sum(b * d for b, d in zip(bitrates, durations)) * 1000 / 8
+        if abs(sum(sizes) / budget - 1) > SEGMENT_RATE_TOLERANCE:
+            # Ask each segment for its planned rate times how far it missed it
+            print(f"Segments came out at {sum(sizes) / budget:.0%} of the video bitrate, encoding them again at corrected rates")
+            bitrates = [b * min(max(b * d * 1000 / 8 / size, 0.5), 2.0) if size else b for b, d, size in zip(bitrates, durations, sizes)]
+            sizes = encode_parts(0.5, 0.97, "encode (rate correction)")
+        parts = [part_path(i, "part") for i in range(len(segments))]
+        if audio_future is not None:
+            audio_future.result()
+
+        context.span(0.97, 1.0, "mux")
+        concat_list = os.path.join(tmp_dir, "parts.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            f.writelines(f"file '{part}'\n" for part in parts)
+        args = ["-f", "concat", "-safe", "0", "-i", concat_list]
+        if audio_file:
+            args += ["-i", audio_file, "-map", "0:v", "-map", "1:a"]
+        with context.metrics.stage("mux"):
+            run_ffmpeg(args + ["-c", "copy", "-movflags", "+faststart", output_file], context=context)
+        context.progress(1.0)
+    return len(segments)
+
+
+# Target size mode: the audio track is encoded first (it is cheap, and AAC
+# spends less than its nominal bitrate on simple sound), the video gets what
+# is left of the size minus the MP4 index. Short probe encodes spread over
+# the file measure what the video needs to look good (at TARGET_SIZE_CRF), so
+# a generous budget isn't spent on bits nobody sees. One-pass ABR lands
+# within a few percent of its target and two-pass within about one, hence the
+# margins. Segmented encodes are re-encoded at corrected rates when their
+# total misses by more than SEGMENT_RATE_TOLERANCE, so they get that on top.
+TARGET_SIZE_SAMPLES = 6
+TARGET_SIZE_SAMPLE_SECONDS = 2.0
+TARGET_SIZE_CRF = 18
+TARGET_SIZE_MARGIN = {"one_pass": 0.04, "two_pass": 0.015, "segmented": 0.04 + SEGMENT_RATE_TOLERANCE}
+# Per video frame in the MP4 index (sample size, timing and sync tables)
+MP4_INDEX_BYTES_PER_FRAME = 24
+# Below about 0.01 bits per pixel x264 hits its lowest quality and overshoots
+MIN_BITS_PER_PIXEL = 0.01
+# Fixed first-pass settings, so the stats don't depend on the bitrate and are cached for any target
+FIRST_PASS_CRF = 20
+
+
+def target_size_mode(spec):
+    # Two-pass takes precedence over segmenting, as in render_compress
+    if spec["two_pass"]:
+        return "two_pass"
+    return "segmented" if spec["segment_seconds"] else "one_pass"
+
+
+def target_video_bitrate(spec, info, audio_bytes):
+    # kbps for the video stream; 1 MB = 1,000,000 bytes
+    video_bytes = spec["target_size_mb"] * 1e6 * (1 - TARGET_SIZE_MARGIN[target_size_mode(spec)]) - audio_bytes
+    video_bytes -= info["duration"] * spec["framerate"] * MP4_INDEX_BYTES_PER_FRAME
+    if video_bytes * 8 / info["duration"] < MIN_BITS_PER_PIXEL * spec["width"] * spec["height"] * spec["framerate"]:
+        raise ValueError(f"{spec['target_size_mb']:g} MB is too small for {info['duration']:.0f}s of {spec['width']}x{spec['height']} video at {spec['framerate']} fps "
+                         f"with {audio_bytes / 1e6:.1f} MB of audio; lower the size, framerate or audio bitrate.")
+    return video_bytes * 8 / 1000 / info["duration"]
+
+
+def sample_segments(duration, samples=TARGET_SIZE_SAMPLES, seconds=TARGET_SIZE_SAMPLE_SECONDS):
+    # Evenly spread over the file, each centred in its share of it
+    samples = max(1, min(samples, int(duration // seconds)))
+    seconds = min(seconds, duration)
+    return [(max(0.0, duration * (i + 0.5) / samples - seconds / 2), seconds) for i in range(samples)]
+
+
+def plan_target_bitrate(spec, info, audio_file, context):
+    # Video kbps for the target size; audio_file (None without audio) receives the final audio track
+    samples = sample_segments(info["duration"])
+    sample_seconds = sum(seconds for _, seconds in samples)
+    workers = min(os.cpu_count() or 1, len(samples))
+    threads = spec["threads"] or max(1, (os.cpu_count() or 1) // workers)
+    probe_args = ["-vf", compress_video_filter(info, spec["width"], spec["height"], spec["framerate"]), "-c:v", "libx264", "-preset", "veryfast", "-crf", TARGET_SIZE_CRF, "-pix_fmt", "yuv420p", "-threads", threads]
+    context.span(0.0, 0.1, "probe")
+    with tempfile.TemporaryDirectory(prefix="cutitout_") as tmp_dir, ThreadPoolExecutor(max_workers=workers) as pool:
+        with context.metrics.stage("probe"):
+            audio_future = None
+            if audio_file is not None:
+                audio_future = pool.submit(run_ffmpeg, ["-i", spec["input_file"], "-map", "0:a:0", "-vn"] + compress_audio_args(spec) + [audio_file], context=context)
+            sizes = list(pool.map(lambda i: encode_segment(spec["input_file"], samples[i][0], sum(samples[i]), os.path.join(tmp_dir, f"probe{i:03d}.mkv"), probe_args, context), range(len(samples))))
+            if audio_future is not None:
+                audio_future.result()
+    audio_bytes = os.path.getsize(audio_file) if audio_file is not None else 0
+    budget = target_video_bitrate(spec, info, audio_bytes)
+    needed = sum(sizes) * 8 / 1000 / sample_seconds
+    bitrate = int(min(budget, needed))
+    print(f"Target {spec['target_size_mb']:g} MB: {audio_bytes * 8 / 1000 / info['duration']:.0f}k audio, {budget:.0f}k video budget, the content needs ~{needed:.0f}k at CRF {TARGET_SIZE_CRF} -> encoding at {bitrate}k")
+    return bitrate
+
+
+def render_compress_two_pass(spec, info, audio_file, output_file, context):
+    # Both passes in ffmpeg. The first pass runs at a fixed CRF so its stats
+    # are kept per source and output format and reused for any bitrate. The
+    # audio track from plan_target_bitrate is muxed in as it is.
+    input_file = spec["input_file"]
+    video_filter = compress_video_filter(info, spec["width"], spec["height"], spec["framerate"])
+    threads = spec["threads"] or os.cpu_count() or 1
+    video_args = ["-vf", video_filter, "-c:v", "libx264", "-preset", "slow", "-pix_fmt", "yuv420p", "-threads", threads]
+    # The stats depend on the encoder settings too (preset, threads), and they
+    # count toward the render cache's size limit like a render
+    passlog = cache_file("passlogs", f"{file_identity(input_file)}|{' '.join(map(str, video_args))}|{FIRST_PASS_CRF}|{encoder_versions()['ffmpeg']}", "")
+
+    context.span(0.1, 0.45, "encode")
+    if not os.path.exists(passlog + "-0.log.mbtree"):
+        tmp_passlog = f"{passlog}.{os.getpid()}"
+        with context.metrics.stage("encode"):
+            run_ffmpeg(["-i", input_file, "-map", "0:v:0", "-an"] + video_args + ["-crf", FIRST_PASS_CRF, "-pass", 1, "-passlogfile", tmp_passlog, "-f", "null", os.devnull], context=context, progress_duration=info["duration"])
+        os.replace(tmp_passlog + "-0.log.mbtree", passlog + "-0.log.mbtree")
+        os.replace(tmp_passlog + "-0.log", passlog + "-0.log")
+    else:
+        print("Reusing the cached first-pass stats")
+        os.utime(passlog + "-0.log.mbtree")
+
+    context.span(0.45, 1.0, "encode")
+    args = ["-i", input_file] + (["-i", audio_file, "-map", "0:v:0", "-map", "1:a:0", "-c:a", "copy"] if audio_file else ["-map", "0:v:0"])
+    args += video_args + ["-b:v", f"{spec['video_bitrate']}k", "-pass", 2, "-passlogfile", passlog, "-movflags", "+faststart", output_file]
+    with context.metrics.stage("encode"):
+        run_ffmpeg(args, context=context, progress_duration=info["duration"])
+    evict_render_cache(RENDER_CACHE_LIMIT_MB)
+
+
+# Audio output format -> codec that can be copied into it without re-encoding
+AUDIO_FORMAT_CODECS = {
+    "mp3": "mp3",
+    "aac": "aac",
+    "m4a": "aac",
+    "flac": "flac",
+    "ogg": "vorbis",
+    "opus": "opus",
+    "wav": "pcm_s16le",
+}
+
+
+def render_extract_audio(spec, context):
+    # One ffmpeg pass writes the audio file and streams a mono copy of the
+    # track into the waveform peaks, which the cutter draws later without
+    # decoding the file again
+    input_file = spec["input_file"]
+    output_file = job_output_path(spec, f"{os.path.splitext(os.path.basename(input_file))[0]}.{spec['audio_format']}")
+    if os.path.abspath(output_file) == os.path.abspath(input_file):
+        raise ValueError(f"The audio would overwrite its source: {output_file}")
+    with context.metrics.stage("probe"):
+        info = probe_media(input_file)
+    if info["audio_codec"] is None:
+        raise ValueError("The video has no audio track.")
+    peaks_file = peaks_cache_file(input_file)
+    if spec["skip_existing"] and os.path.exists(peaks_file) and os.path.exists(output_file) and os.path.getsize(output_file) > 0 and os.path.getmtime(output_file) >= os.path.getmtime(input_file):
+        print(f"Up to date: {output_file}")
+        context.progress(1.0)
+        return [output_file], 0
+
+    # Only copy when the result is what a re-encode would give (same codec, 48kHz)
+    if spec["stream_copy"] and info["audio_codec"] == AUDIO_FORMAT_CODECS.get(spec["audio_format"].lower()) and info["audio_rate"] == 48000:
+        print(f"Copying {info['audio_codec']} audio stream to file: {output_file}")
+        codec_args = ["-c:a", "copy"]
+    else:
+        print(f"Writing audio to file: {output_file}")
+        codec_args = ["-ar", 48000]
+    # Written under a temporary name with the same extension (ffmpeg picks the
+    # format from it), so an interrupted run never leaves an "up to date" file
+    tmp_file = os.path.join(os.path.dirname(os.path.abspath(output_file)), f".{os.path.basename(output_file)}.{os.getpid()}{os.path.splitext(output_file)[1]}")
+    args = ["-i", input_file, "-map", "0:a:0", "-vn"] + codec_args + [tmp_file, "-map", "0:a:0", "-ac", 1, "-ar", PEAK_RATE, "-f", "s16le", "-"]
+    context.span(0.0, 1.0, "encode")
+    try:
+        with context.metrics.stage("encode"):
+            peaks = stream_peaks(args, info["duration"], context)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    save_peaks(peaks_file, peaks)
+    return [output_file], 0
+
+
+# Waveform peaks: min and max of every PEAK_SAMPLES samples of a mono PEAK_RATE
+# decode (100 pairs per second) as int8, cached per source like the media index
+PEAK_RATE = 48000
+PEAK_SAMPLES = 480
+PEAKS_VERSION = 1
+MEDIA_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v")
+
+
+def peaks_cache_file(path):
+    return cache_file("peaks", f"{PEAKS_VERSION}|{PEAK_RATE}|{PEAK_SAMPLES}|{file_identity(path)}", ".npy")
+
+
+def stream_peaks(args, duration=None, context=None):
+    # args end in a mono s16le output to stdout; read in chunks of whole peak blocks
+    peaks = []
+    samples_read = 0
+    for chunk in stream_ffmpeg(args, PEAK_SAMPLES * 2 * (PEAK_RATE // PEAK_SAMPLES) * ANALYSIS_CHUNK_SECONDS, context):
+        samples = np.frombuffer(chunk[:len(chunk) // 2 * 2], dtype=np.int16)
+        blocks = samples[:len(samples) // PEAK_SAMPLES * PEAK_SAMPLES].reshape(-1, PEAK_SAMPLES)
+        peaks.append(np.stack([blocks.min(axis=1), blocks.max(axis=1)], axis=1))
+        tail = samples[len(samples) // PEAK_SAMPLES * PEAK_SAMPLES:]
+        if tail.size:
+            # Only the last chunk is short
+            peaks.append(np.array([[tail.min(), tail.max()]], dtype=np.int16))
+        samples_read += samples.size
+        if context is not None and duration:
+            context.progress(samples_read / PEAK_RATE / duration)
+    if not peaks:
+        return np.zeros((0, 2), dtype=np.int8)
+    return (np.concatenate(peaks) >> 8).astype(np.int8)
+
+
+def save_peaks(path, peaks):
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, peaks)
+    os.replace(tmp_path, path)
+
+
+def waveform_peaks(path, context=None):
+    # Cached peaks, or a decode-only pass for a file whose audio wasn't extracted yet; None without audio
+    path_in_cache = peaks_cache_file(path)
+    try:
+        return np.load(path_in_cache)
+    except (OSError, ValueError):
+        pass
+    info = probe_media(path)
+    if info["audio_codec"] is None:
+        return None
+    peaks = stream_peaks(["-i", path, "-map", "0:a:0", "-vn", "-ac", 1, "-ar", PEAK_RATE, "-f", "s16le", "-"], info["duration"], context)
+    save_peaks(path_in_cache, peaks)
+    return peaks
+
+
+def collect_media_files(inputs, recursive=False):
+    # Folders (their videos), single files and glob patterns, sorted without duplicates
+    files = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            if recursive:
+                candidates = [os.path.join(root, name) for root, _, names in os.walk(pattern) for name in names]
+            else:
+                candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+            files.update(path for path in candidates if path.lower().endswith(MEDIA_EXTENSIONS) and os.path.isfile(path))
+        elif os.path.isfile(pattern):
+            files.add(pattern)
+        else:
+            files.update(path for path in glob.glob(pattern, recursive=recursive) if os.path.isfile(path))
+    return sorted(os.path.abspath(path) for path in files)
+
+
+def audio_extraction_jobs(files, audio_format="mp3", output_dir=None):
+    # One job per file, named after the file and written next to it (or into
+    # output_dir). Files that would share a name get their extension added.
+    jobs = []
+    taken = set()
+    for path in files:
+        folder = output_dir or os.path.dirname(path)
+        stem, extension = os.path.splitext(os.path.basename(path))
+        output_file = os.path.join(folder, f"{stem}.{audio_format}")
+        suffix = 1
+        while output_file in taken:
+            output_file = os.path.join(folder, f"{stem}_{extension.lstrip('.')}{'' if suffix == 1 else suffix}.{audio_format}")
+            suffix += 1
+        taken.add(output_file)
+        jobs.append({"type": "extract_audio", "input_file": path, "output_file": output_file, "audio_format": audio_format, "skip_existing": True})
+    return jobs
+
+
+# Render cache: finished outputs kept under <cache>/renders/<key>/ and keyed by
+# everything that decides their content. Entries are hardlinked in and out
+# (copied across filesystems), and each artifact's size and mtime are checked
+# on a hit, so an output that was later overwritten in place through a shared
+# link is dropped instead of served. Least recently used entries are evicted
+# above the size cap.
+RENDER_CACHE_VERSION = 2
+RENDER_CACHE_LIMIT_MB = float(os.environ.get("CUTITOUT_RENDER_CACHE_MB", 10240))
+# Where the result goes and how many threads make it don't change its content
+RENDER_CACHE_IGNORED_KEYS = ("name", "output_dir", "output_file", "metrics_file", "render_cache", "skip_existing", "threads", "frame_workers", "frame_ring", "segment_workers")
+RENDER_CACHE_FILE_KEYS = ("input_file", "audio_file", "watermark_image", "ranges_file")
+CONTENT_SAMPLES = 16
+CONTENT_SAMPLE_BYTES = 64 * 1024
+
+
+@functools.lru_cache(maxsize=256)
+def sampled_content_hash(identity, path):
+    # Evenly spaced samples including head and tail; identity is only the cache key
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        for offset in sorted({int(i * max(size - CONTENT_SAMPLE_BYTES, 0) / (CONTENT_SAMPLES - 1)) for i in range(CONTENT_SAMPLES)}):
+            f.seek(offset)
+            digest.update(f.read(CONTENT_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def content_identity(path):
+    # Size, mtime and sampled content, but not the path: a moved or renamed source still hits
+    stat = os.stat(path)
+    return f"{stat.st_size}|{stat.st_mtime_ns}|{sampled_content_hash(file_identity(path), path)}"
+
+
+def render_cache_key(spec):
+    keyed = {key: value for key, value in spec.items() if key not in RENDER_CACHE_IGNORED_KEYS}
+    for key in RENDER_CACHE_FILE_KEYS:
+        if keyed.get(key):
+            keyed[key] = content_identity(keyed[key])
+    # A new ffmpeg or MoviePy may encode the same job differently
+    return hashlib.sha1(json.dumps([RENDER_CACHE_VERSION, encoder_versions(), keyed], sort_keys=True, default=str).encode("utf8")).hexdigest()
+
+
+def link_or_copy(source, destination):
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def update_render_cache_stats(**increments):
+    # Read-modify-write without a lock: parallel batch workers may lose a count, never an entry
+    path = os.path.join(cache_dir("renders"), "stats.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = {}
+    for name, value in increments.items():
+        stats[name] = stats.get(name, 0) + value
+    write_json_atomic(path, stats)
+    return stats
+
+
+def render_cache_lookup(spec, key):
+    # Delivers a cached render to where this spec wants it; None on a miss
+    entry_dir = os.path.join(cache_dir("renders"), key)
+    manifest_path = os.path.join(entry_dir, "manifest.json")
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        for i, artifact in enumerate(manifest["files"]):
+            stat = os.stat(os.path.join(entry_dir, f"{i}{artifact['extension']}"))
+            if (stat.st_size, stat.st_mtime_ns) != (artifact["size"], artifact["mtime_ns"]):
+                raise ValueError("artifact changed since it was cached")
+    except (OSError, ValueError, KeyError) as e:
+        if os.path.exists(manifest_path):
+            print(f"Dropping render cache entry {key}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    output_files = []
+    for i, artifact in enumerate(manifest["files"]):
+        if spec["output_file"] and len(manifest["files"]) == 1:
+            destination = spec["output_file"]
+        elif artifact["relative"]:
+            destination = os.path.join(spec["output_dir"], artifact["relative"])
+        else:
+            destination = artifact["path"]
+        link_or_copy(os.path.join(entry_dir, f"{i}{artifact['extension']}"), destination)
+        output_files.append(destination)
+    os.utime(manifest_path)  # LRU order
+    update_render_cache_stats(hits=1, seconds_saved=manifest["render_time"])
+    print(f"Render cache hit: {', '.join(output_files)}")
+    return output_files, manifest["frames"]
+
+
+def render_cache_store(spec, key, output_files, frames, render_time):
+    root = cache_dir("renders")
+    # Assembled next to the final entry, then renamed in one step
+    tmp_dir = tempfile.mkdtemp(prefix=f"{key}.", dir=root)
+    try:
+        files = []
+        for i, path in enumerate(output_files):
+            extension = os.path.splitext(path)[1]
+            link_or_copy(path, os.path.join(tmp_dir, f"{i}{extension}"))
+            stat = os.stat(os.path.join(tmp_dir, f"{i}{extension}"))
+            relative = os.path.relpath(os.path.abspath(path), os.path.abspath(spec["output_dir"]))
+            files.append({
+                "relative": None if relative.startswith(os.pardir) or os.path.isabs(relative) else relative,
+                "path": os.path.abspath(path),
+                "extension": extension,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            })
+        manifest = {"name": spec["name"], "type": spec["type"], "frames": frames, "render_time": render_time, "files": files, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        write_json_atomic(os.path.join(tmp_dir, "manifest.json"), manifest)
+        os.rename(tmp_dir, os.path.join(root, key))
+    except OSError:
+        # Another worker stored the same render first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    update_render_cache_stats(misses=1)
+    evict_render_cache(RENDER_CACHE_LIMIT_MB)
+
+
+def render_cache_entries():
+    root = cache_dir("renders")
+    entries = []
+    for key in os.listdir(root):
+        manifest_path = os.path.join(root, key, "manifest.json")
+        try:
+            last_used = os.stat(manifest_path).st_mtime
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        entries.append({"key": key, "name": manifest["name"], "last_used": last_used, "size": sum(f["size"] for f in manifest["files"]), "paths": [os.path.join(root, key)]})
+    # First-pass stats of two-pass compresses, last used = mtime of the .mbtree
+    root = cache_dir("passlogs")
+    for name in os.listdir(root):
+        if not name.endswith("-0.log.mbtree") or "." in name[:-len("-0.log.mbtree")]:
+            continue
+        prefix = os.path.join(root, name[:-len("-0.log.mbtree")])
+        paths = [prefix + "-0.log.mbtree", prefix + "-0.log"]
+        try:
+            stats = [os.stat(path) for path in paths]
+        except OSError:
+            continue
+        entries.append({"key": os.path.basename(prefix), "name": "first-pass stats", "last_used": stats[0].st_mtime, "size": sum(stat.st_size for stat in stats), "paths": paths})
+    return sorted(entries, key=lambda entry: entry["last_used"])
+
+
+def evict_render_cache(limit_mb):
+    # Oldest first until the cache fits; also clears entries and first-pass
+    # stats left half-written by a crash
+    root = cache_dir("renders")
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and "." in name and time.time() - os.path.getmtime(path) > 3600:
+            shutil.rmtree(path, ignore_errors=True)
+    root = cache_dir("passlogs")
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if "." in name.split("-0.log")[0] and time.time() - os.path.getmtime(path) > 3600:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+    entries = render_cache_entries()
+    total = sum(entry["size"] for entry in entries)
+    evicted = 0
+    while entries and total > limit_mb * 2**20:
+        entry = entries.pop(0)
+        for path in entry["paths"]:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+        total -= entry["size"]
+        evicted += 1
+    if evicted:
+        update_render_cache_stats(evictions=evicted)
+    return evicted
+
+
+def render_cache_stats():
+    try:
+        with open(os.path.join(cache_dir("renders"), "stats.json"), encoding="utf-8") as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = {}
+    entries = render_cache_entries()
+    return {"entries": len(entries), "size_mb": sum(entry["size"] for entry in entries) / 2**20, "limit_mb": RENDER_CACHE_LIMIT_MB,
+            "hits": stats.get("hits", 0), "misses": stats.get("misses", 0), "evictions": stats.get("evictions", 0), "seconds_saved": stats.get("seconds_saved", 0.0)}
+
+
+RENDERERS = {
+    "cut": render_cut,
+    "compress": render_compress,
+    "extract_audio": render_extract_audio,
+}
+
+
+def render_job(job, logger="bar", on_progress=None, context=None):
+    # on_progress(fraction, eta_seconds, stage) replaces MoviePy's console bars;
+    # pass a RenderContext instead to be able to cancel the render
+    spec = normalize_job(job)
+    # Renderers and ffmpeg expect the output folder to exist
+    os.makedirs(os.path.dirname(os.path.abspath(spec["output_file"])) if spec["output_file"] else spec["output_dir"], exist_ok=True)
+    if context is None:
+        context = RenderContext(logger=logger, on_progress=on_progress)
+    cached = key = None
+    if spec["render_cache"]:
+        with context.metrics.stage("cache"):
+            key = render_cache_key(spec)
+            cached = render_cache_lookup(spec, key)
+    if cached is not None:
+        output_files, frames = cached
+        context.progress(1.0)
+    else:
+        output_files, frames = RENDERERS[spec["type"]](spec, context)
+        if key is not None:
+            render_time = time.perf_counter() - context.metrics.started
+            with context.metrics.stage("cache"):
+                render_cache_store(spec, key, output_files, frames, render_time)
+    result = context.metrics.record(spec, output_files, frames)
+    result["cached"] = cached is not None
+    if spec["metrics_file"]:
+        os.makedirs(os.path.dirname(os.path.abspath(spec["metrics_file"])), exist_ok=True)
+        write_json_atomic(spec["metrics_file"], result)
+    return {"status": "ok", "output_file": output_files[0], **result}
+
+
+def expand_jobs(data):
+    # A plain list of jobs, {"defaults": {...}, "jobs": [...]} or a single job
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict) and "jobs" in data:
+        defaults = data.get("defaults", {})
+        return [{**defaults, **job} for job in data["jobs"]]
+    return [data]
+
+
+def load_jobs(jobs_file):
+    with open(jobs_file, "r", encoding="utf-8") as f:
+        return expand_jobs(json.load(f))
+
+
+def _run_batch_job(job):
+    try:
+        return render_job(job, logger=None)
+    except Exception as e:
+        return {"name": job.get("name") or os.path.basename(str(job.get("input_file"))), "type": job.get("type", "cut"), "status": "error", "error": str(e), "wall_time": 0.0, "frames": 0, "fps": None}
+
+
+def format_stages(stages):
+    return ", ".join(f"{name} {seconds:.1f}s" for name, seconds in stages.items() if seconds >= 0.05)
+
+
+def format_job_result(result):
+    if result["status"] != "ok":
+        return f"[error] {result['name']}: {result['error']}"
+    fps = f"{result['fps']:.1f} fps" if result["fps"] else "-"
+    if result.get("cached"):
+        return f"[ok]    {result['name']}: from the render cache -> {', '.join(result['output_files'])}"
+    return f"[ok]    {result['name']}: {result['wall_time']:.1f}s, {fps} ({format_stages(result['stages'])}) -> {', '.join(result['output_files'])}"
+
+
+def run_batch(jobs, workers=None, metrics_dir=None):
+    workers = max(1, workers or os.cpu_count() or 1)
+    if metrics_dir:
+        # One metrics record per job, numbered so jobs with the same name don't collide
+        jobs = [{"metrics_file": os.path.join(metrics_dir, f"{i:04d}_{os.path.basename(job.get('name') or str(job.get('input_file')))}.json"), **job} for i, job in enumerate(jobs)]
+    started = time.perf_counter()
+    results = []
+    print(f"Rendering {len(jobs)} job(s) with {workers} worker(s)")
+    # Workers import the media stack as soon as they start, while the first jobs are handed out
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_media_stack) as pool:
+        futures = [pool.submit(_run_batch_job, job) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(format_job_result(result), flush=True)
+
+    wall_time = time.perf_counter() - started
+    ok = [r for r in results if r["status"] == "ok"]
+    frames = sum(r["frames"] for r in ok)
+    print(f"{len(ok)}/{len(results)} job(s) succeeded in {wall_time:.1f}s ({frames / wall_time if wall_time > 0 else 0:.1f} fps overall)")
+    return results
+
+
+class JobQueue:
+    # Runs render jobs on at most max_workers background threads. Every entry
+    # goes pending -> running -> done / error / cancelled and cancel() works in
+    # any state. State changes and progress are posted to `events` as entry
+    # snapshots for the owner (the Tk thread) to drain; nothing here touches Tk.
+    FINISHED = ("done", "error", "cancelled")
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max(1, max_workers)
+        self.entries = {}
+        self.pending = collections.deque()
+        self.workers = 0
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+
+    def submit(self, job):
+        with self.lock:
+            entry = {
+                "id": self.next_id,
+                "job": job,
+                "name": job.get("name") or os.path.basename(job["input_file"]),
+                "type": job.get("type", "cut"),
+                "state": "pending",
+                "progress": 0.0,
+                "eta": None,
+                "stage": "",
+                "result": None,
+                "error": None,
+                "context": None,
+            }
+            self.next_id += 1
+            self.entries[entry["id"]] = entry
+            self.pending.append(entry["id"])
+            self._post(entry)
+            self._start_workers()
+        return entry["id"]
+
+    def set_max_workers(self, max_workers):
+        with self.lock:
+            # Extra workers retire after their current job when the cap goes down
+            self.max_workers = max(1, max_workers)
+            self._start_workers()
+
+    def cancel(self, job_id):
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if entry is None or entry["state"] in self.FINISHED:
+                return False
+            if entry["state"] == "pending":
+                self.pending.remove(job_id)
+                entry["state"] = "cancelled"
+                self._post(entry)
+                return True
+            context = entry["context"]
+        # The worker reports the running job as cancelled once it has stopped
+        context.cancel()
+        return True
+
+    def cancel_all(self):
+        with self.lock:
+            job_ids = [job_id for job_id, entry in self.entries.items() if entry["state"] not in self.FINISHED]
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def clear_finished(self):
+        with self.lock:
+            finished = [job_id for job_id, entry in self.entries.items() if entry["state"] in self.FINISHED]
+            for job_id in finished:
+                del self.entries[job_id]
+        return finished
+
+    def active_count(self):
+        with self.lock:
+            return sum(entry["state"] not in self.FINISHED for entry in self.entries.values())
+
+    def _post(self, entry):
+        self.events.put({key: value for key, value in entry.items() if key != "context"})
+
+    def _start_workers(self):
+        # Called with the lock held
+        while self.workers < min(self.max_workers, len(self.pending)):
+            self.workers += 1
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _progress(self, entry, fraction, eta, stage):
+        entry["progress"], entry["eta"], entry["stage"] = fraction, eta, stage
+        self._post(entry)
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                if not self.pending or self.workers > self.max_workers:
+                    self.workers -= 1
+                    return
+                entry = self.entries[self.pending.popleft()]
+                entry["context"] = RenderContext(on_progress=functools.partial(self._progress, entry))
+                entry["state"] = "running"
+                self._post(entry)
+
+            context = entry["context"]
+            try:
+                entry["result"] = render_job(entry["job"], context=context)
+                entry["progress"] = 1.0
+                entry["state"] = "done"
+            except Exception as e:
+                # Killing ffmpeg mid-frame surfaces as a broken pipe rather than RenderCancelled
+                entry["state"] = "cancelled" if context.cancelled.is_set() else "error"
+                entry["error"] = str(e)
+            with self.lock:
+                entry["context"] = None
+                self._post(entry)
+
+
+# Render service: `main.py serve` takes jobs from a watched drop folder (a
+# video plus a sidecar JSON job spec) and from a small local HTTP API, and
+# renders them on a JobQueue. Every state change is written to a SQLite file,
+# so after a restart or a crash the unfinished jobs are queued again in their
+# old order. Drops move inbox -> processing/ -> done/ or failed/, renders and
+# one log per job go to the output folder.
+SERVICE_POLL_SECONDS = 2.0
+SERVICE_MAX_RESTARTS = 3
+SERVICE_STATES = ("pending", "running", "done", "error", "cancelled")
+SERVICE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    job TEXT NOT NULL,
+    source TEXT,
+    state TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    restarts INTEGER NOT NULL DEFAULT 0,
+    submitted_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+)
+"""
+
+
+def sidecar_video(sidecar):
+    # clip.json or clip.mp4.json describes clip.mp4 in the same folder
+    base = os.path.splitext(sidecar)[0]
+    if base.lower().endswith(MEDIA_EXTENSIONS) and os.path.isfile(base):
+        return base
+    for extension in MEDIA_EXTENSIONS + tuple(extension.upper() for extension in MEDIA_EXTENSIONS):
+        if os.path.isfile(base + extension):
+            return base + extension
+    return None
+
+
+def is_below(path, folder):
+    # After resolving symlinks and "..", so neither can point out of folder
+    path, folder = os.path.realpath(path), os.path.realpath(folder)
+    return os.path.commonpath([path, folder]) == folder
+
+
+def unique_path(folder, name):
+    path = os.path.join(folder, name)
+    stem, extension = os.path.splitext(name)
+    counter = 2
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{stem}_{counter}{extension}")
+        counter += 1
+    return path
+
+
+class RenderService:
+    def __init__(self, db_file, output_dir, workers=1, watch_dir=None):
+        self.output_dir = os.path.realpath(output_dir)
+        self.log_dir = os.path.join(self.output_dir, "logs")
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.watch_dir = os.path.abspath(watch_dir) if watch_dir else None
+        if self.watch_dir:
+            for folder in ("processing", "done", "failed"):
+                os.makedirs(os.path.join(self.watch_dir, folder), exist_ok=True)
+        # One connection shared by the HTTP, watcher and event threads, always under self.lock
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SERVICE_SCHEMA)
+        self.queue = JobQueue(max_workers=workers)
+        self.lock = threading.Lock()
+        self.queue_ids = {}  # JobQueue id -> row id
+        self.row_ids = {}  # row id -> JobQueue id
+        self.live = {}  # row id -> progress of a running job
+        self.seen = {}  # sidecar -> sizes and mtimes at the previous scan
+        self.waiting = set()
+        self.stopping = threading.Event()
+        self.started = time.time()
+        self.server = None
+
+    def prepare_job(self, job, base_dir):
+        # Relative input paths are relative to base_dir and may not leave it,
+        # every output must land below the service's output folder. Raises
+        # ValueError for a job that can't run or would write anywhere else.
+        if not isinstance(job, dict):
+            raise ValueError("A job must be a JSON object.")
+        job = dict(job)
+        for key in RENDER_CACHE_FILE_KEYS:
+            if job.get(key) and not os.path.isabs(str(job[key])):
+                job[key] = os.path.join(base_dir, str(job[key]))
+                if not is_below(job[key], base_dir):
+                    raise ValueError(f"{key} is outside of {base_dir}: {job[key]}")
+        job["output_dir"] = os.path.join(self.output_dir, str(job.get("output_dir") or ""))
+        if job.get("output_file"):
+            job["output_file"] = os.path.join(job["output_dir"], str(job["output_file"]))
+        spec = normalize_job(job)
+        if not os.path.isfile(spec["input_file"]):
+            raise ValueError(f"Input file not found: {spec['input_file']}")
+        for path in self.output_paths(spec):
+            if not is_below(path, self.output_dir):
+                raise ValueError(f"Output is outside of {self.output_dir}: {path}")
+        return job
+
+    def output_paths(self, spec):
+        # Everywhere the job would write: its folder and files, the files of
+        # extra outputs and the per-range files of a cut list
+        paths = [spec["output_dir"]] + [spec[key] for key in ("output_file", "metrics_file") if spec[key]]
+        ranges = list(spec.get("ranges") or [])
+        if spec.get("ranges_file"):
+            try:
+                ranges += load_cut_list(spec["ranges_file"])
+            except (OSError, KeyError) as e:
+                raise ValueError(f"Can't read the cut list {spec['ranges_file']}: {e}")
+        for entry in list(spec.get("outputs") or []) + ranges:
+            if not isinstance(entry, dict):
+                raise ValueError(f"Outputs and ranges must be JSON objects: {entry!r}")
+        for output in spec.get("outputs") or []:
+            paths.append(output.get("output_file") or os.path.join(spec["output_dir"], str(output.get("name") or "")))
+        for cut in ranges:
+            output_dir = str(cut.get("output_dir") or spec["output_dir"])
+            paths += [output_dir, str(cut.get("output_file") or os.path.join(output_dir, f"{cut.get('name') or ''}.mp4"))]
+        return paths
+
+    def log_file(self, row_id, name, extension):
+        safe_name = re.sub(r"[^\w.-]+", "_", name)
+        return os.path.join(self.log_dir, f"{row_id:05d}_{safe_name}{extension}")
+
+    def submit(self, jobs, source=None):
+        # Jobs must have gone through prepare_job; all of them are stored or none
+        with self.lock:
+            with self.db:
+                ids = [self.db.execute(
+                    "INSERT INTO jobs (name, type, job, source, state, submitted_at) VALUES (?, ?, ?, ?, 'pending', ?)",
+                    (job.get("name") or os.path.basename(job["input_file"]), job.get("type", "cut"), json.dumps(job), source, time.strftime("%Y-%m-%dT%H:%M:%S")),
+                ).lastrowid for job in jobs]
+            for row_id, job in zip(ids, jobs):
+                self._enqueue(row_id, job)
+        return ids
+
+    def cancel(self, row_id):
+        # None for an unknown job, False if it has already finished
+        with self.lock:
+            row = self.db.execute("SELECT state FROM jobs WHERE id = ?", (row_id,)).fetchone()
+            if row is None:
+                return None
+            if row["state"] not in ("pending", "running") or row_id not in self.row_ids:
+                return False
+            return self.queue.cancel(self.row_ids[row_id])
+
+    def job_record(self, row):
+        record = dict(row)
+        record["job"] = json.loads(record["job"])
+        record["result"] = json.loads(record["result"]) if record["result"] else None
+        live = self.live.get(row["id"], {})
+        record["progress"] = 1.0 if row["state"] == "done" else live.get("progress", 0.0)
+        record["eta"] = live.get("eta")
+        record["stage"] = live.get("stage", "")
+        return record
+
+    def get_job(self, row_id):
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (row_id,)).fetchone()
+            return self.job_record(row) if row else None
+
+    def list_jobs(self, state=None):
+        with self.lock:
+            if state:
+                rows = self.db.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,)).fetchall()
+            else:
+                rows = self.db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            return [self.job_record(row) for row in rows]
+
+    def metrics(self):
+        with self.lock:
+            counts = dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            hits, frames, seconds = self.db.execute(
+                "SELECT SUM(json_extract(result, '$.cached')),"
+                " SUM(CASE WHEN json_extract(result, '$.cached') THEN 0 ELSE json_extract(result, '$.frames') END),"
+                " SUM(CASE WHEN json_extract(result, '$.cached') THEN 0 ELSE json_extract(result, '$.wall_time') END)"
+                " FROM jobs WHERE state = 'done'"
+            ).fetchone()
+        return {
+            "uptime": time.time() - self.started,
+            "workers": self.queue.max_workers,
+            "jobs": {state: counts.get(state, 0) for state in SERVICE_STATES},
+            "frames_rendered": frames or 0,
+            "render_seconds": seconds or 0.0,
+            "render_cache_hits": hits or 0,
+            "render_cache": render_cache_stats(),
+        }
+
+    def resume(self):
+        # Jobs that were running when the service died start over, unless they
+        # keep taking it down with them. Drops that were moved to processing/
+        # but never stored are picked up again.
+        with self.lock:
+            with self.db:
+                self.db.execute("UPDATE jobs SET state = 'pending', restarts = restarts + 1, started_at = NULL WHERE state = 'running'")
+            given_up = self.db.execute("SELECT id FROM jobs WHERE state = 'pending' AND restarts >= ?", (SERVICE_MAX_RESTARTS,)).fetchall()
+            for row in given_up:
+                self._finish(row["id"], "error", f"Interrupted {SERVICE_MAX_RESTARTS} times, giving up.", None)
+            rows = self.db.execute("SELECT id, job FROM jobs WHERE state = 'pending' ORDER BY id").fetchall()
+            for row in rows:
+                self._enqueue(row["id"], json.loads(row["job"]))
+            sources = {row["source"] for row in self.db.execute("SELECT DISTINCT source FROM jobs WHERE source IS NOT NULL")}
+        if self.watch_dir:
+            processing = os.path.join(self.watch_dir, "processing")
+            for name in sorted(os.listdir(processing)):
+                sidecar = os.path.join(processing, name)
+                if name.lower().endswith(".json") and sidecar not in sources:
+                    self.claim(sidecar, sidecar_video(sidecar))
+        return len(rows)
+
+    def scan_watch_dir(self):
+        # A drop is claimed once its sidecar and video have kept their size and
+        # mtime for one poll interval, so half-copied files are left alone
+        current = {}
+        for name in sorted(os.listdir(self.watch_dir)):
+            sidecar = os.path.join(self.watch_dir, name)
+            if not name.lower().endswith(".json") or not os.path.isfile(sidecar):
+                continue
+            video = sidecar_video(sidecar)
+            stamp = tuple((stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, filter(None, (sidecar, video))))
+            current[sidecar] = stamp
+            if self.seen.get(sidecar) == stamp:
+                self.claim(sidecar, video)
+        self.seen = current
+
+    def claim(self, sidecar, video):
+        # Queues the jobs of a drop and moves it to processing/; a drop that
+        # can't be read or rendered goes to failed/ with a log
+        name = os.path.basename(sidecar)
+        try:
+            with open(sidecar, "r", encoding="utf-8") as f:
+                jobs = expand_jobs(json.load(f))
+            if video is None and not all(isinstance(job, dict) and job.get("input_file") for job in jobs):
+                if sidecar not in self.waiting:
+                    print(f"{name}: waiting for its video")
+                    self.waiting.add(sidecar)
+                return
+            # Renders of a drop go to their own folder, named like the sidecar
+            defaults = {"output_dir": os.path.splitext(name)[0].split(".")[0]}
+            if video:
+                defaults["input_file"] = video
+            jobs = [self.prepare_job({**defaults, **job} if isinstance(job, dict) else job, self.watch_dir) for job in jobs]
+        except (OSError, ValueError, TypeError) as e:
+            self._reject(sidecar, video, str(e))
+            return
+        self.waiting.discard(sidecar)
+
+        processing = os.path.join(self.watch_dir, "processing")
+        if os.path.dirname(sidecar) != processing:
+            # The sidecar and video keep a common name, so a drop found in
+            # processing/ after a crash still pairs up
+            prefix, counter = "", 2
+            while any(os.path.exists(os.path.join(processing, prefix + os.path.basename(path))) for path in (sidecar, video) if path):
+                prefix, counter = f"{counter}_", counter + 1
+            if video:
+                moved_video = os.path.join(processing, prefix + os.path.basename(video))
+                os.replace(video, moved_video)
+                jobs = [{**job, "input_file": moved_video} if job["input_file"] == video else job for job in jobs]
+            moved_sidecar = os.path.join(processing, prefix + name)
+            os.replace(sidecar, moved_sidecar)
+            sidecar = moved_sidecar
+        ids = self.submit(jobs, source=sidecar)
+        print(f"{name}: queued job(s) {', '.join(f'#{row_id}' for row_id in ids)}")
+
+    def _reject(self, sidecar, video, error):
+        print(f"[error] {os.path.basename(sidecar)}: {error}")
+        failed = os.path.join(self.watch_dir, "failed")
+        for path in (sidecar, video):
+            if path and os.path.exists(path):
+                shutil.move(path, unique_path(failed, os.path.basename(path)))
+        log_file = unique_path(self.log_dir, os.path.basename(sidecar) + ".log")
+        with open(log_file, "w", encoding="utf-8") as f:
+            f.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {os.path.basename(sidecar)} rejected: {error}\n")
+        self.waiting.discard(sidecar)
+
+    def _enqueue(self, row_id, job):
+        # Called with the lock held, so the event thread always knows the ids
+        name = job.get("name") or os.path.basename(job["input_file"])
+        queue_id = self.queue.submit({"metrics_file": self.log_file(row_id, name, ".json"), **job})
+        self.queue_ids[queue_id] = row_id
+        self.row_ids[row_id] = queue_id
+
+    def _drain_events(self):
+        while True:
+            event = self.queue.events.get()
+            with self.lock:
+                row_id = self.queue_ids.get(event["id"])
+                # After stop() the cancelled jobs stay pending in the database
+                if row_id is None or self.stopping.is_set():
+                    continue
+                try:
+                    self._apply_event(row_id, event)
+                except Exception as e:
+                    # A failed log write or drop move must not stop the
+                    # bookkeeping of every later job
+                    print(f"#{row_id} [error] Service error: {e}", flush=True)
+                    self._abandon(row_id, event["id"], f"Service error: {e}")
+
+    def _apply_event(self, row_id, event):
+        if event["state"] == "running":
+            if row_id not in self.live:
+                with self.db:
+                    self.db.execute("UPDATE jobs SET state = 'running', started_at = ? WHERE id = ?", (time.strftime("%Y-%m-%dT%H:%M:%S"), row_id))
+            self.live[row_id] = {"progress": event["progress"], "eta": event["eta"], "stage": event["stage"]}
+        elif event["state"] in JobQueue.FINISHED:
+            del self.queue_ids[event["id"]]
+            del self.row_ids[row_id]
+            self.live.pop(row_id, None)
+            self._finish(row_id, event["state"], event["error"], event["result"])
+            self.queue.clear_finished()
+
+    def _abandon(self, row_id, queue_id, error):
+        # Called with the lock held: stops the job if it still runs and
+        # records it as an error, as far as the database allows
+        self.queue_ids.pop(queue_id, None)
+        self.row_ids.pop(row_id, None)
+        self.live.pop(row_id, None)
+        self.queue.cancel(queue_id)
+        try:
+            with self.db:
+                self.db.execute("UPDATE jobs SET state = 'error', error = ?, finished_at = ? WHERE id = ?", (error, time.strftime("%Y-%m-%dT%H:%M:%S"), row_id))
+        except sqlite3.Error as e:
+            print(f"#{row_id}: the error could not be recorded: {e}")
+
+    def _finish(self, row_id, state, error, result):
+        # Called with the lock held: stores the outcome, writes the job's log
+        # and files away its drop once all jobs of the drop are finished
+        with self.db:
+            self.db.execute(
+                "UPDATE jobs SET state = ?, error = ?, result = ?, finished_at = ? WHERE id = ?",
+                (state, error, json.dumps(result) if result else None, time.strftime("%Y-%m-%dT%H:%M:%S"), row_id),
+            )
+        row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (row_id,)).fetchone()
+        if result:
+            summary = format_job_result(result)
+        else:
+            summary = f"[{state}] {row['name']}" + (f": {error}" if error else "")
+        print(f"#{row_id} {summary}", flush=True)
+        lines = [
+            f"Job #{row_id} ({row['type']}): {state}",
+            f"Submitted {row['submitted_at']}, started {row['started_at'] or '-'}, finished {row['finished_at']}",
+        ]
+        if row["restarts"]:
+            lines.append(f"Started over {row['restarts']} time(s) after the service was interrupted")
+        lines += [summary, json.dumps(json.loads(row["job"]), indent=2)]
+        with open(self.log_file(row_id, row["name"], ".log"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        if row["source"]:
+            self._file_drop(row["source"])
+
+    def _file_drop(self, sidecar):
+        rows = self.db.execute("SELECT state, job FROM jobs WHERE source = ?", (sidecar,)).fetchall()
+        if any(row["state"] in ("pending", "running") for row in rows):
+            return
+        folder = os.path.join(self.watch_dir or os.path.dirname(os.path.dirname(sidecar)), "done" if all(row["state"] == "done" for row in rows) else "failed")
+        processing = os.path.dirname(sidecar)
+        inputs = {json.loads(row["job"])["input_file"] for row in rows}
+        for path in [sidecar] + sorted(path for path in inputs if os.path.dirname(path) == processing):
+            if os.path.exists(path):
+                shutil.move(path, unique_path(folder, os.path.basename(path)))
+
+    def _watch(self):
+        while not self.stopping.wait(SERVICE_POLL_SECONDS):
+            try:
+                self.scan_watch_dir()
+            except OSError as e:
+                print(f"Scanning {self.watch_dir} failed: {e}")
+
+    def start(self, host="127.0.0.1", port=8765):
+        threading.Thread(target=self._drain_events, daemon=True).start()
+        resumed = self.resume()
+        self.server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+        self.server.service = self
+        if self.watch_dir:
+            threading.Thread(target=self._watch, daemon=True).start()
+        print(f"Serving on http://{host}:{self.server.server_port} with {self.queue.max_workers} worker(s), {resumed} job(s) resumed")
+        if self.watch_dir:
+            print(f"Watching {self.watch_dir} for videos with a sidecar .json, output in {self.output_dir}")
+        threading.Thread(target=warm_up_media_stack, daemon=True).start()
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        # Running jobs go back to pending without counting as a restart and
+        # start over on the next run; their ffmpeg processes are killed
+        with self.lock:
+            self.stopping.set()
+            with self.db:
+                self.db.execute("UPDATE jobs SET state = 'pending', started_at = NULL WHERE state = 'running'")
+        self.queue.cancel_all()
+        self.server.server_close()
+        with self.lock:
+            self.db.close()
+        print("Service stopped")
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    # GET /jobs[?state=...], GET /jobs/<id>, GET /metrics,
+    # POST /jobs (a job, a list or {"defaults": ..., "jobs": [...]}), POST /jobs/<id>/cancel
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            state = parse_qs(url.query).get("state", [None])[0]
+            self.send_json(200, service.list_jobs(state))
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            record = service.get_job(int(parts[1]))
+            if record is None:
+                self.send_json(404, {"error": "No such job."})
+            else:
+                self.send_json(200, record)
+        elif parts == ["metrics"]:
+            self.send_json(200, service.metrics())
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        service = self.server.service
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts == ["jobs"]:
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"null")
+                # Paths are on this machine, relative ones from where the service runs
+                jobs = [service.prepare_job(job, os.getcwd()) for job in expand_jobs(data)]
+            except (ValueError, TypeError) as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            self.send_json(201, {"ids": service.submit(jobs)})
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[1].isdigit() and parts[2] == "cancel":
+            cancelled = service.cancel(int(parts[1]))
+            if cancelled is None:
+                self.send_json(404, {"error": "No such job."})
+            elif not cancelled:
+                self.send_json(409, {"error": "The job has already finished."})
+            else:
+                self.send_json(202, {"id": int(parts[1]), "cancelling": True})
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Job state changes are printed already, a line per request is just noise
+        pass
+
+
+PARITY_CASES = (
+    ("resize", {}),
+    ("speed/rotate/colour", {"video_speed": 1.5, "video_rotation": 90, "brightness": 12.0, "contrast": 0.25}),
+    ("watermark", {"watermark_text": "@cutitout", "watermark_position": "Bottom Right"}),
+    ("free rotation", {"video_rotation": 15}),
+    ("multi output", {"outputs": [{"width": 360, "height": 640}, {"width": 640, "height": 360}]}),
+)
+
+
+def sample_video_frames(path, samples=30):
+    # Every n-th frame as RGB, enough to compare two renders without holding all of them
+    info = read_media_info(path)
+    step = max(1, int(info["duration"] * info["fps"]) // samples)
+    raw = run_ffmpeg(["-i", path, "-map", "0:v:0", "-vf", f"select='not(mod(n,{step}))'", "-fps_mode", "passthrough", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"], capture_stdout=True)[0]
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, info["height"], info["width"], 3)
+
+
+def sample_audio(path, rate=ANALYSIS_RATE):
+    # Mono PCM of the first audio stream, None if there is none
+    if read_media_info(path)["audio_codec"] is None:
+        return None
+    raw = run_ffmpeg(["-i", path, "-map", "0:a:0", "-vn", "-ac", 1, "-ar", rate, "-f", "f32le", "-"], capture_stdout=True)[0]
+    return np.frombuffer(raw, dtype=np.float32)
+
+
+def audio_similarity(a, b, window=1024):
+    # Cosine similarity of the average magnitude spectra: 1.0 for the same
+    # pitch and timbre, low when one render is shifted or silent
+    spectra = []
+    for samples in (a, b):
+        frames = samples[:len(samples) // window * window].reshape(-1, window)
+        if not len(frames):
+            return 0.0
+        spectra.append(np.abs(np.fft.rfft(frames * np.hanning(window), axis=1)).mean(axis=0))
+    norms = np.linalg.norm(spectra[0]) * np.linalg.norm(spectra[1])
+    if norms == 0:
+        return 1.0 if not spectra[0].any() and not spectra[1].any() else 0.0
+    return float(spectra[0] @ spectra[1] / norms)
+
+
+def check_backend_parity(jobs, min_psnr=30.0, min_audio_similarity=0.9, max_audio_drift=0.1):
+    # Render every cut job with both backends and compare sampled frames, the
+    # audio length and the audio spectrum
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="cutitout_parity_") as tmp_dir:
+        for i, job in enumerate(jobs):
+            results = {}
+            for backend in ("moviepy", "ffmpeg"):
+                output_dir = os.path.join(tmp_dir, f"{i}_{backend}")
+                os.makedirs(output_dir)
+                results[backend] = render_job({**job, "type": "cut", "backend": backend, "smart_cut": False, "render_cache": False, "output_dir": output_dir, "output_file": None}, logger=None)
+            for reference_file, native_file in zip(results["moviepy"]["output_files"], results["ffmpeg"]["output_files"]):
+                reference, native = sample_video_frames(reference_file), sample_video_frames(native_file)
+                count = min(len(reference), len(native))
+                if reference.shape[1:] != native.shape[1:] or count == 0:
+                    psnr = [0.0]
+                else:
+                    psnr = [min(cv2.PSNR(a, b), 99.0) for a, b in zip(reference[:count], native[:count])]
+                ok = reference.shape[1:] == native.shape[1:] and abs(len(reference) - len(native)) <= 1 and min(psnr) >= min_psnr
+                reference_audio, native_audio = sample_audio(reference_file), sample_audio(native_file)
+                if reference_audio is None or native_audio is None:
+                    similarity, drift = (1.0, 0.0) if reference_audio is native_audio else (0.0, None)
+                else:
+                    similarity = audio_similarity(reference_audio, native_audio)
+                    drift = abs(len(reference_audio) - len(native_audio)) / ANALYSIS_RATE
+                ok = ok and similarity >= min_audio_similarity and drift is not None and drift <= max_audio_drift
+                rows.append((job.get("name") or f"job {i}", os.path.basename(reference_file), min(psnr), sum(psnr) / len(psnr), similarity, drift, results["moviepy"]["wall_time"], results["ffmpeg"]["wall_time"], ok))
+
+    print(f"{'job':<22}{'output':<34}{'min PSNR':>10}{'mean':>8}{'audio':>7}{'drift':>8}{'moviepy':>10}{'ffmpeg':>9}")
+    for name, output, worst, mean, similarity, drift, moviepy_time, native_time, ok in rows:
+        drift = f"{drift:.2f}s" if drift is not None else "-"
+        print(f"{name:<22}{output:<34}{worst:>7.1f} dB{mean:>8.1f}{similarity:>7.2f}{drift:>8}{moviepy_time:>9.1f}s{native_time:>8.1f}s  {'ok' if ok else 'MISMATCH'}")
+    return rows
+
+
+def moviepy_transform_chain(clip, width, height, rotation=0, brightness=0.0, contrast=0.0):
+    # The per-effect MoviePy chain FrameTransform replaced, kept for benchmarking
+    source_width, source_height = clip.size
+    if rotation != 0:
+        clip = rotate(clip, angle=rotation)
+    if contrast != 0.0 or brightness != 0.0:
+        clip = lum_contrast(clip, lum=brightness, contrast=contrast)
+    x0, y0, x1, y1 = center_crop_box(source_width, source_height, width / height)
+    if (x1 - x0, y1 - y0) != (source_width, source_height):
+        clip = crop(clip, x1=x0, y1=y0, x2=x1, y2=y1)
+    return resize(clip, newsize=(width, height))
+
+
+def bench_frame_transform(frames=60, width=1080, height=1920, rotation=0, brightness=10.0, contrast=0.2):
+    rows = []
+    for label, (source_width, source_height) in (("1080p", (1920, 1080)), ("4K", (3840, 2160))):
+        # Horizontal/vertical gradients so no step can shortcut on flat input
+        x = np.linspace(0, 255, source_width, dtype=np.float32)
+        y = np.linspace(0, 255, source_height, dtype=np.float32)[:, None]
+        frame = np.dstack([np.broadcast_to(x, (source_height, source_width)), np.broadcast_to(y, (source_height, source_width)), (x + y) / 2]).astype(np.uint8)
+        source = VideoClip(lambda t: frame, duration=frames)
+
+        timings = {}
+        for name, clip in (
+            ("moviepy chain", moviepy_transform_chain(source, width, height, rotation, brightness, contrast)),
+            ("fused kernel", source.fl_image(FrameTransform(width, height, rotation, brightness, contrast))),
+        ):
+            clip.get_frame(0)  # warm-up
+            started = time.perf_counter()
+            for i in range(frames):
+                clip.get_frame(i)
+            timings[name] = (time.perf_counter() - started) / frames * 1000
+        rows.append((label, timings["moviepy chain"], timings["fused kernel"]))
+
+    print(f"Frame transform to {width}x{height}, rotation {rotation}, lum {brightness}, contrast {contrast} ({frames} frames)")
+    print(f"{'input':<8}{'moviepy chain':>16}{'fused kernel':>16}{'speedup':>10}")
+    for label, chain_ms, fused_ms in rows:
+        print(f"{label:<8}{chain_ms:>13.2f} ms{fused_ms:>13.2f} ms{chain_ms / fused_ms:>9.1f}x")
+    return rows
+
+
+def bench_segmented_compress(input_file, segment_seconds=30, workers=None, width=1280, height=720, video_bitrate=4000):
+    # Serial MoviePy encode vs. parallel segments with the same settings
+    info = probe_media(input_file)
+    job = {"type": "compress", "input_file": input_file, "width": width, "height": height, "framerate": round(info["fps"]), "video_bitrate": video_bitrate, "audio_bitrate": 128}
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="cutitout_bench_") as tmp_dir:
+        for label, extra in (("serial", {}), ("segmented", {"segment_seconds": segment_seconds, "segment_workers": workers})):
+            result = render_job({**job, **extra, "render_cache": False, "output_file": os.path.join(tmp_dir, f"{label}.mp4")}, logger=None)
+            rows.append((label, result["wall_time"], read_media_info(result["output_file"])["video_bitrate"]))
+
+    print(f"Compress {os.path.basename(input_file)} ({info['duration']:.0f}s) to {width}x{height} @ {video_bitrate}k, {workers or os.cpu_count()} worker(s)")
+    serial_time = rows[0][1]
+    for label, wall_time, bitrate in rows:
+        print(f"{label:<10}{wall_time:>8.1f}s{serial_time / wall_time:>7.2f}x   video {bitrate}k")
+    return rows
+
+
+def bench_frame_pipeline(input_file, workers=None, seconds=10, width=1080, height=1920):
+    # Serial frame loop vs. the shared-memory worker pipeline on the same cut
+    workers = workers or os.cpu_count() or 1
+    job = {"input_file": input_file, "start_time": 0, "end_time": seconds, "width": width, "height": height, "framerate": 30, "smart_cut": False, "brightness": 10.0, "contrast": 0.2, "watermark_text": "@cutitout"}
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="cutitout_bench_") as tmp_dir:
+        for label, frame_workers in (("serial", None), (f"{workers} workers", workers)):
+            result = render_job({**job, "frame_workers": frame_workers, "render_cache": False, "output_file": os.path.join(tmp_dir, "out.mp4")}, logger=None)
+            rows.append((label, result["wall_time"], result["fps"]))
+
+    print(f"Cut {seconds}s of {os.path.basename(input_file)} to {width}x{height}")
+    serial_time = rows[0][1]
+    for label, wall_time, fps in rows:
+        print(f"{label:<12}{wall_time:>8.1f}s{fps:>8.1f} fps{serial_time / wall_time:>7.2f}x")
+    return rows
+
+
+# Run in a fresh interpreter by bench_startup; prints the time.time() of each milestone
+STARTUP_PROBE = """
+import json, os, sys, time
+sys.path.insert(0, sys.argv[1])
+import main
+marks = {"import main": time.time()}
+root = None
+if main.tk is not None and (os.name == "nt" or os.environ.get("DISPLAY")):
+    root = main.ttk.Window(themename="superhero")
+    app = main.VideoCutterApp(root)
+    root.update()
+    marks["first window"] = time.time()
+main.load_media_stack()
+marks["media stack"] = time.time()
+if len(sys.argv) > 2:
+    source = main.SourceVideo(sys.argv[2], main.RenderContext(logger=None))
+    source.clip().get_frame(0)
+    source.close()
+    marks["first frame"] = time.time()
+if root is not None:
+    root.destroy()
+print(json.dumps(marks))
+"""
+
+
+def bench_startup(input_file=None, runs=5):
+    # Milestones in seconds since the process was launched, median of several cold starts
+    samples = collections.defaultdict(list)
+    for _ in range(runs):
+        launched = time.time()
+        proc = subprocess.run([sys.executable, "-c", STARTUP_PROBE, os.path.dirname(os.path.abspath(__file__))] + ([input_file] if input_file else []),
+                              capture_output=True, text=True, check=True)
+        for milestone, at in json.loads(proc.stdout.strip().splitlines()[-1]).items():
+            samples[milestone].append(at - launched)
+
+    print(f"Startup, median of {runs} run(s){'' if 'first window' in samples else ' (no display, window skipped)'}")
+    rows = []
+    for milestone, times in samples.items():
+        rows.append((milestone, sorted(times)[len(times) // 2]))
+        print(f"{milestone:<14}{rows[-1][1]:>8.3f}s")
+    return rows
+
+
+# Benchmark suite: synthetic fixtures made by ffmpeg's lavfi sources (SMPTE
+# bars with a moving test pattern over them, a beeping tone, a chord as
+# music), so every machine times the same media without downloading any.
+# Every case runs in a fresh process with an empty cache, which keeps the
+# timings cold and the peak RSS the case's own. A saved run is a baseline the
+# next run is checked against.
+BENCH_SIZES = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+BENCH_CASES = ("cut", "compress", "extract_audio", "process_audio", "text_watermark")
+BENCH_FIXTURE_VERSION = 1
+
+
+def bench_fixture(kind, seconds):
+    path = os.path.join(cache_dir("bench"), f"{kind}_v{BENCH_FIXTURE_VERSION}_{seconds:g}s.{'m4a' if kind == 'music' else 'mp4'}")
+    if os.path.exists(path):
+        return path
+    if kind == "music":
+        graph = f"aevalsrc='0.3*sin(2*PI*220*t)+0.2*sin(2*PI*277.2*t)|0.3*sin(2*PI*329.6*t)':s=48000:d={seconds}[a]"
+        args = ["-map", "[a]", "-c:a", "aac", "-b:a", "192k"]
+    else:
+        width, height = BENCH_SIZES[kind]
+        graph = (f"smptehdbars=size={width}x{height}:rate=30[bars];testsrc2=size={width // 2}x{height // 2}:rate=30[pattern];"
+                 f"[bars][pattern]overlay=x='(W-w)/2*(1+sin(t))':y='(H-h)/2*(1+cos(0.7*t))'[v];"
+                 f"sine=frequency=440:beep_factor=4:sample_rate=48000[a]")
+        # One encoder thread, so the fixture is bit-identical everywhere
+        args = ["-map", "[v]", "-map", "[a]", "-c:v", "libx264", "-preset", "veryfast", "-crf", 20, "-g", 60, "-pix_fmt", "yuv420p", "-threads", 1, "-c:a", "aac", "-b:a", "128k"]
+    tmp_path = f"{path}.{os.getpid()}{os.path.splitext(path)[1]}"
+    run_ffmpeg(["-filter_complex", graph] + args + ["-t", seconds, tmp_path])
+    os.replace(tmp_path, path)
+    return path
+
+
+def run_bench_case(case, fixture, music, seconds, tmp_dir):
+    # In a fresh process, see bench_suite
+    os.environ["CUTITOUT_CACHE_DIR"] = os.path.join(tmp_dir, "cache")
+    load_media_stack()
+    frames = None
+    started = time.perf_counter()
+    if case in ("cut", "compress", "extract_audio"):
+        job = {"type": case, "input_file": fixture, "output_dir": tmp_dir, "render_cache": False}
+        if case == "cut":
+            job.update({"end_time": seconds, "width": 720, "height": 1280, "framerate": 30, "brightness": 10, "contrast": 0.1, "smart_cut": False})
+        elif case == "compress":
+            info = probe_media(fixture)
+            job.update({"width": info["width"] // 2, "height": info["height"] // 2, "framerate": 30, "video_bitrate": 4000})
+        else:
+            job.update({"audio_format": "mp3"})
+        frames = render_job(job, logger=None)["frames"]
+    elif case == "process_audio":
+        with contextlib.closing(VideoFileClip(fixture)) as video:
+            mixed = process_audio(video, music, 0.5, fade_in=1.0, fade_out=1.0, duck=0.3)
+            for _ in mixed.audio.iter_chunks(chunksize=MIX_FPS, fps=MIX_FPS):
+                pass
+    else:
+        # A few decoded frames replayed, so the watermark and not the decoder is timed
+        with contextlib.closing(VideoFileClip(fixture)) as video:
+            cached = [video.get_frame(i / 30) for i in range(10)]
+        for frame in cached:
+            frame.flags.writeable = False
+        clip = add_text_watermark(VideoClip(lambda t: cached[int(round(t * 30)) % len(cached)], duration=seconds), "@cutitout", "Bottom Right")
+        started = time.perf_counter()
+        frames = sum(1 for _ in clip.iter_frames(fps=30, dtype="uint8"))
+    wall_time = time.perf_counter() - started
+    peak_rss, peak_child_rss = peak_rss_mb()
+    return {"wall_time": wall_time, "frames": frames, "fps": frames / wall_time if frames else None, "peak_rss_mb": peak_rss, "peak_child_rss_mb": peak_child_rss}
+
+
+def bench_environment():
+    load_media_stack()
+    return {"python": sys.version.split()[0], "platform": sys.platform, "cpu_count": os.cpu_count(), "numpy": np.__version__, "opencv": cv2.__version__, **encoder_versions()}
+
+
+def bench_suite(sizes=tuple(BENCH_SIZES), cases=BENCH_CASES, seconds=4.0, runs=1, baseline_file=None, save_file=None, threshold=0.15):
+    # Best of `runs` wall times per size and case; returns False on a regression against the baseline
+    music = bench_fixture("music", seconds)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="cutitout_bench_") as tmp_dir:
+        for size in sizes:
+            fixture = bench_fixture(size, seconds)
+            for case in cases:
+                samples = []
+                for _ in range(runs):
+                    with multiprocessing.get_context("spawn").Pool(1) as pool:
+                        samples.append(pool.apply(run_bench_case, (case, fixture, music, seconds, tmp_dir)))
+                results[f"{size}/{case}"] = min(samples, key=lambda sample: sample["wall_time"])
+                print(f"{size}/{case}: {results[f'{size}/{case}']['wall_time']:.2f}s")
+
+    baseline = None
+    if baseline_file:
+        with open(baseline_file, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print(f"\n{'case':<24}{'wall':>9}{'fps':>9}{'peak RSS':>11}{'child RSS':>11}" + ("   vs. baseline" if baseline else ""))
+    ok = True
+    for key, result in results.items():
+        fps = f"{result['fps']:.1f}" if result["fps"] else "-"
+        line = f"{key:<24}{result['wall_time']:>8.2f}s{fps:>9}{result['peak_rss_mb'] or 0:>8.0f} MB{result['peak_child_rss_mb'] or 0:>8.0f} MB"
+        if baseline and key in baseline:
+            time_ratio = result["wall_time"] / baseline[key]["wall_time"]
+            rss_ratio = (result["peak_rss_mb"] or 0) / (baseline[key]["peak_rss_mb"] or 1)
+            regressed = time_ratio > 1 + threshold or rss_ratio > 1 + threshold
+            ok = ok and not regressed
+            line += f"   time {time_ratio - 1:+.0%}, RSS {rss_ratio - 1:+.0%}" + ("  REGRESSION" if regressed else "")
+        print(line)
+
+    if save_file:
+        write_json_atomic(save_file, {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "seconds": seconds, "runs": runs, "environment": bench_environment(), "results": results})
+        print(f"Results written to {save_file}")
+    if baseline and not ok:
+        print(f"Slower or bigger than the baseline by more than {threshold:.0%}")
+    return ok
+
 
 class VideoCutterApp:
+    TIMELINE_WIDTH = 640
+    TIMELINE_HEIGHT = 48
+    PREVIEW_HEIGHT = 270
+
     def __init__(self, root):
         self.root = root
         self.root.title("Py - Cut It Out")
+        self.job_queue = JobQueue(max_workers=1)
+        self.tracked_job_id = None
+        self.finished_jobs = []
+        self.ui_calls = queue.Queue()
         self.setup_ui()
 
         self.input_file = None
+        self.compress_input_file = None
+        self.audio_input_file = None
+        self.audio_input_files = None
         self.audio_file = None
         self.watermark_text = None
 
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(100, self.poll_job_queue)
+        # Once the window is drawn, import the media stack in the background so
+        # it is ready by the time the first file is opened or job is queued
+        self.root.after_idle(lambda: threading.Thread(target=warm_up_media_stack, daemon=True).start())
+
     def setup_ui(self):
         notebook = ttk.Notebook(self.root, bootstyle="primary")
         notebook.pack(fill='both', expand=True)
@@ -28,14 +3634,17 @@ class VideoCutterApp:
         self.video_cut_tab = ttk.Frame(notebook)
         self.audio_extract_tab = ttk.Frame(notebook)
         self.video_compress_tab = ttk.Frame(notebook)
+        self.queue_tab = ttk.Frame(notebook)
 
         notebook.add(self.video_cut_tab, text='Video Cutter')
         notebook.add(self.audio_extract_tab, text='Audio Extractor')
         notebook.add(self.video_compress_tab, text='Video Compressor')
+        notebook.add(self.queue_tab, text='Queue')
 
         self.setup_video_cutter_ui(self.video_cut_tab)
         self.setup_audio_extractor_ui(self.audio_extract_tab)
         self.setup_video_compressor_ui(self.video_compress_tab)
+        self.setup_queue_ui(self.queue_tab)
 
     def setup_video_cutter_ui(self, tab):
         main_frame = ttk.Frame(tab)
@@ -44,6 +3653,14 @@ class VideoCutterApp:
         basic_settings_frame = ttk.Labelframe(main_frame, text="Basic Settings")
         basic_settings_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
+        timeline_frame = ttk.Labelframe(main_frame, text="Timeline")
+        timeline_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.setup_timeline_ui(timeline_frame)
+
+        cut_list_frame = ttk.Labelframe(main_frame, text="Cut List")
+        cut_list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.setup_cut_list_ui(cut_list_frame)
+
         advanced_settings_frame = ttk.Labelframe(main_frame, text="Advanced Settings")
         advanced_settings_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
@@ -59,14 +3676,16 @@ class VideoCutterApp:
         ttk.Button(basic_settings_frame, text="Browse", command=self.select_audio_file, bootstyle="primary").grid(row=1, column=2, padx=10, pady=10)
 
         ttk.Label(basic_settings_frame, text="Start Time (seconds):").grid(row=2, column=0, padx=10, pady=10, sticky=tk.W)
-        self.start_time_var = tk.IntVar(value=0)
+        self.start_time_var = tk.DoubleVar(value=0)
         self.start_time_entry = ttk.Entry(basic_settings_frame, textvariable=self.start_time_var)
         self.start_time_entry.grid(row=2, column=1, padx=10, pady=10, sticky=tk.W)
 
         ttk.Label(basic_settings_frame, text="End Time (seconds):").grid(row=3, column=0, padx=10, pady=10, sticky=tk.W)
-        self.end_time_var = tk.IntVar(value=60)
+        self.end_time_var = tk.DoubleVar(value=60)
         self.end_time_entry = ttk.Entry(basic_settings_frame, textvariable=self.end_time_var)
         self.end_time_entry.grid(row=3, column=1, padx=10, pady=10, sticky=tk.W)
+        self.start_time_var.trace_add("write", lambda *args: self.draw_timeline_marks())
+        self.end_time_var.trace_add("write", lambda *args: self.draw_timeline_marks())
 
         ttk.Label(basic_settings_frame, text="Width:").grid(row=4, column=0, padx=10, pady=10, sticky=tk.W)
         self.width_var = tk.IntVar(value=1080)
@@ -86,11 +3705,22 @@ class VideoCutterApp:
         self.resolution_combobox.grid(row=6, column=1, padx=10, pady=10, sticky=tk.W)
         self.resolution_combobox.bind("<<ComboboxSelected>>", self.update_resolution)
 
-        ttk.Button(basic_settings_frame, text="Cut It Out!", command=self.cut_video, bootstyle="success").grid(row=7, column=0, columnspan=3, pady=20)
+        # Ticking presets renders all of them from a single decode
+        ttk.Label(basic_settings_frame, text="Also Render Presets:").grid(row=7, column=0, padx=10, pady=10, sticky=tk.W)
+        presets_frame = ttk.Frame(basic_settings_frame)
+        presets_frame.grid(row=7, column=1, columnspan=2, padx=10, pady=10, sticky=tk.W)
+        self.preset_vars = {}
+        for i, resolution in enumerate(r for r in self.resolutions if not r.startswith("<--")):
+            self.preset_vars[resolution] = tk.BooleanVar(value=False)
+            ttk.Checkbutton(presets_frame, text=resolution, variable=self.preset_vars[resolution]).grid(row=i // 3, column=i % 3, padx=5, pady=2, sticky=tk.W)
+
+        ttk.Button(basic_settings_frame, text="Cut It Out!", command=self.cut_video, bootstyle="success").grid(row=8, column=0, columnspan=3, pady=20)
 
         self.progress_var = tk.IntVar()
-        self.progress_bar = ttk.Progressbar(basic_settings_frame, orient=tk.HORIZONTAL, length=400, mode='indeterminate', variable=self.progress_var)
-        self.progress_bar.grid(row=8, column=0, columnspan=3, padx=10, pady=10)
+        self.progress_bar = ttk.Progressbar(basic_settings_frame, orient=tk.HORIZONTAL, length=400, mode='determinate', maximum=100, variable=self.progress_var)
+        self.progress_bar.grid(row=9, column=0, columnspan=3, padx=10, pady=(10, 0))
+        self.progress_label = ttk.Label(basic_settings_frame, text="")
+        self.progress_label.grid(row=10, column=0, columnspan=3, padx=10, pady=(0, 10))
 
         # Advanced Settings
         self.show_advanced = tk.BooleanVar(value=False)
@@ -177,6 +3807,30 @@ class VideoCutterApp:
         self.watermark_position_combobox.grid(row=9, column=2, padx=10, pady=10, sticky=tk.W)
         self.advanced_widgets.append(self.watermark_position_combobox)
 
+        self.watermark_image_label = ttk.Label(advanced_settings_frame, text="Watermark Logo (optional):")
+        self.watermark_image_label.grid(row=10, column=0, padx=10, pady=10, sticky=tk.W)
+        self.watermark_image_var = tk.StringVar()
+        self.watermark_image_entry = ttk.Entry(advanced_settings_frame, textvariable=self.watermark_image_var)
+        self.watermark_image_entry.grid(row=10, column=1, padx=10, pady=10, sticky=tk.W)
+        self.watermark_image_button = ttk.Button(advanced_settings_frame, text="Browse", command=self.select_watermark_image, bootstyle="primary")
+        self.watermark_image_button.grid(row=10, column=2, padx=10, pady=10, sticky=tk.W)
+        self.advanced_widgets.extend([self.watermark_image_label, self.watermark_image_entry, self.watermark_image_button])
+
+        self.music_fade_label = ttk.Label(advanced_settings_frame, text="Music Fade In/Out (s):")
+        self.music_fade_label.grid(row=11, column=0, padx=10, pady=10, sticky=tk.W)
+        self.music_fade_var = tk.DoubleVar(value=0.0)
+        self.music_fade_entry = ttk.Entry(advanced_settings_frame, textvariable=self.music_fade_var)
+        self.music_fade_entry.grid(row=11, column=1, padx=10, pady=10, sticky=tk.W)
+        self.music_duck_var = tk.BooleanVar(value=False)
+        self.music_duck_checkbox = ttk.Checkbutton(advanced_settings_frame, text="Duck Music Under Video Audio", variable=self.music_duck_var)
+        self.music_duck_checkbox.grid(row=11, column=2, padx=10, pady=10, sticky=tk.W)
+        self.advanced_widgets.extend([self.music_fade_label, self.music_fade_entry, self.music_duck_checkbox])
+
+        self.native_backend_var = tk.BooleanVar(value=False)
+        self.native_backend_checkbox = ttk.Checkbutton(advanced_settings_frame, text="Render With ffmpeg Filters (faster)", variable=self.native_backend_var)
+        self.native_backend_checkbox.grid(row=12, column=0, columnspan=2, padx=10, pady=10, sticky=tk.W)
+        self.advanced_widgets.append(self.native_backend_checkbox)
+
         # Hide advanced settings initially
         self.toggle_advanced_settings()
         
@@ -217,6 +3871,7 @@ class VideoCutterApp:
         self.audio_input_file_entry = ttk.Entry(tab, width=50)
         self.audio_input_file_entry.grid(row=0, column=1, padx=10, pady=10)
         ttk.Button(tab, text="Browse", command=self.select_audio_input_file, bootstyle="primary").grid(row=0, column=2, padx=10, pady=10)
+        ttk.Button(tab, text="Folder", command=self.select_audio_input_folder, bootstyle="primary").grid(row=0, column=3, padx=10, pady=10)
 
         ttk.Label(tab, text="Output Audio Format:").grid(row=1, column=0, padx=10, pady=10)
         self.audio_format_var = tk.StringVar(value='mp3')
@@ -276,26 +3931,400 @@ class VideoCutterApp:
         self.compress_video_tone_slider = ttk.Scale(tab, from_=0, to=3, orient=tk.HORIZONTAL, variable=self.compress_video_tone_var, command=self.update_compress_video_tone_label)
         self.compress_video_tone_slider.grid(row=8, column=1, padx=10, pady=10)
 
+        self.compress_segmented_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(tab, text="Parallel Segments (s):", variable=self.compress_segmented_var).grid(row=9, column=0, padx=10, pady=10)
+        self.compress_segment_seconds_var = tk.IntVar(value=30)
+        self.compress_segment_seconds_entry = ttk.Entry(tab, textvariable=self.compress_segment_seconds_var)
+        self.compress_segment_seconds_entry.grid(row=9, column=1, padx=10, pady=10)
+
+        # Target size replaces the video bitrate: it is worked out from probe encodes
+        self.compress_target_size_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(tab, text="Target Size (MB):", variable=self.compress_target_size_var).grid(row=10, column=0, padx=10, pady=10)
+        self.compress_target_size_mb_var = tk.StringVar(value="25")
+        ttk.Entry(tab, textvariable=self.compress_target_size_mb_var).grid(row=10, column=1, padx=10, pady=10)
+        self.compress_two_pass_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(tab, text="Two-Pass", variable=self.compress_two_pass_var).grid(row=10, column=2, padx=10, pady=10, sticky=tk.W)
+
         ttk.Button(tab, text="Compress Video", command=self.compress_video, bootstyle="success").grid(row=11, column=0, columnspan=3, pady=20)
 
 
+    def setup_queue_ui(self, tab):
+        columns = ("name", "type", "state", "progress", "stage")
+        self.queue_tree = ttk.Treeview(tab, columns=columns, show="headings", height=12, bootstyle="primary")
+        for column, heading, width in zip(columns, ("Job", "Type", "State", "Progress", "Stage / ETA"), (260, 100, 90, 80, 200)):
+            self.queue_tree.heading(column, text=heading)
+            self.queue_tree.column(column, width=width, anchor=tk.W)
+        self.queue_tree.grid(row=0, column=0, columnspan=4, padx=10, pady=10, sticky=tk.NSEW)
+
+        ttk.Label(tab, text="Parallel Jobs:").grid(row=1, column=0, padx=10, pady=10, sticky=tk.W)
+        self.max_jobs_var = tk.IntVar(value=1)
+        ttk.Spinbox(tab, from_=1, to=os.cpu_count() or 1, width=5, textvariable=self.max_jobs_var, command=self.update_max_jobs).grid(row=1, column=1, padx=10, pady=10, sticky=tk.W)
+        ttk.Button(tab, text="Cancel Selected", command=self.cancel_selected_jobs, bootstyle="danger").grid(row=1, column=2, padx=10, pady=10)
+        ttk.Button(tab, text="Clear Finished", command=self.clear_finished_jobs, bootstyle="secondary").grid(row=1, column=3, padx=10, pady=10)
+
+    def enqueue_job(self, job):
+        self.tracked_job_id = self.job_queue.submit(job)
+        self.progress_var.set(0)
+
+    def update_max_jobs(self):
+        try:
+            self.job_queue.set_max_workers(int(self.max_jobs_var.get()))
+        except (ValueError, tk.TclError):
+            pass
+
+    def cancel_selected_jobs(self):
+        for item in self.queue_tree.selection():
+            self.job_queue.cancel(int(item))
+
+    def clear_finished_jobs(self):
+        for job_id in self.job_queue.clear_finished():
+            if self.queue_tree.exists(str(job_id)):
+                self.queue_tree.delete(str(job_id))
+
+    def poll_job_queue(self):
+        # Render threads only post to job_queue.events and other background
+        # threads to ui_calls; all Tk updates happen here
+        while True:
+            try:
+                entry = self.job_queue.events.get_nowait()
+            except queue.Empty:
+                break
+            self.show_job(entry)
+        while True:
+            try:
+                func, args = self.ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+        self.root.after(50, self.poll_job_queue)
+
+    def run_in_background(self, func, args, on_done, on_error=print):
+        # on_done(result) / on_error(exception) run on the Tk thread
+        def worker():
+            try:
+                self.ui_calls.put((on_done, (func(*args),)))
+            except Exception as e:
+                self.ui_calls.put((on_error, (e,)))
+        threading.Thread(target=worker, daemon=True).start()
+
+    def show_job(self, entry):
+        stage = entry["stage"].capitalize()
+        if entry["state"] == "running" and entry["eta"] is not None:
+            stage += f", {int(entry['eta'] // 60)}:{int(entry['eta'] % 60):02d} left"
+        elif entry["state"] == "error":
+            stage = entry["error"]
+        values = (entry["name"], entry["type"], entry["state"], f"{entry['progress']:.0%}", stage)
+        item = str(entry["id"])
+        if self.queue_tree.exists(item):
+            self.queue_tree.item(item, values=values)
+        else:
+            self.queue_tree.insert("", tk.END, iid=item, values=values)
+
+        if entry["id"] == self.tracked_job_id:
+            self.progress_var.set(round(entry["progress"] * 100))
+            self.progress_label.config(text=f"{entry['name']}: {entry['state']} {stage}")
+
+        if entry["state"] == "error":
+            messagebox.showerror("Error", f"{entry['name']}: {entry['error']}")
+        elif entry["state"] == "done":
+            self.finished_jobs.append(entry)
+            if self.job_queue.active_count() == 0:
+                # One message once the queue has drained, not one per job
+                summary = "\n\n".join(f"{e['name']} -> {', '.join(e['result']['output_files'])}\n{self.format_render_summary(e['result'])}" for e in self.finished_jobs)
+                self.finished_jobs = []
+                messagebox.showinfo("Success", f"All jobs finished!\n\n{summary}")
+
+    def on_close(self):
+        # Kill running ffmpeg encodes instead of leaving them behind
+        self.job_queue.cancel_all()
+        self.root.destroy()
+
+    def setup_timeline_ui(self, frame):
+        self.timeline_file = None
+        self.timeline_info = None
+        self.timeline_index = None
+        self.timeline_image = None
+        self.preview_image = None
+        self.preview_after_id = None
+        self.timeline_silences = []
+        self.timeline_scene_changes = []
+        self.timeline_peaks = None
+        self.waveform_image = None
+
+        self.preview_label = ttk.Label(frame, text="Select a video to scrub through it.")
+        self.preview_label.grid(row=0, column=0, columnspan=4, padx=10, pady=(10, 0))
+
+        self.timeline_canvas = tk.Canvas(frame, width=self.TIMELINE_WIDTH, height=self.TIMELINE_HEIGHT, highlightthickness=0, background="black")
+        self.timeline_canvas.grid(row=1, column=0, columnspan=4, padx=10, pady=(10, 0))
+        self.timeline_canvas.bind("<Button-1>", self.on_timeline_click)
+        self.timeline_canvas.bind("<B1-Motion>", self.on_timeline_click)
+
+        self.scrub_var = tk.DoubleVar(value=0.0)
+        self.scrub_scale = ttk.Scale(frame, from_=0, to=1, orient=tk.HORIZONTAL, length=self.TIMELINE_WIDTH, variable=self.scrub_var, command=self.on_scrub)
+        self.scrub_scale.grid(row=2, column=0, columnspan=4, padx=10, pady=(0, 10))
+
+        self.scrub_time_label = ttk.Label(frame, text="0.000s")
+        self.scrub_time_label.grid(row=3, column=0, padx=10, pady=10, sticky=tk.W)
+        ttk.Button(frame, text="Set Start", command=lambda: self.start_time_var.set(round(self.scrub_var.get(), 3)), bootstyle="secondary").grid(row=3, column=1, padx=10, pady=10)
+        ttk.Button(frame, text="Set End", command=lambda: self.end_time_var.set(round(self.scrub_var.get(), 3)), bootstyle="secondary").grid(row=3, column=2, padx=10, pady=10)
+
+    def load_timeline(self, file_path, info):
+        # Index + thumbnails come from the disk cache, or from one keyframe-only
+        # decode pass in the background for a new file
+        self.timeline_file = None
+        self.timeline_silences = []
+        self.timeline_scene_changes = []
+        self.timeline_peaks = None
+        self.timeline_canvas.delete("all")
+        self.preview_label.config(text="Indexing keyframes...", image="")
+        self.run_in_background(media_index, (file_path,), lambda index: self.show_timeline(file_path, info, index), lambda e: self.preview_label.config(text=f"Could not index the video: {e}"))
+        # From the peak cache if the audio was extracted before, else one audio-only decode
+        self.run_in_background(waveform_peaks, (file_path,), lambda peaks: self.show_waveform(file_path, peaks))
+
+    def show_timeline(self, file_path, info, index):
+        if file_path != self.input_file:
+            return  # another file was picked meanwhile
+        self.timeline_file, self.timeline_info, self.timeline_index = file_path, info, index
+        self.scrub_scale.config(to=info["duration"])
+        self.scrub_var.set(0.0)
+
+        canvas = self.timeline_canvas
+        canvas.delete("all")
+        thumbnails = index["thumbnails"]
+        if len(thumbnails):
+            # Fill the strip with the nearest thumbnail for each slot
+            slot_width = max(1, round(thumbnails.shape[2] * self.TIMELINE_HEIGHT / thumbnails.shape[1]))
+            slots = self.TIMELINE_WIDTH // slot_width + 1
+            strip = np.hstack([cv2.resize(thumbnail_at(index, info["duration"] * i / slots), (slot_width, self.TIMELINE_HEIGHT), interpolation=cv2.INTER_AREA) for i in range(slots)])
+            self.timeline_image = ImageTk.PhotoImage(Image.fromarray(np.ascontiguousarray(strip[:, :self.TIMELINE_WIDTH])))
+            canvas.create_image(0, 0, anchor=tk.NW, image=self.timeline_image)
+        for keyframe in index["keyframes"][:: max(1, len(index["keyframes"]) // self.TIMELINE_WIDTH)]:
+            x = self.timeline_x(keyframe)
+            canvas.create_line(x, self.TIMELINE_HEIGHT - 5, x, self.TIMELINE_HEIGHT, fill="white")
+        self.draw_waveform()
+        self.draw_timeline_marks()
+        self.show_preview(0.0)
+
+    def show_waveform(self, file_path, peaks):
+        if file_path != self.input_file:
+            return
+        self.timeline_peaks = peaks
+        self.draw_waveform()
+
+    def draw_waveform(self):
+        # Semi-transparent overlay on the thumbnail strip, one min/max bar per pixel column
+        if self.timeline_file is None or self.timeline_peaks is None or not len(self.timeline_peaks):
+            return
+        peaks = self.timeline_peaks
+        starts = (np.arange(self.TIMELINE_WIDTH) * self.timeline_info["duration"] / self.TIMELINE_WIDTH * PEAK_RATE / PEAK_SAMPLES).astype(int)
+        # The audio may end before the video does
+        covered = starts < len(peaks)
+        starts = np.minimum(starts, len(peaks) - 1)
+        low = np.minimum.reduceat(peaks[:, 0], starts)
+        high = np.maximum.reduceat(peaks[:, 1], starts)
+        middle = self.TIMELINE_HEIGHT / 2
+        top = (middle - high.astype(np.float32) / 128 * middle).astype(int)
+        bottom = (middle - low.astype(np.float32) / 128 * middle).astype(int)
+        rows = np.arange(self.TIMELINE_HEIGHT)[:, None]
+        overlay = np.zeros((self.TIMELINE_HEIGHT, self.TIMELINE_WIDTH, 4), dtype=np.uint8)
+        overlay[..., :3] = (120, 220, 140)
+        overlay[..., 3] = np.where((rows >= top) & (rows <= bottom) & covered, 150, 0)
+        self.waveform_image = ImageTk.PhotoImage(Image.fromarray(overlay, "RGBA"))
+        self.timeline_canvas.delete("waveform")
+        self.timeline_canvas.create_image(0, 0, anchor=tk.NW, image=self.waveform_image, tags="waveform")
+        self.timeline_canvas.tag_raise("marks")
+
+    def timeline_x(self, t):
+        return t / self.timeline_info["duration"] * (self.TIMELINE_WIDTH - 1)
+
+    def draw_timeline_marks(self):
+        if self.timeline_file is None:
+            return
+        canvas = self.timeline_canvas
+        canvas.delete("marks")
+        try:
+            start_time, end_time = float(self.start_time_var.get()), float(self.end_time_var.get())
+        except (ValueError, tk.TclError):
+            start_time, end_time = None, None  # half-typed value
+        if start_time is not None and start_time < end_time:
+            canvas.create_rectangle(self.timeline_x(start_time), 1, self.timeline_x(min(end_time, self.timeline_info["duration"])), self.TIMELINE_HEIGHT - 1, outline="#f0ad4e", width=2, tags="marks")
+        for start, end in self.timeline_silences:
+            canvas.create_rectangle(self.timeline_x(start), 0, self.timeline_x(end), 8, fill="gray50", outline="", tags="marks")
+        for t in self.timeline_scene_changes:
+            canvas.create_line(self.timeline_x(t), 0, self.timeline_x(t), self.TIMELINE_HEIGHT, fill="#ffc107", tags="marks")
+        for cut in self.cut_list_ranges():
+            try:
+                cut_start, cut_end = parse_time(cut["start"]), parse_time(cut["end"])
+            except (KeyError, ValueError):
+                continue
+            canvas.create_rectangle(self.timeline_x(cut_start), self.TIMELINE_HEIGHT - 8, self.timeline_x(min(cut_end, self.timeline_info["duration"])), self.TIMELINE_HEIGHT - 1, fill="#5bc0de", outline="", tags="marks")
+        x = self.timeline_x(self.scrub_var.get())
+        canvas.create_line(x, 0, x, self.TIMELINE_HEIGHT, fill="red", width=2, tags="marks")
+
+    def on_timeline_click(self, event):
+        if self.timeline_file is None:
+            return
+        self.scrub_var.set(max(0.0, min(event.x / (self.TIMELINE_WIDTH - 1), 1.0)) * self.timeline_info["duration"])
+        self.on_scrub(self.scrub_var.get())
+
+    def on_scrub(self, value):
+        if self.timeline_file is None:
+            return
+        t = float(value)
+        self.scrub_time_label.config(text=f"{t:.3f}s")
+        self.draw_timeline_marks()
+        # The keyframe thumbnail shows up right away, the exact frame once scrubbing pauses
+        thumbnail = thumbnail_at(self.timeline_index, t)
+        if thumbnail is not None:
+            self.set_preview_image(thumbnail)
+        if self.preview_after_id is not None:
+            self.root.after_cancel(self.preview_after_id)
+        self.preview_after_id = self.root.after(150, self.show_preview, t)
+
+    def show_preview(self, t):
+        self.preview_after_id = None
+        info = self.timeline_info
+        width = min(PREVIEW_WIDTH, round(self.PREVIEW_HEIGHT * info["width"] / info["height"] / 2) * 2)
+        self.run_in_background(seek_frame, (self.timeline_file, t, width), lambda frame: self.set_preview_image(frame) if abs(self.scrub_var.get() - t) < 1e-6 else None)
+
+    def set_preview_image(self, frame):
+        height = self.PREVIEW_HEIGHT
+        width = max(2, round(frame.shape[1] * height / frame.shape[0]))
+        if frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+        self.preview_image = ImageTk.PhotoImage(Image.fromarray(np.ascontiguousarray(frame)))
+        self.preview_label.config(image=self.preview_image, text="")
+
+    def setup_cut_list_ui(self, frame):
+        # Ranges cut in one job instead of the single Start/End above. Extra
+        # columns of a loaded CSV/JSON stay attached to their row as overrides.
+        self.cut_list_overrides = {}
+        columns = ("name", "start", "end")
+        self.cut_list_tree = ttk.Treeview(frame, columns=columns, show="headings", height=5, bootstyle="primary")
+        for column, heading, width in zip(columns, ("Name (double-click to edit)", "Start", "End"), (300, 120, 120)):
+            self.cut_list_tree.heading(column, text=heading)
+            self.cut_list_tree.column(column, width=width, anchor=tk.W)
+        self.cut_list_tree.grid(row=0, column=0, columnspan=4, padx=10, pady=10, sticky=tk.NSEW)
+        self.cut_list_tree.bind("<Double-1>", self.edit_cut_list_cell)
+
+        ttk.Button(frame, text="Add Start/End", command=self.add_cut_range, bootstyle="secondary").grid(row=1, column=0, padx=10, pady=10)
+        ttk.Button(frame, text="Remove Selected", command=self.remove_cut_ranges, bootstyle="secondary").grid(row=1, column=1, padx=10, pady=10)
+        ttk.Button(frame, text="Load List", command=self.load_cut_list_file, bootstyle="primary").grid(row=1, column=2, padx=10, pady=10)
+        ttk.Button(frame, text="Save List", command=self.save_cut_list_file, bootstyle="primary").grid(row=1, column=3, padx=10, pady=10)
+
+        self.reel_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Join Into One Highlight Reel", variable=self.reel_var).grid(row=2, column=0, columnspan=2, padx=10, pady=10, sticky=tk.W)
+        ttk.Label(frame, text="Crossfade (seconds):").grid(row=2, column=2, padx=10, pady=10, sticky=tk.E)
+        self.crossfade_var = tk.DoubleVar(value=0.5)
+        ttk.Entry(frame, textvariable=self.crossfade_var, width=8).grid(row=2, column=3, padx=10, pady=10, sticky=tk.W)
+
+        ttk.Button(frame, text="Suggest Cuts", command=self.suggest_cuts, bootstyle="primary").grid(row=3, column=0, padx=10, pady=10)
+        self.suggest_label = ttk.Label(frame, text="Finds silences and scene changes and adds the clips between them.")
+        self.suggest_label.grid(row=3, column=1, columnspan=3, padx=10, pady=10, sticky=tk.W)
+
+    def cut_list_ranges(self):
+        ranges = []
+        for item in self.cut_list_tree.get_children():
+            name, start, end = self.cut_list_tree.item(item, "values")
+            ranges.append({"name": name, "start": start, "end": end, **self.cut_list_overrides.get(item, {})})
+        return ranges
+
+    def add_cut_range(self, name=None, start=None, end=None, overrides=None):
+        if start is None:
+            start, end = self.start_time_var.get(), self.end_time_var.get()
+        name = name or f"clip{len(self.cut_list_tree.get_children()) + 1:02d}"
+        item = self.cut_list_tree.insert("", tk.END, values=(name, start, end))
+        if overrides:
+            self.cut_list_overrides[item] = overrides
+        self.draw_timeline_marks()
+
+    def remove_cut_ranges(self):
+        for item in self.cut_list_tree.selection():
+            self.cut_list_tree.delete(item)
+            self.cut_list_overrides.pop(item, None)
+        self.draw_timeline_marks()
+
+    def edit_cut_list_cell(self, event):
+        tree = self.cut_list_tree
+        item, column = tree.identify_row(event.y), tree.identify_column(event.x)
+        if not item or not column:
+            return
+        index = int(column[1:]) - 1
+        x, y, width, height = tree.bbox(item, column)
+        editor = ttk.Entry(tree)
+        editor.insert(0, tree.item(item, "values")[index])
+        editor.select_range(0, tk.END)
+        editor.place(x=x, y=y, width=width, height=height)
+        editor.focus_set()
+
+        def close(commit):
+            editor.unbind("<FocusOut>")
+            if commit:
+                values = list(tree.item(item, "values"))
+                values[index] = editor.get().strip()
+                tree.item(item, values=values)
+            editor.destroy()
+            self.draw_timeline_marks()
+
+        editor.bind("<Return>", lambda e: close(True))
+        editor.bind("<FocusOut>", lambda e: close(True))
+        editor.bind("<Escape>", lambda e: close(False))
+
+    def load_cut_list_file(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Cut lists", "*.csv;*.json")])
+        if not file_path:
+            return
+        try:
+            ranges = load_cut_list(file_path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"Could not read the cut list: {e}")
+            return
+        for item in self.cut_list_tree.get_children():
+            self.cut_list_tree.delete(item)
+        self.cut_list_overrides = {}
+        for cut in ranges:
+            overrides = {key: value for key, value in cut.items() if key not in ("name", "start", "end")}
+            self.add_cut_range(cut.get("name"), cut.get("start", 0), cut.get("end", ""), overrides)
+
+    def suggest_cuts(self):
+        if not self.input_file:
+            messagebox.showerror("Error", "Please select a video file.")
+            return
+        file_path = self.input_file
+        self.suggest_label.config(text="Analyzing audio and scenes...")
+        self.run_in_background(analyze_media, (file_path,), lambda analysis: self.show_suggestions(file_path, analysis), lambda e: self.suggest_label.config(text=f"Analysis failed: {e}"))
+
+    def show_suggestions(self, file_path, analysis):
+        if file_path != self.input_file:
+            return  # another file was picked meanwhile
+        self.timeline_silences = find_silences(analysis)
+        self.timeline_scene_changes = find_scene_changes(analysis)
+        ranges = suggest_cut_list(analysis, probe_media(file_path)["duration"])
+        for cut in ranges:
+            self.add_cut_range(cut["name"], cut["start"], cut["end"])
+        self.suggest_label.config(text=f"{len(ranges)} suggested clip(s) from {len(self.timeline_silences)} silence(s) and {len(self.timeline_scene_changes)} scene change(s)")
+
+    def save_cut_list_file(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV", "*.csv"), ("JSON", "*.json")])
+        if file_path:
+            save_cut_list(file_path, self.cut_list_ranges())
+
     def select_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4;*.avi;*.mov")])
         if file_path:
             self.input_file_entry.delete(0, tk.END)
             self.input_file_entry.insert(0, file_path)
-            with VideoFileClip(file_path) as video:
-                duration = int(video.duration)
-                fps = video.fps
-                width, height = video.size
-                resolution = f"{width} x {height}"
-                self.width_var.set(width)
-                self.height_var.set(height)
-                self.resolution_var.set(resolution)
-                self.end_time_var.set(duration)
-                self.framerate_var.set(fps)
-                self.bitrate_var.set("12000")
+            info = probe_media(file_path)
+            width, height = info["width"], info["height"]
+            resolution = f"{width} x {height}"
+            self.width_var.set(width)
+            self.height_var.set(height)
+            self.resolution_var.set(resolution)
+            self.end_time_var.set(round(info["duration"], 3))
+            self.framerate_var.set(info["fps"])
+            self.bitrate_var.set("12000")
             self.input_file = file_path
+            self.load_timeline(file_path, info)
 
     def select_audio_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("Audio files", "*.mp3;*.wav")])
@@ -304,20 +4333,24 @@ class VideoCutterApp:
             self.audio_file_entry.insert(0, file_path)
             self.audio_file = file_path
             
+    def select_watermark_image(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.png;*.jpg;*.jpeg")])
+        if file_path:
+            self.watermark_image_var.set(file_path)
+            
     def select_compress_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4;*.avi;*.mov")])
         if file_path:
             self.compress_input_file_entry.delete(0, tk.END)
             self.compress_input_file_entry.insert(0, file_path)
-            self.input_file = file_path
-            with VideoFileClip(file_path) as video:
-                fps = video.fps
-                width, height = video.size
-                resolution = f"{width} x {height}"
-                self.compress_width_var.set(width)
-                self.compress_height_var.set(height)
-                self.compress_resolution_var.set(resolution)
-                self.compress_framerate_var.set(fps)
+            self.compress_input_file = file_path
+            info = probe_media(file_path)
+            width, height = info["width"], info["height"]
+            resolution = f"{width} x {height}"
+            self.compress_width_var.set(width)
+            self.compress_height_var.set(height)
+            self.compress_resolution_var.set(resolution)
+            self.compress_framerate_var.set(info["fps"])
                 
     def update_compress_resolution(self, event):
         resolution = self.compress_resolution_var.get()
@@ -333,66 +4366,60 @@ class VideoCutterApp:
         
 
     def compress_video(self):
-        if not self.input_file:
+        if not self.compress_input_file:
             messagebox.showerror("Error", "Please select a video file.")
             return
 
         try:
-            width = int(self.compress_width_var.get())
-            height = int(self.compress_height_var.get())
-            framerate = int(self.compress_framerate_var.get())
-            video_bitrate = int(self.compress_bitrate_var.get())
-            audio_bitrate = int(self.compress_audio_bitrate_var.get())
-            volume = float(self.compress_video_volume_var.get())
-            tone = float(self.compress_video_tone_var.get())
+            job = {
+                "type": "compress",
+                "input_file": self.compress_input_file,
+                "width": int(self.compress_width_var.get()),
+                "height": int(self.compress_height_var.get()),
+                "framerate": int(self.compress_framerate_var.get()),
+                "video_bitrate": int(self.compress_bitrate_var.get()),
+                "audio_bitrate": int(self.compress_audio_bitrate_var.get()),
+                "volume": float(self.compress_video_volume_var.get()),
+                "tone": float(self.compress_video_tone_var.get()),
+            }
+            if self.compress_segmented_var.get():
+                job["segment_seconds"] = int(self.compress_segment_seconds_var.get())
+            if self.compress_target_size_var.get():
+                job["target_size_mb"] = float(self.compress_target_size_mb_var.get())
+                job["two_pass"] = self.compress_two_pass_var.get()
         except ValueError:
-            messagebox.showerror("Error", "Bitrate must be an integer.")
+            messagebox.showerror("Error", "Bitrates must be integers and the target size a number.")
             return
 
         output_dir = filedialog.askdirectory()
         if not output_dir:
             return
+        job["output_dir"] = output_dir
 
-        threading.Thread(target=self.process_compress_video, args=(width, height, output_dir, framerate, video_bitrate, audio_bitrate, volume, tone)).start()
+        self.enqueue_job(job)
 
-    def process_compress_video(self, width, height, output_dir, framerate, video_bitrate, audio_bitrate, volume=1.0, tone=1.0):
-        self.progress_bar.start()
-
-        try:
-            with VideoFileClip(self.input_file) as video:
-                subclip = resize(video, newsize=(width, height))
-                
-                # Adjust volume
-                if volume <= 0:
-                    raise ValueError("Volume limit must be a positive value.")
-                if volume != 1.0:
-                    subclip = subclip.fx(volumex, volume)
-
-                # Set tone
-                if tone <= 0:
-                    raise ValueError("Volume limit must be a positive value.")
-                if tone != 1.0:
-                    subclip = subclip.fx(volumex, tone)
-                
-                output_file = os.path.join(output_dir, f"compressed_video_{framerate}_{video_bitrate}.mp4")
-                
-                # Encoder: libx264, h264_nvenc, hevc_nvenc
-                subclip.write_videofile(output_file, codec="libx264", audio_codec="aac", fps=framerate, bitrate=f"{video_bitrate}k", audio_bitrate=f"{audio_bitrate}k", preset="slow", audio_fps=48000)
-
-            self.progress_bar.stop()
-            messagebox.showinfo("Success", "Video compressed successfully!")
-        except Exception as e:
-            self.progress_bar.stop()
-            messagebox.showerror("Error", str(e))
-        finally:
-            self.progress_var.set(100)
+    def format_render_summary(self, result):
+        if result.get("cached"):
+            return "Taken from the render cache (same input and settings as an earlier render)."
+        fps = f" ({result['fps']:.1f} fps)" if result["fps"] else ""
+        return f"Done in {result['wall_time']:.1f}s{fps}\n{format_stages(result['stages'])}"
 
     def select_audio_input_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4;*.avi;*.mov")])
         if file_path:
             self.audio_input_file_entry.delete(0, tk.END)
             self.audio_input_file_entry.insert(0, file_path)
-            self.input_file = file_path
+            self.audio_input_file = file_path
+            self.audio_input_files = None
+
+    def select_audio_input_folder(self):
+        folder = filedialog.askdirectory()
+        if folder:
+            files = collect_media_files([folder])
+            self.audio_input_file_entry.delete(0, tk.END)
+            self.audio_input_file_entry.insert(0, f"{folder} ({len(files)} videos)")
+            self.audio_input_file = folder
+            self.audio_input_files = files
     
     def cut_video(self):
         if not self.input_file:
@@ -400,164 +4427,236 @@ class VideoCutterApp:
             return
 
         try:
-            start_time = int(self.start_time_entry.get())
-            end_time = int(self.end_time_entry.get())
-            width = int(self.width_entry.get())
-            height = int(self.height_entry.get())
-            video_volume = float(self.video_volume_var.get())
-            audio_volume = float(self.audio_volume_var.get())
-            video_speed = float(self.video_speed_var.get())
-            video_rotation = int(self.video_rotation_var.get())
-            contrast = float(self.contrast_var.get())
-            brightness = float(self.brightness_var.get())
-            framerate = int(self.framerate_var.get())
-            video_bitrate = self.bitrate_var.get()
-            audio_bitrate = self.audio_bitrate_var.get()
+            job = {
+                "type": "cut",
+                "input_file": self.input_file,
+                "start_time": float(self.start_time_entry.get()),
+                "end_time": float(self.end_time_entry.get()),
+                "width": int(self.width_entry.get()),
+                "height": int(self.height_entry.get()),
+                "video_volume": float(self.video_volume_var.get()),
+                "audio_volume": float(self.audio_volume_var.get()),
+                "video_speed": float(self.video_speed_var.get()),
+                "video_rotation": int(self.video_rotation_var.get()),
+                "contrast": float(self.contrast_var.get()),
+                "brightness": float(self.brightness_var.get()),
+                "framerate": int(self.framerate_var.get()),
+                "video_bitrate": self.bitrate_var.get(),
+                "audio_bitrate": self.audio_bitrate_var.get(),
+                "audio_file": self.audio_file,
+                "music_fade_in": float(self.music_fade_var.get()),
+                "music_fade_out": float(self.music_fade_var.get()),
+                "music_duck": 0.3 if self.music_duck_var.get() else 1.0,
+                "backend": "ffmpeg" if self.native_backend_var.get() else "moviepy",
+            }
         except ValueError:
             messagebox.showerror("Error", "Invalid input values.")
             return
 
-        if start_time >= end_time:
+        ranges = self.cut_list_ranges()
+        if ranges:
+            try:
+                for cut in ranges:
+                    if parse_time(cut["start"]) >= parse_time(cut["end"]):
+                        raise ValueError(f"{cut['name']}: end time must be greater than start time.")
+                job.update({"ranges": ranges, "reel": self.reel_var.get(), "crossfade": float(self.crossfade_var.get())})
+            except (ValueError, tk.TclError) as e:
+                messagebox.showerror("Error", f"Invalid cut list: {e}")
+                return
+        elif job["start_time"] >= job["end_time"]:
             messagebox.showerror("Error", "End time must be greater than start time.")
             return
 
+        presets = [resolution for resolution, var in self.preset_vars.items() if var.get()]
+        if presets:
+            # Main size plus every ticked preset, bitrate scaled by pixel count
+            sizes = [(job["width"], job["height"])]
+            sizes += [size for size in (tuple(map(int, p.split(' x '))) for p in presets) if size not in sizes]
+            base_pixels = job["width"] * job["height"]
+            job["outputs"] = [{"width": w, "height": h, "video_bitrate": max(500, int(float(job["video_bitrate"]) * w * h / base_pixels))} for w, h in sizes]
+
+        if self.add_watermark_var.get():
+            job["watermark_text"] = self.watermark_text_var.get()
+            job["watermark_image"] = self.watermark_image_var.get() or None
+            job["watermark_position"] = self.watermark_position_var.get()
+
         output_dir = filedialog.askdirectory()
         if not output_dir:
             return
+        job["output_dir"] = output_dir
 
-        threading.Thread(target=self.process_video, args=(start_time, end_time, width, height, video_volume, audio_volume, video_speed, video_rotation, contrast, brightness, framerate, video_bitrate, audio_bitrate, output_dir)).start()
+        self.enqueue_job(job)
 
-    def process_audio(self, subclip, audio_file, audio_volume):
-        try:
-            new_audio = AudioFileClip(audio_file)
-            new_audio = new_audio.volumex(audio_volume)
-            new_audio = new_audio.set_fps(48000)
-            
-            if new_audio.duration > subclip.duration:
-                new_audio = new_audio.subclip(0, subclip.duration)
-            
-            if subclip.audio is None:
-                print("The video has no audio track. Setting the new audio directly.")
-                subclip = subclip.set_audio(new_audio)
-            else:
-                composite_audio = CompositeAudioClip([subclip.audio, new_audio])
-                subclip = subclip.set_audio(composite_audio)
-            
-            print("Audio has been successfully set.")
-        except Exception as e:
-            print(f"An error occurred while processing audio: {e}")
-            raise e
-        finally:
-            # Ensure the audio clip is closed
-            new_audio.close()
-        return subclip
-    
-    def process_video(self, start_time, end_time, width, height, video_volume, audio_volume, video_speed, video_rotation, contrast, brightness, framerate, video_bitrate, audio_bitrate, output_dir):
-        self.progress_bar.start()
+    def extract_audio(self):
+        if not self.audio_input_file:
+            messagebox.showerror("Error", "Please select a video file.")
+            return
 
-        try:
-            with VideoFileClip(self.input_file) as video:
-                subclip = video.subclip(start_time, end_time)
+        output_dir = filedialog.askdirectory()
+        if not output_dir:
+            return
 
-                # Apply video speed
-                if video_speed != 1.0:
-                    subclip = speedx(subclip, factor=video_speed)
+        if self.audio_input_files is not None:
+            # A folder: one queued job per video, up-to-date ones are skipped
+            for job in audio_extraction_jobs(self.audio_input_files, self.audio_format_var.get(), output_dir):
+                self.enqueue_job(job)
+            return
+        job = {"type": "extract_audio", "input_file": self.audio_input_file, "audio_format": self.audio_format_var.get(), "output_dir": output_dir}
+        self.enqueue_job(job)
 
-                # Apply video rotation
-                if video_rotation != 0:
-                    subclip = rotate(subclip, angle=video_rotation)
-                
-                # Apply contrast and brightness
-                if contrast != 0.0 or brightness != 0.0:
-                    subclip = lum_contrast(subclip, lum=brightness, contrast=contrast)
-            
-                original_aspect_ratio = video.size[0] / video.size[1]
-                new_aspect_ratio = width / height
-
-                if original_aspect_ratio > new_aspect_ratio:
-                    new_width = int(video.size[1] * new_aspect_ratio)
-                    new_height = video.size[1]
-                    x_center = video.size[0] // 2
-                    subclip = crop(subclip, width=new_width, height=new_height, x_center=x_center)
-                elif original_aspect_ratio < new_aspect_ratio:
-                    new_width = video.size[0]
-                    new_height = int(video.size[0] / new_aspect_ratio)
-                    y_center = video.size[1] // 2
-                    subclip = crop(subclip, width=new_width, height=new_height, y_center=y_center)
-
-                subclip = resize(subclip, newsize=(width, height))
-                subclip = subclip.volumex(video_volume)
-
-                if self.audio_file:
-                    subclip = self.process_audio(subclip, self.audio_file, audio_volume)
-
-                if self.add_watermark_var.get():
-                    subclip = self.add_text_watermark(subclip, self.watermark_text_var.get(), self.watermark_position_var.get())
-
-                output_file = os.path.join(output_dir, f"cut_video_{start_time}_{end_time}.mp4")
-                
-                print(f"Writing video to file: {output_file}")
-                subclip.write_videofile(output_file, codec="libx264", audio_codec="aac", fps=framerate, bitrate=f"{video_bitrate}k", audio_bitrate=f"{audio_bitrate}k", preset="slow", audio_fps=48000)
 
-            self.progress_bar.stop()
-            messagebox.showinfo("Success", "Video cut and audio added successfully!")
-        except Exception as e:
-            self.progress_bar.stop()
-            messagebox.showerror("Error", str(e))
-        finally:
-            self.progress_var.set(100)
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py", description="Py - Cut It Out")
+    subparsers = parser.add_subparsers(dest="command")
 
+    batch_parser = subparsers.add_parser("batch", help="Render a JSON file of jobs without the GUI")
+    batch_parser.add_argument("jobs_file", help="JSON list of jobs, or {\"defaults\": {...}, \"jobs\": [...]}")
+    batch_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of parallel render processes")
+    batch_parser.add_argument("--metrics-dir", help="Write a JSON metrics record (stage timings, fps, peak RSS) per job into this folder")
 
-    def add_text_watermark(self, video_clip, text, position="Top Left"):
-        def add_text_to_frame(get_frame, t):
-            frame = get_frame(t)
-            overlay = frame.copy()
-            alpha = 0.4  # Transparency factor
-            
-            # Get frame dimensions
-            h, w = frame.shape[:2]
-
-            # Calculate positions
-            positions = {
-                "Top Left": (20, 40),
-                "Top Right": (w - 20 - cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)[0][0], 40),
-                "Bottom Left": (20, h - 20),
-                "Bottom Right": (w - 20 - cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)[0][0], h - 20),
-                "Center": ((w - cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)[0][0]) // 2, (h + cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)[0][1]) // 2)
-            }
-            
-            pos = positions.get(position, (20, 40))  # Default to "Top Left" if position is not recognized
-            
-            # Adding text with transparency
-            cv2.putText(overlay, text, pos, cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2, cv2.LINE_AA)
-            cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
+    extract_parser = subparsers.add_parser("extract-audio", help="Extract the audio of every video in folders, files or glob patterns")
+    extract_parser.add_argument("inputs", nargs="+", help="Folders, video files or quoted glob patterns")
+    extract_parser.add_argument("--format", default="mp3", help="Audio format / file extension (mp3, wav, m4a, flac, ogg, opus)")
+    extract_parser.add_argument("--output-dir", help="Write all audio files here instead of next to their videos")
+    extract_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of parallel extractions")
+    extract_parser.add_argument("--recursive", action="store_true", help="Include subfolders (and ** in patterns)")
+    extract_parser.add_argument("--force", action="store_true", help="Extract again even if the audio file is up to date")
 
-            return frame
+    bench_parser = subparsers.add_parser("bench", help="Run micro-benchmarks")
+    bench_parser.add_argument("target", choices=["kernel", "segments", "pipeline", "startup", "suite"], help="kernel: fused frame transform vs. the MoviePy fx chain; segments: serial vs. parallel segment compression; pipeline: serial frame loop vs. frame worker processes; startup: time to first window and first decoded frame; suite: every render path on synthetic 720p/1080p/4K fixtures")
+    bench_parser.add_argument("--frames", type=int, default=60)
+    bench_parser.add_argument("--rotation", type=int, default=0)
+    bench_parser.add_argument("--input", help="Source video for the segments, pipeline and startup benchmarks")
+    bench_parser.add_argument("--segment-seconds", type=float, default=30)
+    bench_parser.add_argument("--workers", type=int, default=None)
+    bench_parser.add_argument("--runs", type=int, default=None, help="startup: number of cold starts (default 5); suite: best of this many runs per case (default 1)")
+    bench_parser.add_argument("--sizes", nargs="+", choices=list(BENCH_SIZES), default=list(BENCH_SIZES), help="suite: fixture sizes")
+    bench_parser.add_argument("--cases", nargs="+", choices=BENCH_CASES, default=list(BENCH_CASES), help="suite: render paths to time")
+    bench_parser.add_argument("--seconds", type=float, default=4.0, help="suite: fixture length")
+    bench_parser.add_argument("--baseline", help="suite: JSON results of an earlier run to check against")
+    bench_parser.add_argument("--save", help="suite: write the results (e.g. as the next baseline) to this JSON file")
+    bench_parser.add_argument("--threshold", type=float, default=0.15, help="suite: largest allowed slowdown or RSS growth against the baseline (0.15 = 15%%)")
 
-        return video_clip.fl(add_text_to_frame, apply_to=["mask"])
+    analyze_parser = subparsers.add_parser("analyze", help="Find silences and scene changes and suggest a cut list")
+    analyze_parser.add_argument("input", help="Source video")
+    analyze_parser.add_argument("--cut-list", help="Write the suggested ranges to this .csv/.json cut list")
+    analyze_parser.add_argument("--silence-db", type=float, default=-40.0, help="Audio below this level (dBFS) counts as silence")
+    analyze_parser.add_argument("--min-silence", type=float, default=0.5, help="Shortest silence (seconds) to cut at")
+    analyze_parser.add_argument("--scene-threshold", type=float, default=0.15, help="Frame difference (0-1) that counts as a scene change")
+    analyze_parser.add_argument("--min-length", type=float, default=5.0, help="Shortest suggested clip (seconds)")
+    analyze_parser.add_argument("--max-length", type=float, default=60.0, help="Longest suggested clip (seconds)")
 
-    def extract_audio(self):
-        if not self.input_file:
-            messagebox.showerror("Error", "Please select a video file.")
-            return
+    serve_parser = subparsers.add_parser("serve", help="Run a render service with a watch folder and a local HTTP job API")
+    serve_parser.add_argument("--watch", help="Folder to pick up videos with a sidecar .json job spec from")
+    serve_parser.add_argument("--output-dir", default="renders", help="Where renders (and logs/ with one log per job) are written")
+    serve_parser.add_argument("--db", default="cutitout-jobs.sqlite", help="SQLite file the job queue is kept in across restarts")
+    serve_parser.add_argument("--workers", type=int, default=1, help="Number of jobs rendered at the same time")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address of the HTTP API (local only by default)")
+    serve_parser.add_argument("--port", type=int, default=8765)
 
-        output_dir = filedialog.askdirectory()
-        if not output_dir:
-            return
+    cache_parser = subparsers.add_parser("cache", help="Show statistics of the render cache or purge it")
+    cache_parser.add_argument("action", choices=["stats", "purge"])
+    cache_parser.add_argument("--max-mb", type=float, default=0, help="purge: evict least recently used renders only until the cache is below this size")
 
-        try:
-            with VideoFileClip(self.input_file) as video:
-                audio = video.audio
-                audio_output_path = os.path.join(output_dir, f"extracted_audio.{self.audio_format_var.get()}")
-                # Set the sample rate to 48kHz
-                audio.write_audiofile(audio_output_path, fps=48000)
+    parity_parser = subparsers.add_parser("parity", help="Render cut jobs with the MoviePy and the native ffmpeg backend and compare the frames")
+    parity_parser.add_argument("--input", help="Source video for the built-in test cases")
+    parity_parser.add_argument("--jobs", help="JSON jobs file (like batch) to compare instead of the built-in cases")
+    parity_parser.add_argument("--start", type=float, default=0.0)
+    parity_parser.add_argument("--end", type=float, default=3.0)
+    parity_parser.add_argument("--min-psnr", type=float, default=30.0, help="Lowest per-frame PSNR (dB) that still counts as a match")
+    parity_parser.add_argument("--min-audio-similarity", type=float, default=0.9, help="Lowest spectral similarity (0-1) of the two audio tracks that still counts as a match")
 
-            messagebox.showinfo("Success", f"Audio extracted successfully to {audio_output_path}!")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+    args = parser.parse_args(argv)
+    if args.command in ("batch", "extract-audio", "analyze", "parity") or (args.command == "bench" and args.target not in ("startup", "suite")):
+        load_media_stack()
 
+    if args.command == "batch":
+        results = run_batch(load_jobs(args.jobs_file), workers=args.workers, metrics_dir=args.metrics_dir)
+        return 0 if all(r["status"] == "ok" for r in results) else 1
 
-if __name__ == "__main__":
+    if args.command == "extract-audio":
+        files = collect_media_files(args.inputs, args.recursive)
+        if not files:
+            parser.error("no video files found")
+        jobs = [{**job, "skip_existing": not args.force} for job in audio_extraction_jobs(files, args.format, args.output_dir)]
+        results = run_batch(jobs, workers=args.workers)
+        return 0 if all(r["status"] == "ok" for r in results) else 1
+
+    if args.command == "bench":
+        if args.target == "segments":
+            if not args.input:
+                parser.error("bench segments needs --input")
+            bench_segmented_compress(args.input, args.segment_seconds, args.workers)
+        elif args.target == "pipeline":
+            if not args.input:
+                parser.error("bench pipeline needs --input")
+            bench_frame_pipeline(args.input, args.workers)
+        elif args.target == "startup":
+            bench_startup(args.input, args.runs or 5)
+        elif args.target == "suite":
+            return 0 if bench_suite(args.sizes, args.cases, args.seconds, args.runs or 1, args.baseline, args.save, args.threshold) else 1
+        else:
+            bench_frame_transform(frames=args.frames, rotation=args.rotation)
+        return 0
+
+    if args.command == "serve":
+        service = RenderService(args.db, args.output_dir, args.workers, args.watch)
+        service.start(args.host, args.port)
+
+        def stop_service(signum, frame):
+            raise KeyboardInterrupt
+
+        # Service managers stop with SIGTERM; shut down like on Ctrl+C
+        signal.signal(signal.SIGTERM, stop_service)
+        service.serve_forever()
+        return 0
+
+    if args.command == "cache":
+        if args.action == "purge":
+            print(f"Evicted {evict_render_cache(args.max_mb)} render(s)")
+        stats = render_cache_stats()
+        lookups = stats["hits"] + stats["misses"]
+        print(f"Render cache: {stats['entries']} render(s), {stats['size_mb']:.1f} / {stats['limit_mb']:.0f} MB in {cache_dir('renders')}")
+        print(f"{stats['hits']} hit(s), {stats['misses']} miss(es) ({stats['hits'] / lookups if lookups else 0:.0%} hit rate), {stats['evictions']} eviction(s), {stats['seconds_saved']:.0f}s of rendering saved")
+        return 0
+
+    if args.command == "analyze":
+        started = time.perf_counter()
+        analysis = analyze_media(args.input)
+        duration = probe_media(args.input)["duration"]
+        silences = find_silences(analysis, args.silence_db, args.min_silence)
+        changes = find_scene_changes(analysis, args.scene_threshold)
+        ranges = suggest_cut_list(analysis, duration, args.silence_db, args.min_silence, args.scene_threshold, args.min_length, args.max_length)
+        print(f"Analyzed {os.path.basename(args.input)} ({duration:.0f}s) in {time.perf_counter() - started:.1f}s")
+        print(f"{len(silences)} silence(s): " + ", ".join(f"{start:.2f}-{end:.2f}" for start, end in silences[:20]) + (" ..." if len(silences) > 20 else ""))
+        print(f"{len(changes)} scene change(s): " + ", ".join(f"{t:.2f}" for t in changes[:20]) + (" ..." if len(changes) > 20 else ""))
+        for cut in ranges:
+            print(f"{cut['name']:<16}{cut['start']:>10.2f}{cut['end']:>10.2f}")
+        if args.cut_list:
+            save_cut_list(args.cut_list, ranges)
+            print(f"Cut list written to {args.cut_list}")
+        return 0
+
+    if args.command == "parity":
+        if args.jobs:
+            jobs = load_jobs(args.jobs)
+        elif args.input:
+            base = {"input_file": args.input, "start_time": args.start, "end_time": args.end, "width": 720, "height": 1280, "framerate": round(probe_media(args.input)["fps"] or 30)}
+            jobs = [{**base, "name": name, **overrides} for name, overrides in PARITY_CASES]
+        else:
+            parser.error("parity needs --input or --jobs")
+        rows = check_backend_parity(jobs, args.min_psnr, args.min_audio_similarity)
+        return 0 if all(row[-1] for row in rows) else 1
+
+    if tk is None:
+        parser.error("tkinter/ttkbootstrap are not installed; only the batch command is available.")
     root = ttk.Window(themename="superhero")
     app = VideoCutterApp(root)
     root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    # Needed for the process pool in PyInstaller --onefile builds
+    multiprocessing.freeze_support()
+    sys.exit(main())